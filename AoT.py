@@ -6,7 +6,8 @@ import copy
 import numpy as np
 from scipy.special import comb
 
-from Attribute import Angle, Color, Number, Position, Size, Type, Uniformity
+import metrics
+from Attribute import Angle, Color, Number, Position, Size, Type, Uniformity, position_mask, slot_names
 from constraints import rule_constraint
 
 
@@ -14,6 +15,8 @@ class AoTNode:
     """Superclass of AoT.
     """
 
+    __slots__ = ("name", "level", "node_type", "children", "is_pg", "modified_attr")
+
     levels_next = {"Root": "Structure",
                    "Structure": "Component",
                    "Component": "Layout",
@@ -47,18 +50,26 @@ class AoTNode:
         assert node.level == self.levels_next[self.level]
         self.children.append(node)
 
-    def _resample(self, change_number):
+    def _resample(self, rng, change_number):
         """Resample the layout. If the number of entities change, resample also the
         position distribution; otherwise only resample each attribute for each entity.
         Arugments:
+            rng(numpy.random.Generator): source of randomness
             change_number(bool): whether to the number has been reset
         """
         assert self.is_pg
         if self.node_type == "and":
             for child in self.children:
-                child._resample(change_number)
+                child._resample(rng, change_number)
         else:
-            self.children[0]._resample(change_number)
+            self.children[0]._resample(rng, change_number)
+
+    def __copy__(self):
+        # copy.copy would go through the much slower __reduce_ex__ for classes with __slots__
+        new_node = object.__new__(self.__class__)
+        for name in slot_names(self.__class__):
+            setattr(new_node, name, getattr(self, name))
+        return new_node
 
     def __repr__(self):
         return self.level + "." + self.name
@@ -69,29 +80,38 @@ class AoTNode:
 
 class Root(AoTNode):
 
+    __slots__ = ("feasible_cache", "rule_table")
+
     def __init__(self, name, is_pg=False):
         super(Root, self).__init__(name, level="Root", node_type="or", is_pg=is_pg)
+        # (structure, component, rule group) -> whether the component has a feasible layout, see feasible
+        self.feasible_cache = dict()
+        # optional rule_table.RuleTable of the configuration, to draw feasible rules directly
+        self.rule_table = None
 
-    def sample(self):
+    def sample(self, rng):
         """The function returns a separate AoT that is correctly parsed.
         Note that a new node is needed so that modification does not alter settings
         in the original tree.
+        Arguments:
+            rng(numpy.random.Generator): source of randomness
         Returns:
             new_node(Root): a newly instantiated node
         """
         if self.is_pg:
             raise ValueError("Could not sample on a PG")
         new_node = Root(self.name, True)
-        selected = np.random.choice(self.children)
-        new_node.insert(selected._sample())
+        selected = self.children[rng.integers(len(self.children))]
+        new_node.insert(selected._sample(rng))
         return new_node
 
-    def resample(self, change_number=False):
-        self._resample(change_number)
+    def resample(self, rng, change_number=False):
+        self._resample(rng, change_number)
 
-    def prune(self, rule_groups):
+    def prune(self, rng, rule_groups):
         """Prune the AoT such that all branches satisfy the constraints.
         Arguments:
+            rng(numpy.random.Generator): source of randomness for the new layouts
             rule_groups(list of list of Rule): each list of Rule applies to a component
         Returns:
             new_node(Root): a newly instantiated node with branches all satisfying the constraints;
@@ -100,7 +120,7 @@ class Root(AoTNode):
         new_node = Root(self.name)
         for structure in self.children:
             if len(structure.children) == len(rule_groups):
-                new_child = structure._prune(rule_groups)
+                new_child = structure._prune(rng, rule_groups)
                 if new_child is not None:
                     new_node.insert(new_child)
         # during real execution, this should never happen
@@ -108,6 +128,32 @@ class Root(AoTNode):
             new_node = None
         return new_node
 
+    def feasible(self, rule_groups):
+        """Whether prune(rng, rule_groups) would keep any branch, without building the pruned tree.
+        A component is feasible if one of its layouts satisfies the constraints of its rule group.
+        This only depends on the name, attribute and value of each rule, so it is memoized on them.
+        Arguments:
+            rule_groups(list of list of Rule): each list of Rule applies to a component
+        Returns:
+            feasible(bool): whether some structure satisfies the constraints of all the rules
+        """
+        keys = [tuple((rule.name, rule.attr, rule.value) for rule in rule_group) for rule_group in rule_groups]
+        for i in range(len(self.children)):
+            structure = self.children[i]
+            if len(structure.children) != len(rule_groups):
+                continue
+            for j in range(len(structure.children)):
+                key = (i, j, keys[j])
+                feasible = self.feasible_cache.get(key)
+                if feasible is None:
+                    feasible = structure.children[j]._feasible(rule_groups[j])
+                    self.feasible_cache[key] = feasible
+                if not feasible:
+                    break
+            else:
+                return True
+        return False
+
     def prepare(self):
         """This function prepares the AoT for rendering.
         Returns:
@@ -127,9 +173,10 @@ class Root(AoTNode):
                     entities.append(child)
         return structure.name, entities
 
-    def sample_new(self, component_idx, attr_name, min_level, max_level, root):
+    def sample_new(self, rng, component_idx, attr_name, min_level, max_level, root):
         """Sample a new configuration. This is used for generating answers.
         Arguments:
+            rng(numpy.random.Generator): source of randomness
             component_idx(int): the component we will sample
             attr_name(str): name of the attribute to sample
             min_level(int): lower bound of value level for the attribute
@@ -137,93 +184,126 @@ class Root(AoTNode):
             root(AoTNode): the answer AoT, used for storing previous value levels for each attribute
         """
         assert self.is_pg
-        self.children[0]._sample_new(component_idx, attr_name, min_level, max_level, root.children[0])
+        self.children[0]._sample_new(rng, component_idx, attr_name, min_level, max_level, root.children[0])
 
-    def sample_new_value(self, component_idx, attr_name, min_level, max_level, attr_uni, mode_3):
+    def sample_new_value(self, rng, component_idx, attr_name, min_level, max_level, attr_uni, mode_3):
         assert self.is_pg
-        return self.children[0]._sample_new_value(component_idx, attr_name, min_level, max_level, attr_uni, mode_3)
+        return self.children[0]._sample_new_value(rng, component_idx, attr_name, min_level, max_level, attr_uni,
+                                                  mode_3)
 
-    def apply_new_value(self, component_idx, attr_name, value):
+    def apply_new_value(self, rng, component_idx, attr_name, value):
         assert self.is_pg
-        self.children[0]._apply_new_value(component_idx, attr_name, value)
+        self.children[0]._apply_new_value(rng, component_idx, attr_name, value)
 
         self.modified_attr.append([component_idx, attr_name])
 
+    def copy_component(self, component_idx):
+        """Copy the panel before modifying one of its components. Only that component is
+        deep-copied; the other components are shared with this panel and must not be modified.
+        Arguments:
+            component_idx(int): the component that will be modified
+        Returns:
+            new_node(Root): a new panel with an independent copy of the component
+        """
+        assert self.is_pg
+        structure = self.children[0]
+        new_structure = copy.copy(structure)
+        new_structure.children = list(structure.children)
+        new_structure.modified_attr = list(structure.modified_attr)
+        new_structure.children[component_idx] = copy.deepcopy(structure.children[component_idx])
+        new_node = copy.copy(self)
+        new_node.children = [new_structure]
+        new_node.modified_attr = list(self.modified_attr)
+        return new_node
+
 
 class Structure(AoTNode):
 
+    __slots__ = ()
+
     def __init__(self, name, is_pg=False):
         super(Structure, self).__init__(name, level="Structure", node_type="and", is_pg=is_pg)
 
-    def _sample(self):
+    def _sample(self, rng):
         if self.is_pg:
             raise ValueError("Could not sample on a PG")
         new_node = Structure(self.name, True)
         for child in self.children:
-            new_node.insert(child._sample())
+            new_node.insert(child._sample(rng))
         return new_node
 
-    def _prune(self, rule_groups):
+    def _prune(self, rng, rule_groups):
         new_node = Structure(self.name)
         for i in range(len(self.children)):
             child = self.children[i]
             # if any of the components fails to satisfy the constraint
             # the structure could not be chosen
-            new_child = child._prune(rule_groups[i])
+            new_child = child._prune(rng, rule_groups[i])
             if new_child is None:
                 return None
             new_node.insert(new_child)
         return new_node
 
-    def _sample_new(self, component_idx, attr_name, min_level, max_level, structure):
-        self.children[component_idx]._sample_new(attr_name, min_level, max_level, structure.children[component_idx])
+    def _sample_new(self, rng, component_idx, attr_name, min_level, max_level, structure):
+        self.children[component_idx]._sample_new(rng, attr_name, min_level, max_level,
+                                                 structure.children[component_idx])
 
-    def _sample_new_value(self, component_idx, attr_name, min_level, max_level, attr_uni, mode_3):
-        return self.children[component_idx]._sample_new_value(attr_name, min_level, max_level, attr_uni, mode_3)
+    def _sample_new_value(self, rng, component_idx, attr_name, min_level, max_level, attr_uni, mode_3):
+        return self.children[component_idx]._sample_new_value(rng, attr_name, min_level, max_level, attr_uni,
+                                                              mode_3)
 
-    def _apply_new_value(self, component_idx, attr_name, value):
-        self.children[component_idx]._apply_new_value(attr_name, value)
+    def _apply_new_value(self, rng, component_idx, attr_name, value):
+        self.children[component_idx]._apply_new_value(rng, attr_name, value)
 
 
 class Component(AoTNode):
 
+    __slots__ = ()
+
     def __init__(self, name, is_pg=False):
         super(Component, self).__init__(name, level="Component", node_type="or", is_pg=is_pg)
 
-    def _sample(self):
+    def _sample(self, rng):
         if self.is_pg:
             raise ValueError("Could not sample on a PG")
         new_node = Component(self.name, True)
-        selected = np.random.choice(self.children)
-        new_node.insert(selected._sample())
+        selected = self.children[rng.integers(len(self.children))]
+        new_node.insert(selected._sample(rng))
         return new_node
 
-    def _prune(self, rule_group):
+    def _prune(self, rng, rule_group):
         new_node = Component(self.name)
         for child in self.children:
-            new_child = child._update_constraint(rule_group)
+            new_child = child._update_constraint(rng, rule_group)
             if new_child is not None:
                 new_node.insert(new_child)
         if len(new_node.children) == 0:
             new_node = None
         return new_node
 
-    def _sample_new(self, attr_name, min_level, max_level, component):
-        self.children[0]._sample_new(attr_name, min_level, max_level, component.children[0])
+    def _feasible(self, rule_group):
+        return any(child._rule_constraint(rule_group) is not None for child in self.children)
+
+    def _sample_new(self, rng, attr_name, min_level, max_level, component):
+        self.children[0]._sample_new(rng, attr_name, min_level, max_level, component.children[0])
 
-    def _sample_new_value(self, attr_name, min_level, max_level, attr_uni, mode_3):
-        return self.children[0]._sample_new_value(attr_name, min_level, max_level, attr_uni, mode_3)
+    def _sample_new_value(self, rng, attr_name, min_level, max_level, attr_uni, mode_3):
+        return self.children[0]._sample_new_value(rng, attr_name, min_level, max_level, attr_uni, mode_3)
 
-    def _apply_new_value(self, attr_name, value):
-        self.children[0]._apply_new_value(attr_name, value)
+    def _apply_new_value(self, rng, attr_name, value):
+        self.children[0]._apply_new_value(rng, attr_name, value)
 
 
 class Layout(AoTNode):
     """Layout is the highest level of the hierarchy that has attributes (Number, Position and Uniformity).
     To copy a Layout, please use deepcopy such that newly instantiated and separated attributes are created.
+    The constraint dicts are never modified in place and are shared between copies.
     """
 
-    def __init__(self, name, layout_constraint, entity_constraint,
+    __slots__ = ("layout_constraint", "entity_constraint", "number", "position", "uniformity",
+                 "orig_layout_constraint", "orig_entity_constraint", "sample_new_num_count", "num_count")
+
+    def __init__(self, name, layout_constraint, entity_constraint, rng,
                  orig_layout_constraint=None, orig_entity_constraint=None,
                  sample_new_num_count=None, is_pg=False):
         super(Layout, self).__init__(name, level="Layout", node_type="and", is_pg=is_pg)
@@ -232,9 +312,9 @@ class Layout(AoTNode):
         self.number = Number(min_level=layout_constraint["Number"][0], max_level=layout_constraint["Number"][1])
         self.position = Position(pos_type=layout_constraint["Position"][0], pos_list=layout_constraint["Position"][1])
         self.uniformity = Uniformity(min_level=layout_constraint["Uni"][0], max_level=layout_constraint["Uni"][1])
-        self.number.sample()
-        self.position.sample(self.number.get_value())
-        self.uniformity.sample()
+        self.number.sample(rng)
+        self.position.sample(rng, self.number.get_value())
+        self.uniformity.sample(rng)
         # store initial layout_constraint and entity_constraint for answer generation
         if orig_layout_constraint is None:
             self.orig_layout_constraint = copy.deepcopy(self.layout_constraint)
@@ -248,21 +328,34 @@ class Layout(AoTNode):
             self.sample_new_num_count = dict()
             most_num = len(self.position.values)
             for i in range(layout_constraint["Number"][0], layout_constraint["Number"][1] + 1):
-                self.sample_new_num_count[i] = [comb(most_num, i + 1, exact=True), []]
+                self.sample_new_num_count[i] = [comb(most_num, i + 1, exact=True), set()]
         else:
             self.sample_new_num_count = sample_new_num_count
         self.num_count = dict()
         for i in list(self.sample_new_num_count.keys()):
             self.num_count[i] = 1
 
+    def __deepcopy__(self, memo):
+        new_node = copy.copy(self)
+        new_node.children = [copy.deepcopy(child, memo) for child in self.children]
+        new_node.modified_attr = list(self.modified_attr)
+        new_node.number = copy.deepcopy(self.number, memo)
+        new_node.position = copy.deepcopy(self.position, memo)
+        new_node.uniformity = copy.deepcopy(self.uniformity, memo)
+        new_node.num_count = dict(self.num_count)
+        new_node.sample_new_num_count = dict((i, [count, set(sampled)])
+                                             for i, (count, sampled) in self.sample_new_num_count.items())
+        return new_node
+
     def reset_num_count(self):
         for i in list(self.num_count.keys()):
             if self.sample_new_num_count[i][0] > 0:
                 self.num_count[i] = 1
 
-    def add_new(self, *bboxes):
+    def add_new(self, rng, *bboxes):
         """Add new entities into this level.
         Arguments:
+            rng(numpy.random.Generator): source of randomness
             *bboxes(tuple of bbox): bboxes of new entities
         """
         name = self.number.get_value()
@@ -274,13 +367,13 @@ class Layout(AoTNode):
             new_entity.name = str(name)
             new_entity.bbox = bbox
             if not uni:
-                new_entity.resample()
+                new_entity.resample(rng)
             self._insert(new_entity)
 
-    def resample(self, change_number=False):
-        self._resample(change_number)
+    def resample(self, rng, change_number=False):
+        self._resample(rng, change_number)
 
-    def _sample(self):
+    def _sample(self, rng):
         """Though Layout is an "and" node, we do not enumerate all possible configurations, but rather
         we treat it as a sampling process such that different configurtions are sampled. After the
         sampling, the lower level Entities are instantiated.
@@ -291,7 +384,7 @@ class Layout(AoTNode):
         new_node = copy.deepcopy(self)
         new_node.is_pg = True
         if self.uniformity.get_value():
-            node = Entity(name=str(0), bbox=pos[0], entity_constraint=self.entity_constraint)
+            node = Entity(name=str(0), bbox=pos[0], entity_constraint=self.entity_constraint, rng=rng)
             new_node._insert(node)
             for i in range(1, len(pos)):
                 bbox = pos[i]
@@ -302,23 +395,24 @@ class Layout(AoTNode):
         else:
             for i in range(len(pos)):
                 bbox = pos[i]
-                node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint)
+                node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint, rng=rng)
                 new_node._insert(node)
         return new_node
 
-    def _resample(self, change_number):
+    def _resample(self, rng, change_number):
         """Resample each attribute for every child.
         This function is called across rows.
         Arguments:
+            rng(numpy.random.Generator): source of randomness
             change_number(bool): whether to resample a number
         """
         if change_number:
-            self.number.sample()
+            self.number.sample(rng)
         del self.children[:]
-        self.position.sample(self.number.get_value())
+        self.position.sample(rng, self.number.get_value())
         pos = self.position.get_value()
         if self.uniformity.get_value():
-            node = Entity(name=str(0), bbox=pos[0], entity_constraint=self.entity_constraint)
+            node = Entity(name=str(0), bbox=pos[0], entity_constraint=self.entity_constraint, rng=rng)
             self._insert(node)
             for i in range(1, len(pos)):
                 bbox = pos[i]
@@ -329,17 +423,34 @@ class Layout(AoTNode):
         else:
             for i in range(len(pos)):
                 bbox = pos[i]
-                node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint)
+                node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint, rng=rng)
                 self._insert(node)
 
-    def _update_constraint(self, rule_group):
+    def _update_constraint(self, rng, rule_group):
         """Update the constraint of the layout. If one constraint is not satisfied, return None
         such that this structure is disgarded.
         Arguments:
+            rng(numpy.random.Generator): source of randomness for the new layout
             rule_group(list of Rule): all rules to apply to this layout
         Returns:
             Layout(Layout): a new Layout node with independent attributes
         """
+        new_constraints = self._rule_constraint(rule_group)
+        if new_constraints is None:
+            return None
+        new_layout_constraint, new_entity_constraint = new_constraints
+        return Layout(self.name, new_layout_constraint, new_entity_constraint, rng,
+                      self.orig_layout_constraint, self.orig_entity_constraint,
+                      self.sample_new_num_count)
+
+    def _rule_constraint(self, rule_group):
+        """Constraints of the layout under the rules.
+        Arguments:
+            rule_group(list of Rule): all rules to apply to this layout
+        Returns:
+            layout_constraint(dict), entity_constraint(dict): the new constraints;
+                None if one constraint is not satisfied
+        """
         num_min = self.layout_constraint["Number"][0]
         num_max = self.layout_constraint["Number"][1]
         uni_min = self.layout_constraint["Uni"][0]
@@ -388,9 +499,7 @@ class Layout(AoTNode):
         new_entity_constraint["Type"][:] = [new_type_min, new_type_max]
         new_entity_constraint["Size"][:] = [new_size_min, new_size_max]
         new_entity_constraint["Color"][:] = [new_color_min, new_color_max]
-        return Layout(self.name, new_layout_constraint, new_entity_constraint,
-                      self.orig_layout_constraint, self.orig_entity_constraint,
-                      self.sample_new_num_count)
+        return new_layout_constraint, new_entity_constraint
 
     def reset_constraint(self, attr):
         attr_name = attr.lower()
@@ -400,31 +509,25 @@ class Layout(AoTNode):
         assert isinstance(instance.min_level, (int, np.int64))
         assert isinstance(instance.max_level, (int, np.int64))
 
-    def _sample_new(self, attr_name, min_level, max_level, layout):
+    def _sample_new(self, rng, attr_name, min_level, max_level, layout):
         if attr_name == "Number":
-            while True:
-                value_level = self.number.sample_new(min_level, max_level)
-                if layout.sample_new_num_count[value_level][0] == 0:
-                    continue
-                new_num = self.number.get_value(value_level)
-                new_value_idx = self.position.sample_new(new_num)
-                set_new_value_idx = set(new_value_idx)
-                if set_new_value_idx not in layout.sample_new_num_count[value_level][1]:
-                    layout.sample_new_num_count[value_level][0] -= 1
-                    layout.sample_new_num_count[value_level][1].append(set_new_value_idx)
-                    break
+            levels = [level for level in range(min_level, max_level + 1)
+                      if level != self.number.get_value_level() and layout.sample_new_num_count[level][0] > 0]
+            value_level = self._sample_new_number_level(rng, min_level, max_level, levels)
+            new_value_idx = self._sample_new_number_positions(rng, layout.sample_new_num_count.get(value_level),
+                                                              self.number.get_value(value_level))
             self.number.set_value_level(value_level)
             self.position.set_value_idx(new_value_idx)
             pos = self.position.get_value()
             del self.children[:]
             for i in range(len(pos)):
                 bbox = pos[i]
-                node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint)
+                node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint, rng=rng)
                 self._insert(node)
 
         elif attr_name == "Position":
-            new_value_idx = self.position.sample_new(self.number.get_value())
-            layout.position.previous_values.append(new_value_idx)
+            new_value_idx = self.position.sample_new(rng, self.number.get_value())
+            layout.position.previous_values.append(position_mask(new_value_idx))
             self.position.set_value_idx(new_value_idx)
             pos = self.position.get_value()
             # --- 关键修复：如位置基数变化，重建 children；否则逐一更新 bbox ---
@@ -432,7 +535,7 @@ class Layout(AoTNode):
                 del self.children[:]
                 for i in range(len(pos)):
                     bbox = pos[i]
-                    node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint)
+                    node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint, rng=rng)
                     self._insert(node)
             else:
                 for i in range(len(pos)):
@@ -442,83 +545,110 @@ class Layout(AoTNode):
 
         elif attr_name == "Type":
             for index in range(len(self.children)):
-                new_value_level = self.children[index].type.sample_new(min_level, max_level)
+                new_value_level = self.children[index].type.sample_new(rng, min_level, max_level)
                 self.children[index].type.set_value_level(new_value_level)
                 layout.children[index].type.previous_values.append(new_value_level)
 
         elif attr_name == "Size":
             for index in range(len(self.children)):
-                new_value_level = self.children[index].size.sample_new(min_level, max_level)
+                new_value_level = self.children[index].size.sample_new(rng, min_level, max_level)
                 self.children[index].size.set_value_level(new_value_level)
                 layout.children[index].size.previous_values.append(new_value_level)
 
         elif attr_name == "Color":
             for index in range(len(self.children)):
-                new_value_level = self.children[index].color.sample_new(min_level, max_level)
+                new_value_level = self.children[index].color.sample_new(rng, min_level, max_level)
                 self.children[index].color.set_value_level(new_value_level)
                 layout.children[index].color.previous_values.append(new_value_level)
 
         else:
             raise ValueError("Unsupported operation")
 
-    def _sample_new_value(self, attr_name, min_level, max_level, attr_uni, mode_3):
+    def _sample_new_value(self, rng, attr_name, min_level, max_level, attr_uni, mode_3):
 
         ret = []
         if attr_name == "Number":
             previous_num = self.number.get_value()
-            while True:
-                value_level = self.number.sample_new(min_level, max_level)
-                if mode_3 == '3-Position-Number' and self.sample_new_num_count[value_level][0] == 1:
-                    continue
-                if self.num_count[value_level] == 1:
-                    self.num_count[value_level] = 0
-                    break
+            # 3-Position-Number 模式需要同一 level 下两个未用过的位置组合
+            t = 1
+            if mode_3 == '3-Position-Number':
+                t += 1
+            levels = self._unused_number_levels(min_level, max_level, t)
+            if not levels:
+                # every level was drawn since the last reset, start a new round
+                self.reset_num_count()
+                levels = self._unused_number_levels(min_level, max_level, t)
+            value_level = self._sample_new_number_level(rng, min_level, max_level, levels)
+            self.num_count[value_level] = 0
             new_num = self.number.get_value(value_level)
 
             if not self.children:  # If no children, can't select from them
                 select = []
             elif previous_num >= new_num:
-                select = list(np.random.choice(previous_num, new_num, replace=False))
+                select = list(rng.choice(previous_num, new_num, replace=False))
             else:
                 select = list(range(previous_num)) + list(
-                    np.random.choice(previous_num, new_num - previous_num, replace=True))
+                    rng.choice(previous_num, new_num - previous_num, replace=True))
 
             ret = [value_level, select]
-
-            t = 1
-            if mode_3 == '3-Position-Number':
-                t += 1
             for i in range(t):
-                while True:
-                    new_value_idx = self.position.sample_new(new_num)
-                    set_new_value_idx = set(new_value_idx)
-                    if set_new_value_idx not in self.sample_new_num_count[value_level][1]:
-                        self.sample_new_num_count[value_level][0] -= 1
-                        self.sample_new_num_count[value_level][1].append(set_new_value_idx)
-                        ret.append(new_value_idx)
-                        break
+                ret.append(self._sample_new_number_positions(rng, self.sample_new_num_count.get(value_level), new_num))
             if sum(self.num_count.values()) == 1:
                 self.reset_num_count()
 
         elif attr_name == "Position":
-            new_value_idx = self.position.sample_new(self.number.get_value())
+            new_value_idx = self.position.sample_new(rng, self.number.get_value())
             ret = [new_value_idx]
 
         elif attr_name in ["Type", "Size", "Color"]:
             if not self.children:
                 return []
             if attr_uni:
-                new_value_level = getattr(self.children[0], attr_name.lower()).sample_new(min_level, max_level)
+                new_value_level = getattr(self.children[0], attr_name.lower()).sample_new(rng, min_level, max_level)
                 ret = [new_value_level]
             else:
                 for index in range(len(self.children)):
-                    new_value_level = getattr(self.children[index], attr_name.lower()).sample_new(min_level, max_level)
+                    new_value_level = getattr(self.children[index], attr_name.lower()).sample_new(rng, min_level, max_level)
                     ret.append(new_value_level)
         else:
             raise ValueError("Unsupported operation")
         return ret
 
-    def _apply_new_value(self, attr_name, value):
+    def _unused_number_levels(self, min_level, max_level, t):
+        """The Number levels other than the current one not drawn since the last reset_num_count,
+        with at least t position sets left in sample_new_num_count.
+        """
+        return [level for level in range(min_level, max_level + 1)
+                if level != self.number.get_value_level() and self.num_count.get(level) == 1 and
+                self.sample_new_num_count[level][0] >= t]
+
+    def _sample_new_number_level(self, rng, min_level, max_level, levels):
+        """Draw a new Number level uniformly among the admissible levels, as a rejection loop
+        over Number.sample_new would, in a single draw. If none is admissible, the pool of
+        new (level, position set) pairs is exhausted and any other level is drawn.
+        """
+        if not levels:
+            metrics.count("number_exhausted")
+            return self.number.sample_new(rng, min_level, max_level)
+        if len(levels) == 1:
+            metrics.count("number_levels_low")
+        return self.number.sample_new(rng, min_level, max_level, allowed=levels)
+
+    def _sample_new_number_positions(self, rng, pool, new_num):
+        """Draw a position set of new_num entities not in the pool of its level, an entry
+        [count, masks] of sample_new_num_count, and record it there. Without a set left in the
+        pool, the set is only kept different from the current one.
+        """
+        if pool is None or pool[0] <= 0:
+            return self.position.sample_new(rng, new_num)
+        if pool[0] == 1:
+            metrics.count("number_positions_low")
+        new_value_idx = self.position.sample_new(rng, new_num, used=pool[1])
+        pool[0] -= 1
+        pool[1].add(position_mask(new_value_idx))
+        return new_value_idx
+
+    def _apply_new_value(self, rng, attr_name, value):
         if not value:
             return
         L = len(value)
@@ -537,7 +667,7 @@ class Layout(AoTNode):
             if self.uniformity.get_value():
                 # If uniform, all new entities are the same
                 if pos:  # Ensure there is at least one position
-                    node = Entity(name=str(0), bbox=pos[0], entity_constraint=self.entity_constraint)
+                    node = Entity(name=str(0), bbox=pos[0], entity_constraint=self.entity_constraint, rng=rng)
                     self._insert(node)
                     for i in range(1, len(pos)):
                         bbox = pos[i]
@@ -549,7 +679,7 @@ class Layout(AoTNode):
                 # If not uniform, create a new random entity for each position
                 for i in range(len(pos)):
                     bbox = pos[i]
-                    node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint)
+                    node = Entity(name=str(i), bbox=bbox, entity_constraint=self.entity_constraint, rng=rng)
                     self._insert(node)
 
         elif attr_name == "Position":
@@ -578,7 +708,9 @@ class Layout(AoTNode):
 
 class Entity(AoTNode):
 
-    def __init__(self, name, bbox, entity_constraint):
+    __slots__ = ("entity_constraint", "bbox", "type", "size", "color", "angle")
+
+    def __init__(self, name, bbox, entity_constraint, rng):
         super(Entity, self).__init__(name, level="Entity", node_type="leaf", is_pg=True)
         # Attributes
         # Sample each attribute such that the value lies in the admissible range
@@ -586,25 +718,38 @@ class Entity(AoTNode):
         self.entity_constraint = entity_constraint
         self.bbox = bbox
         self.type = Type(min_level=entity_constraint["Type"][0], max_level=entity_constraint["Type"][1])
-        self.type.sample()
+        self.type.sample(rng)
         self.size = Size(min_level=entity_constraint["Size"][0], max_level=entity_constraint["Size"][1])
-        self.size.sample()
+        self.size.sample(rng)
         self.color = Color(min_level=entity_constraint["Color"][0], max_level=entity_constraint["Color"][1])
-        self.color.sample()
+        self.color.sample(rng)
         self.angle = Angle(min_level=entity_constraint["Angle"][0], max_level=entity_constraint["Angle"][1])
-        self.angle.sample()
+        self.angle.sample(rng)
+
+    def __deepcopy__(self, memo):
+        # bbox and entity_constraint are shared, see reset_constraint
+        new_node = copy.copy(self)
+        new_node.children = []
+        new_node.modified_attr = list(self.modified_attr)
+        new_node.type = copy.deepcopy(self.type, memo)
+        new_node.size = copy.deepcopy(self.size, memo)
+        new_node.color = copy.deepcopy(self.color, memo)
+        new_node.angle = copy.deepcopy(self.angle, memo)
+        return new_node
 
     def reset_constraint(self, attr, min_level, max_level):
         assert isinstance(min_level, (int, np.int64))
         assert isinstance(max_level, (int, np.int64))
         attr_name = attr.lower()
-        self.entity_constraint[attr][:] = [min_level, max_level]
+        # the constraint may be shared with copies of this entity, replace it instead of writing into it
+        self.entity_constraint = dict(self.entity_constraint)
+        self.entity_constraint[attr] = [min_level, max_level]
         instance = getattr(self, attr_name)
         instance.min_level = min_level
         instance.max_level = max_level
 
-    def resample(self):
-        self.type.sample()
-        self.size.sample()
-        self.color.sample()
-        self.angle.sample()
\ No newline at end of file
+    def resample(self, rng):
+        self.type.sample(rng)
+        self.size.sample(rng)
+        self.color.sample(rng)
+        self.angle.sample(rng)
\ No newline at end of file
@@ -1,25 +1,81 @@
 # -*- coding: utf-8 -*-
 
 
+import copy
+import functools
+import math
+
 import numpy as np
 
 from const import (ANGLE_MAX, ANGLE_MIN, ANGLE_VALUES, COLOR_MAX, COLOR_MIN,
                    COLOR_VALUES, NUM_MAX, NUM_MIN, NUM_VALUES, SIZE_MAX,
                    SIZE_MIN, SIZE_VALUES, TYPE_MAX, TYPE_MIN, TYPE_VALUES,
                    UNI_MAX, UNI_MIN, UNI_VALUES)
+import metrics
+
+
+@functools.lru_cache(maxsize=None)
+def slot_names(cls):
+    """All the __slots__ of a class, including the inherited ones.
+    """
+    return tuple(name for klass in cls.__mro__ for name in getattr(klass, "__slots__", ()))
+
+
+def position_mask(value_idx):
+    """Canonical form of a position configuration: bit i is set if position i is occupied.
+    Two configurations are the same set of positions if and only if their masks are equal.
+    """
+    mask = 0
+    for idx in value_idx:
+        mask |= 1 << int(idx)
+    return mask
+
+
+def mask_positions(mask):
+    """Indices of the occupied positions of a mask, in increasing order.
+    """
+    return np.array([idx for idx in range(mask.bit_length()) if mask >> idx & 1], np.int64)
+
+
+def combination_rank(mask):
+    """Rank of a position mask in the colex order of the masks with the same number of
+    positions: sum of C(idx, i + 1) over its i-th smallest position idx.
+    """
+    rank = 0
+    for i, idx in enumerate(mask_positions(mask)):
+        rank += math.comb(int(idx), i + 1)
+    return rank
+
+
+def combination_unrank(rank, num, length):
+    """Inverse of combination_rank: the mask of num positions out of length with that rank.
+    """
+    mask = 0
+    idx = length - 1
+    for i in range(num, 0, -1):
+        while math.comb(idx, i) > rank:
+            idx -= 1
+        rank -= math.comb(idx, i)
+        mask |= 1 << idx
+        idx -= 1
+    return mask
 
 
 class Attribute:
     """Super-class for all attributes. This should not be instantiated.
+    All sampling methods draw from the numpy.random.Generator passed as rng.
+    Value tables and value_idx arrays are never modified in place, so copies share them.
     """
 
+    __slots__ = ("name", "level", "previous_values")
+
     def __init__(self, name):
         self.name = name
         self.level = "Attribute"
         # memory to store previous values
         self.previous_values = []
 
-    def sample(self):
+    def sample(self, rng):
         pass
 
     def get_value(self):
@@ -28,6 +84,18 @@ class Attribute:
     def set_value(self):
         pass
 
+    def __copy__(self):
+        # copy.copy would go through the much slower __reduce_ex__ for classes with __slots__
+        new_attr = object.__new__(self.__class__)
+        for name in slot_names(self.__class__):
+            setattr(new_attr, name, getattr(self, name))
+        return new_attr
+
+    def __deepcopy__(self, memo):
+        new_attr = copy.copy(self)
+        new_attr.previous_values = list(self.previous_values)
+        return new_attr
+
     def __repr__(self):
         return self.level + "." + self.name
 
@@ -37,6 +105,8 @@ class Attribute:
 
 class Number(Attribute):
 
+    __slots__ = ("value_level", "values", "min_level", "max_level")
+
     def __init__(self, min_level=NUM_MIN, max_level=NUM_MAX):
         super(Number, self).__init__("Number")
         self.value_level = 0
@@ -44,16 +114,21 @@ class Number(Attribute):
         self.min_level = min_level
         self.max_level = max_level
 
-    def sample(self, min_level=NUM_MIN, max_level=NUM_MAX):
+    def sample(self, rng, min_level=NUM_MIN, max_level=NUM_MAX):
         min_level = max(self.min_level, min_level)
         max_level = min(self.max_level, max_level)
-        self.value_level = np.random.choice(list(range(min_level, max_level + 1)))
+        self.value_level = rng.choice(list(range(min_level, max_level + 1)))
 
-    def sample_new(self, min_level=None, max_level=None, previous_values=None):
+    def sample_new(self, rng, min_level=None, max_level=None, previous_values=None, allowed=None):
+        """Sample a new level, different from the current one and from the previous values if any
+        is left. With allowed, only the levels in it are drawn.
+        """
         if min_level is None or max_level is None:
             values = list(range(self.min_level, self.max_level + 1))
         else:
             values = list(range(min_level, max_level + 1))
+        if allowed is not None:
+            values = [value for value in values if value in allowed]
         if not previous_values:
             available = set(values) - set(self.previous_values) - {self.value_level}
         else:
@@ -64,7 +139,7 @@ class Number(Attribute):
         if not available:  # 极不可能，但作为保险
             available = set(values)
 
-        new_idx = np.random.choice(list(available))
+        new_idx = rng.choice(list(available))
         return new_idx
 
     def get_value_level(self):
@@ -81,6 +156,8 @@ class Number(Attribute):
 
 class Type(Attribute):
 
+    __slots__ = ("value_level", "values", "min_level", "max_level")
+
     def __init__(self, min_level=TYPE_MIN, max_level=TYPE_MAX):
         super(Type, self).__init__("Type")
         self.value_level = 0
@@ -88,12 +165,12 @@ class Type(Attribute):
         self.min_level = min_level
         self.max_level = max_level
 
-    def sample(self, min_level=TYPE_MIN, max_level=TYPE_MAX):
+    def sample(self, rng, min_level=TYPE_MIN, max_level=TYPE_MAX):
         min_level = max(self.min_level, min_level)
         max_level = min(self.max_level, max_level)
-        self.value_level = np.random.choice(list(range(min_level, max_level + 1)))
+        self.value_level = rng.choice(list(range(min_level, max_level + 1)))
 
-    def sample_new(self, min_level=None, max_level=None, previous_values=None):
+    def sample_new(self, rng, min_level=None, max_level=None, previous_values=None):
         if min_level is None or max_level is None:
             values = list(range(self.min_level, self.max_level + 1))
         else:
@@ -106,7 +183,7 @@ class Type(Attribute):
         if not available: available = set(values) - {self.value_level}
         if not available: available = set(values)
 
-        new_idx = np.random.choice(list(available))
+        new_idx = rng.choice(list(available))
         return new_idx
 
     def get_value_level(self):
@@ -123,6 +200,8 @@ class Type(Attribute):
 
 class Size(Attribute):
 
+    __slots__ = ("value_level", "values", "min_level", "max_level")
+
     def __init__(self, min_level=SIZE_MIN, max_level=SIZE_MAX):
         super(Size, self).__init__("Size")
         self.value_level = 3
@@ -130,12 +209,12 @@ class Size(Attribute):
         self.min_level = min_level
         self.max_level = max_level
 
-    def sample(self, min_level=SIZE_MIN, max_level=SIZE_MAX):
+    def sample(self, rng, min_level=SIZE_MIN, max_level=SIZE_MAX):
         min_level = max(self.min_level, min_level)
         max_level = min(self.max_level, max_level)
-        self.value_level = np.random.choice(list(range(min_level, max_level + 1)))
+        self.value_level = rng.choice(list(range(min_level, max_level + 1)))
 
-    def sample_new(self, min_level=None, max_level=None, previous_values=None):
+    def sample_new(self, rng, min_level=None, max_level=None, previous_values=None):
         if min_level is None or max_level is None:
             values = list(range(self.min_level, self.max_level + 1))
         else:
@@ -148,7 +227,7 @@ class Size(Attribute):
         if not available: available = set(values) - {self.value_level}
         if not available: available = set(values)
 
-        new_idx = np.random.choice(list(available))
+        new_idx = rng.choice(list(available))
         return new_idx
 
     def get_value_level(self):
@@ -165,6 +244,8 @@ class Size(Attribute):
 
 class Color(Attribute):
 
+    __slots__ = ("value_level", "values", "min_level", "max_level")
+
     def __init__(self, min_level=COLOR_MIN, max_level=COLOR_MAX):
         super(Color, self).__init__("Color")
         self.value_level = 0
@@ -172,12 +253,12 @@ class Color(Attribute):
         self.min_level = min_level
         self.max_level = max_level
 
-    def sample(self, min_level=COLOR_MIN, max_level=COLOR_MAX):
+    def sample(self, rng, min_level=COLOR_MIN, max_level=COLOR_MAX):
         min_level = max(self.min_level, min_level)
         max_level = min(self.max_level, max_level)
-        self.value_level = np.random.choice(list(range(min_level, max_level + 1)))
+        self.value_level = rng.choice(list(range(min_level, max_level + 1)))
 
-    def sample_new(self, min_level=None, max_level=None, previous_values=None):
+    def sample_new(self, rng, min_level=None, max_level=None, previous_values=None):
         if min_level is None or max_level is None:
             values = list(range(self.min_level, self.max_level + 1))
         else:
@@ -190,7 +271,7 @@ class Color(Attribute):
         if not available: available = set(values) - {self.value_level}
         if not available: available = set(values)
 
-        new_idx = np.random.choice(list(available))
+        new_idx = rng.choice(list(available))
         return new_idx
 
     def get_value_level(self):
@@ -209,6 +290,8 @@ class Color(Attribute):
 
 class Angle(Attribute):
 
+    __slots__ = ("value_level", "values", "min_level", "max_level")
+
     def __init__(self, min_level=ANGLE_MIN, max_level=ANGLE_MAX):
         super(Angle, self).__init__("Angle")
         self.value_level = 3
@@ -216,12 +299,12 @@ class Angle(Attribute):
         self.min_level = min_level
         self.max_level = max_level
 
-    def sample(self, min_level=ANGLE_MIN, max_level=ANGLE_MAX):
+    def sample(self, rng, min_level=ANGLE_MIN, max_level=ANGLE_MAX):
         min_level = max(self.min_level, min_level)
         max_level = min(self.max_level, max_level)
-        self.value_level = np.random.choice(list(range(min_level, max_level + 1)))
+        self.value_level = rng.choice(list(range(min_level, max_level + 1)))
 
-    def sample_new(self, min_level=None, max_level=None, previous_values=None):
+    def sample_new(self, rng, min_level=None, max_level=None, previous_values=None):
         if min_level is None or max_level is None:
             values = list(range(self.min_level, self.max_level + 1))
         else:
@@ -234,7 +317,7 @@ class Angle(Attribute):
         if not available: available = set(values) - {self.value_level}
         if not available: available = set(values)
 
-        new_idx = np.random.choice(list(available))
+        new_idx = rng.choice(list(available))
         return new_idx
 
     def get_value_level(self):
@@ -251,6 +334,8 @@ class Angle(Attribute):
 
 class Uniformity(Attribute):
 
+    __slots__ = ("value_level", "values", "min_level", "max_level")
+
     def __init__(self, min_level=UNI_MIN, max_level=UNI_MAX):
         super(Uniformity, self).__init__("Uniformity")
         self.value_level = 0
@@ -258,10 +343,10 @@ class Uniformity(Attribute):
         self.min_level = min_level
         self.max_level = max_level
 
-    def sample(self):
-        self.value_level = np.random.choice(list(range(self.min_level, self.max_level + 1)))
+    def sample(self, rng):
+        self.value_level = rng.choice(list(range(self.min_level, self.max_level + 1)))
 
-    def sample_new(self):
+    def sample_new(self, rng):
         # Should not resample uniformity
         pass
 
@@ -281,6 +366,8 @@ class Position(Attribute):
     """Position is a special case.
     """
 
+    __slots__ = ("pos_type", "values", "value_idx", "value_mask", "isChanged")
+
     def __init__(self, pos_type, pos_list):
         super(Position, self).__init__("Position")
         # planar: [x_c, y_c, max_w, max_h]
@@ -289,53 +376,64 @@ class Position(Attribute):
         self.pos_type = pos_type
         self.values = pos_list
         self.value_idx = None
+        # position_mask of value_idx, kept in sync by every method that changes it
+        self.value_mask = 0
         self.isChanged = False
 
-    def sample(self, num):
+    def sample(self, rng, num):
         length = len(self.values)
         if num > length:
             # 如果请求的数量大于可用槽位 (例如 num=9, length=4), 则使用所有槽位
             num = length
-        self.value_idx = np.random.choice(list(range(length)), num, False)
-
-    # --- 修复：使用 cwhy/i-raven 的鲁棒循环来防止死锁 ---
-    def sample_new(self, num, previous_values=None):
-        # Here sample new relies on probability
+        self.set_value_idx(rng.choice(list(range(length)), num, False))
+
+    def sample_new(self, rng, num, previous_values=None, used=()):
+        """Sample a configuration of num positions, different from the current one and from the
+        previous values if any is left. Always terminates, in a single draw.
+        The position masks in used are never drawn, even when every other configuration was;
+        at least one configuration of num positions must be left out of them.
+        Returns:
+            new_value_idx(np.ndarray): the new positions, in increasing order
+        """
         length = len(self.values)
-        if num > length: num = length  # 确保 num 不大于 length
+        num = int(min(num, length))  # 确保 num 不大于 length
 
+        # previous values are kept as position masks
         if not previous_values:
-            constraints = self.previous_values
+            constraints = set(self.previous_values)
         else:
-            constraints = previous_values
-
-        # 尝试50次，如果50次都找不到新组合（极不可能，除非 num=length）
-        # 就跳出循环并返回最后一次尝试
-        for _ in range(50):
-            finished = True
-            new_value_idx = np.random.choice(length, num, False)
-            if set(new_value_idx) == set(self.value_idx):
-                continue
-            for previous_value in constraints:
-                if set(new_value_idx) == set(previous_value):
-                    finished = False
-                    break
-            if finished:
+            constraints = set(previous_values)
+        constraints.add(self.value_mask)
+
+        # draw uniformly from the unused combinations: a rank among the C(length, num) - len(excluded)
+        # remaining ones, mapped past the excluded ranks, then unranked
+        total = math.comb(length, num)
+        used = set(mask for mask in used if bin(mask).count("1") == num)
+        excluded = used | set(mask for mask in constraints if bin(mask).count("1") == num)
+        if len(excluded) >= total:
+            metrics.count("position_saturated")
+            # 所有组合都已用过：只避开当前的组合
+            excluded = used | (set([self.value_mask]) if bin(self.value_mask).count("1") == num < length else set())
+            if len(excluded) >= total:
+                excluded = used
+        excluded = sorted(combination_rank(mask) for mask in excluded)
+        rank = int(rng.integers(total - len(excluded)))
+        for excluded_rank in excluded:
+            if excluded_rank > rank:
                 break
-        return new_value_idx
-
-    # --- 修复结束 ---
+            rank += 1
+        return mask_positions(combination_unrank(rank, num, length))
 
-    def sample_add(self, num):
+    def sample_add(self, rng, num):
         ret = []
-        available = set(range(len(self.values))) - set(self.value_idx)
+        available = [idx for idx in range(len(self.values)) if not self.value_mask >> idx & 1]
         num_to_sample = min(num, len(available))  # 确保采样数不超过可用数
         if num_to_sample == 0:
             return ret
 
-        idxes_2_add = np.random.choice(list(available), num_to_sample, False)
+        idxes_2_add = rng.choice(available, num_to_sample, False)
         for index in idxes_2_add:
-            self.value_idx = np.insert(self.value_idx, 0, index)
+            self.set_value_idx(np.insert(self.value_idx, 0, index))
             ret.append(self.values[index])
         return ret
 
@@ -344,6 +442,10 @@ class Position(Attribute):
 
     def set_value_idx(self, value_idx):
         self.value_idx = value_idx
+        self.value_mask = position_mask(value_idx)
+
+    def get_value_mask(self):
+        return self.value_mask
 
     def get_value(self, value_idx=None):
         if value_idx is None:
@@ -356,4 +458,4 @@ class Position(Attribute):
     def remove(self, bbox):
         idx = self.values.index(bbox)
         np_idx = np.where(self.value_idx == idx)[0][0]
-        self.value_idx = np.delete(self.value_idx, np_idx)
\ No newline at end of file
+        self.set_value_idx(np.delete(self.value_idx, np_idx))
\ No newline at end of file
@@ -2,34 +2,68 @@
 
 
 import copy
+import math
 
 import numpy as np
 
 from const import (COLOR_MAX, COLOR_MIN, NUM_MAX, NUM_MIN, SIZE_MAX,
                    SIZE_MIN)
 from AoT import Entity
+from Attribute import mask_positions
 
 
-def Rule_Wrapper(name, attr, param, component_idx):
+def Rule_Wrapper(name, attr, param, component_idx, rng, value=None):
     if name == "Constant":
-        ret = Constant(name, attr, param, component_idx)
+        ret = Constant(name, attr, param, component_idx, rng, value)
     elif name == "Progression":
-        ret = Progression(name, attr, param, component_idx)
+        ret = Progression(name, attr, param, component_idx, rng, value)
     elif name == "Arithmetic":
-        ret = Arithmetic(name, attr, param, component_idx)
+        ret = Arithmetic(name, attr, param, component_idx, rng, value)
     elif name == "Distribute_Three":
-        ret = Distribute_Three(name, attr, param, component_idx)
+        ret = Distribute_Three(name, attr, param, component_idx, rng, value)
     else:
         raise ValueError("Unsupported Rule")
     return ret
 
 
+def apply_rule_group(rng, rule_group, aot_list, out_aot=None):
+    """Apply the rules of a component to the next panel of a row in a single pass: the component
+    of the previous panel is copied once, then every rule of the group modifies that copy in place.
+    Arguments:
+        rng(numpy.random.Generator): source of randomness
+        rule_group(list of Rule): the rules of one component, the Number/Position rule first
+        aot_list(list of AoTNode): the previous panels of the row
+        out_aot(Root): a panel, not in aot_list, to write the component into; its other components
+            are kept. If None, a new panel is copied from aot_list[-1]
+    Returns:
+        out_aot(Root): the panel with the new component
+    """
+    component_idx = rule_group[0].component_idx
+    if out_aot is None:
+        out_aot = aot_list[-1].copy_component(component_idx)
+    else:
+        _reset_component(out_aot, aot_list[-1], component_idx)
+    for rule in rule_group:
+        arity = 1
+        if rule.name in ["Arithmetic", "Distribute_Three"]:
+            arity = 2
+        if rule.apply_rule(rng, aot_list[-arity:], in_aot=out_aot, in_place=True) is None:
+            # as when applying the rules one copy at a time, the next rules start over from the previous panel
+            _reset_component(out_aot, aot_list[-1], component_idx)
+    return out_aot
+
+
+def _reset_component(dst_aot, src_aot, component_idx):
+    src_component = src_aot.children[0].children[component_idx]
+    dst_aot.children[0].children[component_idx] = copy.deepcopy(src_component)
+
+
 class Rule:
     """General API for a rule.
     Priority order: Rule on Number/Position always comes first
     """
 
-    def __init__(self, name, attr, params, component_idx=0):
+    def __init__(self, name, attr, params, component_idx, rng, value=None):
         """Instantiate a rule by its name, attribute, paramter list and the component it applies to.
         Each rule should be applied to all entities in a component.
         Arguments:
@@ -37,64 +71,77 @@ class Rule:
             attr(str): pre-defined name of the attribute
             params(list): a list of possible parameters for it to sample
             component_idx(int): the index of the component to apply the rule
+            rng(numpy.random.Generator): source of randomness for the parameter
+            value(int): the parameter, if already chosen; rng is then not used
         """
         self.name = name
         self.attr = attr
         self.params = params
         self.component_idx = component_idx
         self.value = 0
-        self.sample()
+        if value is None:
+            self.sample(rng)
+        else:
+            self.value = value
 
-    def sample(self):
+    def sample(self, rng):
         """Sample a parameter from the parameter list.
         """
         if self.params is not None:
-            self.value = np.random.choice(self.params)
+            self.value = rng.choice(self.params)
             self.value = int(self.value)
 
-    def apply_rule(self, aot_list, in_aot=None):
+    def apply_rule(self, rng, aot_list, in_aot=None, in_place=False):
         """Apply the rule to a component in the AoT.
         Arguments:
+            rng(numpy.random.Generator): source of randomness
             aot_list(list of AoTNode): a list of AoTs for reference
             in_aot(AoTNode): an AoT to apply the rule
+            in_place(bool): modify in_aot instead of a copy of it; in_aot must own its component
+                and must not be in aot_list, see apply_rule_group
         Returns:
-            second_aot(AoTNode): a modified AoT
+            second_aot(AoTNode): a modified AoT; None if the rule could not be applied
         """
         # Root -> Structure -> Component -> Layout -> Entity
         pass
 
+    def _output_aot(self, in_aot, in_place):
+        if in_place:
+            return in_aot
+        return in_aot.copy_component(self.component_idx)
+
 
 class Constant(Rule):
     """Unary operator (1-arity). Nothing changes.
     """
 
-    def __init__(self, name, attr, param, component_idx):
-        super(Constant, self).__init__(name, attr, param, component_idx)
+    def __init__(self, name, attr, param, component_idx, rng, value=None):
+        super(Constant, self).__init__(name, attr, param, component_idx, rng, value)
 
-    def apply_rule(self, aot_list, in_aot=None):
+    def apply_rule(self, rng, aot_list, in_aot=None, in_place=False):
         # 1-arity 规则，只看 aot_list[-1]
         aot = aot_list[-1]
         if in_aot is None:
             in_aot = aot
-        return copy.deepcopy(in_aot)
+        return self._output_aot(in_aot, in_place)
 
 
 class Progression(Rule):
     """Unary operator (1-arity). Attribute difference on two consequetive Panels remains the same.
     """
 
-    def __init__(self, name, attr, param, component_idx):
-        super(Progression, self).__init__(name, attr, param, component_idx)
+    def __init__(self, name, attr, param, component_idx, rng, value=None):
+        super(Progression, self).__init__(name, attr, param, component_idx, rng, value)
         # 标志位在CoT模式下不再需要，因为我们是无状态的
         # self.first_col = True
 
-    def apply_rule(self, aot_list, in_aot=None):
+    def apply_rule(self, rng, aot_list, in_aot=None, in_place=False):
         # 1-arity 规则，只看 aot_list[-1]
         aot = aot_list[-1]
         current_layout = aot.children[0].children[self.component_idx].children[0]
         if in_aot is None:
             in_aot = aot
-        second_aot = copy.deepcopy(in_aot)
+        second_aot = self._output_aot(in_aot, in_place)
         second_layout = second_aot.children[0].children[self.component_idx].children[0]
 
         if not current_layout.children:  # 如果没有实体，直接返回
@@ -102,7 +149,7 @@ class Progression(Rule):
 
         if self.attr == "Number":
             second_layout.number.set_value_level(second_layout.number.get_value_level() + self.value)
-            second_layout.position.sample(second_layout.number.get_value())
+            second_layout.position.sample(rng, second_layout.number.get_value())
             pos = second_layout.position.get_value()
             del second_layout.children[:]
             for i in range(len(pos)):
@@ -110,7 +157,7 @@ class Progression(Rule):
                 entity.name = str(i)
                 entity.bbox = pos[i]
                 if not current_layout.uniformity.get_value():
-                    entity.resample()
+                    entity.resample(rng)
                 second_layout.insert(entity)
         elif self.attr == "Position":
             second_pos_idx = (second_layout.position.get_value_idx() + self.value) % len(second_layout.position.values)
@@ -139,16 +186,16 @@ class Arithmetic(Rule):
     """Binary operator (2-arity). Panel_t = Panel_{t-2} + Panel_{t-1}.
     """
 
-    def __init__(self, name, attr, param, component_idx):
-        super(Arithmetic, self).__init__(name, attr, param, component_idx)
+    def __init__(self, name, attr, param, component_idx, rng, value=None):
+        super(Arithmetic, self).__init__(name, attr, param, component_idx, rng, value)
         # 状态在CoT模式下被移除
         # self.color_count = 0
         # self.color_white_alarm = False
 
-    def apply_rule(self, aot_list, in_aot=None):
+    def apply_rule(self, rng, aot_list, in_aot=None, in_place=False):
         # 2-arity 规则，需要 2 个输入面板
         if len(aot_list) < 2:
-            return copy.deepcopy(aot_list[-1])  # 输入不足
+            return None if in_place else aot_list[-1].copy_component(self.component_idx)  # 输入不足
 
         first_aot = aot_list[-2]
         second_aot = aot_list[-1]
@@ -158,7 +205,7 @@ class Arithmetic(Rule):
 
         if in_aot is None:
             in_aot = second_aot  # 新面板基于 t-1 面板
-        new_aot = copy.deepcopy(in_aot)
+        new_aot = self._output_aot(in_aot, in_place)
         new_layout = new_aot.children[0].children[self.component_idx].children[0]
 
         if self.attr == "Number":
@@ -174,34 +221,35 @@ class Arithmetic(Rule):
             total = np.clip(total, NUM_MIN, NUM_MAX)
             new_layout.number.set_value_level(total)
 
-            new_layout.position.sample(new_layout.number.get_value())
+            new_layout.position.sample(rng, new_layout.number.get_value())
             pos = new_layout.position.get_value()
             del new_layout.children[:]
             for i in range(len(pos)):
                 if second_layout.children:
                     entity = copy.deepcopy(second_layout.children[0])
                 else:
-                    entity = Entity(name=str(i), bbox=pos[i], entity_constraint=second_layout.entity_constraint)
+                    entity = Entity(name=str(i), bbox=pos[i], entity_constraint=second_layout.entity_constraint, rng=rng)
                 entity.name = str(i)
                 entity.bbox = pos[i]
                 if not second_layout.uniformity.get_value():
-                    entity.resample()
+                    entity.resample(rng)
                 new_layout.insert(entity)
 
         elif self.attr == "Position":
-            first_layout_value_idx = first_layout.position.get_value_idx()
-            second_layout_value_idx = second_layout.position.get_value_idx()
+            first_layout_mask = first_layout.position.get_value_mask()
+            second_layout_mask = second_layout.position.get_value_mask()
 
             if self.value > 0:
-                new_pos_idx = set(first_layout_value_idx) | set(second_layout_value_idx)
+                new_pos_mask = first_layout_mask | second_layout_mask
             else:
-                new_pos_idx = set(first_layout_value_idx) - set(second_layout_value_idx)
+                new_pos_mask = first_layout_mask & ~second_layout_mask
 
-            if not new_pos_idx:
+            if not new_pos_mask:
                 return None
 
+            new_pos_idx = mask_positions(new_pos_mask)
             new_layout.number.set_value_level(len(new_pos_idx) - 1)
-            new_layout.position.set_value_idx(np.array(list(new_pos_idx)))
+            new_layout.position.set_value_idx(new_pos_idx)
 
             pos = new_layout.position.get_value()
             del new_layout.children[:]
@@ -209,11 +257,11 @@ class Arithmetic(Rule):
                 if second_layout.children:
                     entity = copy.deepcopy(second_layout.children[0])
                 else:
-                    entity = Entity(name=str(i), bbox=pos[i], entity_constraint=second_layout.entity_constraint)
+                    entity = Entity(name=str(i), bbox=pos[i], entity_constraint=second_layout.entity_constraint, rng=rng)
                 entity.name = str(i)
                 entity.bbox = pos[i]
                 if not second_layout.uniformity.get_value():
-                    entity.resample()
+                    entity.resample(rng)
                 new_layout.insert(entity)
 
         elif self.attr == "Size":
@@ -255,14 +303,14 @@ class Distribute_Three(Rule):
     新逻辑：V_t (或 V3) 是从总值集中选择的、一个与 V_{t-1}(V2) 和 V_{t-2}(V1) *都不同*的值。
     """
 
-    def __init__(self, name, attr, param, component_idx):
-        super(Distribute_Three, self).__init__(name, attr, param, component_idx)
+    def __init__(self, name, attr, param, component_idx, rng, value=None):
+        super(Distribute_Three, self).__init__(name, attr, param, component_idx, rng, value)
         # 移除所有状态 (self.value_levels, self.count)
 
-    def apply_rule(self, aot_list, in_aot=None):
+    def apply_rule(self, rng, aot_list, in_aot=None, in_place=False):
         # 这是一个 2-arity 规则，需要 2 个输入面板
         if len(aot_list) < 2:
-            return copy.deepcopy(aot_list[-1])  # 输入不足
+            return None if in_place else aot_list[-1].copy_component(self.component_idx)  # 输入不足
 
         first_aot = aot_list[-2]  # V1
         second_aot = aot_list[-1]  # V2
@@ -273,7 +321,7 @@ class Distribute_Three(Rule):
         if in_aot is None:
             in_aot = second_aot
 
-        new_aot = copy.deepcopy(in_aot)
+        new_aot = self._output_aot(in_aot, in_place)
         new_layout = new_aot.children[0].children[self.component_idx].children[0]
 
         # --- 获取原始约束边界 ---
@@ -305,38 +353,35 @@ class Distribute_Three(Rule):
                 available = set(all_value_levels) - {v1_level, v2_level}
                 if not available: available = set(all_value_levels)  # 如果只有2个或1个值，就从中选
 
-            v3_level = np.random.choice(list(available))
+            v3_level = rng.choice(list(available))
             new_layout.number.set_value_level(v3_level)
 
             # 基于新 Number 重新采样 Position 和实体
-            new_layout.position.sample(new_layout.number.get_value())
+            new_layout.position.sample(rng, new_layout.number.get_value())
             pos = new_layout.position.get_value()
             del new_layout.children[:]
             for i in range(len(pos)):
                 if second_layout.children:
                     entity = copy.deepcopy(second_layout.children[0])
                 else:
-                    entity = Entity(name=str(i), bbox=pos[i], entity_constraint=second_layout.entity_constraint)
+                    entity = Entity(name=str(i), bbox=pos[i], entity_constraint=second_layout.entity_constraint, rng=rng)
                 entity.name = str(i)
                 entity.bbox = pos[i]
                 if not second_layout.uniformity.get_value():
-                    entity.resample()
+                    entity.resample(rng)
                 new_layout.insert(entity)
 
         elif self.attr == "Position":
             # Position 的 Distribute_Three 意味着3个不同的位置*集合*
-            v1_idx_set = set(first_layout.position.get_value_idx())
-            v2_idx_set = set(second_layout.position.get_value_idx())
+            v1_mask = first_layout.position.get_value_mask()
+            v2_mask = second_layout.position.get_value_mask()
             num = new_layout.number.get_value()  # 保持与 t-1 面板相同的实体数量
 
-            # 循环直到找到一个不同的位置集
-            attempts = 0
-            while attempts < 10:  # 防止死循环
-                v3_idx = new_layout.position.sample_new(num)
-                v3_idx_set = set(v3_idx)
-                if v3_idx_set != v1_idx_set and v3_idx_set != v2_idx_set:
-                    break
-                attempts += 1
+            # 一次抽样得到与前两个面板都不同的位置集；组合不够时只能重复
+            used = set(mask for mask in (v1_mask, v2_mask) if bin(mask).count("1") == num)
+            if len(used) >= math.comb(len(new_layout.position.values), num):
+                used = set()
+            v3_idx = new_layout.position.sample_new(rng, num, used=used)
 
             new_layout.position.set_value_idx(v3_idx)
             pos = new_layout.position.get_value()
@@ -357,7 +402,7 @@ class Distribute_Three(Rule):
             if not available:
                 available = set(all_value_levels)
 
-            v3_level = np.random.choice(list(available))
+            v3_level = rng.choice(list(available))
 
             # 将 v3 应用到新面板的所有实体上
             for entity in new_layout.children:
@@ -6,13 +6,7 @@ import xml.etree.ElementTree as ET
 import cv2
 import numpy as np
 from const import DEFAULT_WIDTH, IMAGE_SIZE
-from rendering import render_entity
-
-
-class Bunch:
-    """Dummy class"""
-    def __init__(self, **kwds):
-        self.__dict__.update(kwds)
+from rendering import render_entity_layer
 
 
 def get_real_bbox(entity_bbox, entity_type, entity_size, entity_angle):
@@ -65,13 +59,8 @@ def get_real_bbox(entity_bbox, entity_type, entity_size, entity_angle):
 
 
 def get_mask(entity_bbox, entity_type, entity_size, entity_angle):
-    dummy_entity = Bunch()
-    dummy_entity.bbox = entity_bbox
-    dummy_entity.type = Bunch(get_value=lambda : entity_type)
-    dummy_entity.size = Bunch(get_value=lambda : entity_size)
-    dummy_entity.color = Bunch(get_value=lambda : 0)
-    dummy_entity.angle = Bunch(get_value=lambda : entity_angle)
-    mask = render_entity(dummy_entity) // 255
+    # shares the layer cache with render_panel; color 0 leaves only the outline
+    mask = render_entity_layer(tuple(entity_bbox), entity_type, entity_size, 0, entity_angle) // 255
     return mask
 
 
@@ -82,12 +71,8 @@ def rle_encode(img):
     img: numpy array, 1 - mask, 0 - background
     Returns run length as string formated
     '''
-    pixels = img.flatten()
-    pixels = np.concatenate([[0], pixels, [0]])
-    runs = np.where(pixels[1:] != pixels[:-1])[0] + 1
-    runs[1::2] -= runs[::2]
-    return "[" + ",".join(str(x) for x in runs) + "]"
- 
+    return rle_format(*rle_encode_batch(img[np.newaxis]))[0]
+
 
 def rle_decode(mask_rle, shape):
     '''
@@ -95,11 +80,74 @@ def rle_decode(mask_rle, shape):
     shape: (height,width) of array to return 
     Returns numpy array, 1 - mask, 0 - background
     '''
-    s = mask_rle[1:-1].split(",")
-    starts, lengths = [np.asarray(x, dtype=int) for x in (s[0:][::2], s[1:][::2])]
-    starts -= 1
-    ends = starts + lengths
-    img = np.zeros(shape[0] * shape[1], dtype=np.uint8)
-    for lo, hi in zip(starts, ends):
-        img[lo:hi] = 1
-    return img.reshape(shape)
+    return rle_decode_batch(*rle_parse([mask_rle]), shape)[0]
+
+
+def rle_encode_batch(masks):
+    """Run-length encode a stack of masks at once.
+    Arguments:
+        masks(np.ndarray): (N, ...) masks, 1 - mask, 0 - background
+    Returns:
+        runs(np.ndarray): the (start, length) pairs of all the masks, concatenated; starts
+            are 1-based indices in the flattened mask, as in rle_encode
+        offsets(np.ndarray): (N + 1,) the runs of mask i are runs[offsets[i]:offsets[i + 1]]
+    """
+    pixels = masks.reshape(len(masks), -1)
+    padded = np.zeros((len(masks), pixels.shape[1] + 2), np.bool_)
+    padded[:, 1:-1] = pixels != 0
+    # every mask has an even number of changes, so starts and ends alternate over the whole stack
+    rows, runs = np.divmod(np.flatnonzero(padded[:, 1:] != padded[:, :-1]), pixels.shape[1] + 1)
+    runs += 1
+    runs[1::2] -= runs[::2]
+    offsets = np.zeros(len(masks) + 1, np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(masks)), out=offsets[1:])
+    return runs, offsets
+
+
+def rle_decode_batch(runs, offsets, shape):
+    """Decode runs produced by rle_encode_batch or rle_parse into a stack of masks.
+    Arguments:
+        runs(np.ndarray), offsets(np.ndarray): see rle_encode_batch
+        shape(tuple): (height, width) of each mask
+    Returns:
+        masks(np.ndarray): (N, height, width) uint8, 1 - mask, 0 - background
+    """
+    size = shape[0] * shape[1]
+    n = len(offsets) - 1
+    # global start and end of every run in the flattened stack
+    rows = np.repeat(np.arange(n), np.diff(offsets) // 2)
+    starts = rows * size + runs[::2] - 1
+    ends = starts + runs[1::2]
+    # the stack alternates background and mask: repeat 0 and 1 by the gap and run lengths
+    lengths = np.empty(2 * len(starts) + 1, np.int64)
+    lengths[0:-1:2] = starts - np.concatenate([[0], ends[:-1]])
+    lengths[1::2] = runs[1::2]
+    lengths[-1] = n * size - (ends[-1] if len(ends) else 0)
+    values = np.zeros(len(lengths), np.uint8)
+    values[1::2] = 1
+    return np.repeat(values, lengths).reshape((n,) + tuple(shape))
+
+
+def rle_format(runs, offsets):
+    """The runs of each mask as the string of rle_encode.
+    """
+    # join all the runs once, then cut the string of each mask at its character offsets
+    text = ",".join(map(str, runs.tolist()))
+    digits = np.ones(len(runs), np.int64)
+    power = 10
+    while len(runs) and power <= runs.max():
+        digits += runs >= power
+        power *= 10
+    starts = np.zeros(len(runs) + 1, np.int64)
+    np.cumsum(digits + 1, out=starts[1:])
+    starts = starts[offsets].tolist()
+    return ["[" + text[starts[i]:max(starts[i], starts[i + 1] - 1)] + "]" for i in range(len(offsets) - 1)]
+
+
+def rle_parse(mask_rles):
+    """Inverse of rle_format: read the strings of rle_encode into runs and offsets.
+    """
+    runs = [np.asarray(mask_rle[1:-1].split(",") if len(mask_rle) > 2 else [], np.int64) for mask_rle in mask_rles]
+    offsets = np.zeros(len(runs) + 1, np.int64)
+    np.cumsum([len(r) for r in runs], out=offsets[1:])
+    return np.concatenate(runs) if runs else np.zeros(0, np.int64), offsets
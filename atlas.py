@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from build_tree import (build_center_single, build_distribute_four,
+                        build_distribute_nine,
+                        build_in_center_single_out_center_single,
+                        build_in_distribute_four_out_center_single,
+                        build_left_center_single_right_center_single,
+                        build_up_center_single_down_center_single)
+from const import ANGLE_VALUES, COLOR_VALUES, SIZE_VALUES, TYPE_VALUES
+from rendering import render_entity_layer, sprite_window
+
+
+ATLAS_DATA = "atlas.npy"
+ATLAS_INDEX = "atlas.json"
+
+# "none" renders nothing and is never stored
+ATLAS_TYPES = [t for t in TYPE_VALUES if t != "none"]
+
+
+def layout_slots(planar=True):
+    """Collect the position slots of every configuration in build_tree.
+    Angular slots rotate around another center and are left to the regular renderer,
+    they are only collected if planar is False.
+    Returns:
+        slots(list of tuple): distinct bboxes, in build order
+    """
+    # the trees are only walked for their position lists; the sampled values do not matter
+    rng = np.random.default_rng(0)
+    roots = [build_center_single(rng),
+             build_distribute_four(rng),
+             build_distribute_nine(rng),
+             build_left_center_single_right_center_single(rng),
+             build_up_center_single_down_center_single(rng),
+             build_in_center_single_out_center_single(rng),
+             build_in_distribute_four_out_center_single(rng)]
+    slots = []
+    for root in roots:
+        for structure in root.children:
+            for component in structure.children:
+                for layout in component.children:
+                    for bbox in layout.position.values:
+                        bbox = tuple(bbox)
+                        if (len(bbox) == 4 or not planar) and bbox not in slots:
+                            slots.append(bbox)
+    return slots
+
+
+def build_atlas(save_dir):
+    """Rasterize every entity variant of every slot once into a flat uint8 array on disk.
+    Variants of a slot are stored as a (type, size, color, angle, h, w) block, cropped to
+    the slot window.
+    """
+    if not os.path.exists(save_dir):
+        os.mkdir(save_dir)
+    n_variants = len(ATLAS_TYPES) * len(SIZE_VALUES) * len(COLOR_VALUES) * len(ANGLE_VALUES)
+    index = {"types": ATLAS_TYPES,
+             "sizes": SIZE_VALUES,
+             "colors": COLOR_VALUES,
+             "angles": ANGLE_VALUES,
+             "slots": []}
+    offset = 0
+    for bbox in layout_slots():
+        y0, y1, x0, x1 = sprite_window(bbox)
+        index["slots"].append({"bbox": list(bbox), "offset": offset, "window": [y0, y1, x0, x1]})
+        offset += n_variants * (y1 - y0) * (x1 - x0)
+
+    data = np.lib.format.open_memmap(os.path.join(save_dir, ATLAS_DATA), mode="w+",
+                                     dtype=np.uint8, shape=(offset,))
+    for slot in index["slots"]:
+        bbox = tuple(slot["bbox"])
+        y0, y1, x0, x1 = slot["window"]
+        block = data[slot["offset"]:slot["offset"] + n_variants * (y1 - y0) * (x1 - x0)]
+        block = block.reshape((len(ATLAS_TYPES), len(SIZE_VALUES), len(COLOR_VALUES), len(ANGLE_VALUES),
+                               y1 - y0, x1 - x0))
+        for t, entity_type in enumerate(ATLAS_TYPES):
+            for s, entity_size in enumerate(SIZE_VALUES):
+                for c, entity_color in enumerate(COLOR_VALUES):
+                    for a, entity_angle in enumerate(ANGLE_VALUES):
+                        # bypass the layer cache, every variant is rendered exactly once
+                        layer = render_entity_layer.__wrapped__(bbox, entity_type, entity_size,
+                                                                entity_color, entity_angle)
+                        sprite = layer[y0:y1, x0:x1]
+                        assert int(sprite.sum()) == int(layer.sum()), "sprite exceeds its window"
+                        block[t, s, c, a] = sprite
+    data.flush()
+    del data
+    with open(os.path.join(save_dir, ATLAS_INDEX), "w") as f:
+        json.dump(index, f)
+
+
+class SpriteAtlas:
+    """Read-only view of an atlas written by build_atlas. The data is memory-mapped,
+    so processes loading the same atlas share its pages.
+    """
+
+    def __init__(self, save_dir):
+        with open(os.path.join(save_dir, ATLAS_INDEX)) as f:
+            index = json.load(f)
+        if index["types"] != ATLAS_TYPES or index["sizes"] != SIZE_VALUES or \
+                index["colors"] != COLOR_VALUES or index["angles"] != ANGLE_VALUES:
+            raise ValueError("Atlas {} was built with other value tables".format(save_dir))
+        # a plain ndarray view of the mapping, slicing a np.memmap is much slower
+        self.data = np.asarray(np.load(os.path.join(save_dir, ATLAS_DATA), mmap_mode="r"))
+        self.type_index = dict((v, i) for i, v in enumerate(ATLAS_TYPES))
+        self.size_index = dict((v, i) for i, v in enumerate(SIZE_VALUES))
+        self.color_index = dict((v, i) for i, v in enumerate(COLOR_VALUES))
+        self.angle_index = dict((v, i) for i, v in enumerate(ANGLE_VALUES))
+        self.slots = dict()
+        for slot in index["slots"]:
+            self.slots[tuple(slot["bbox"])] = (slot["offset"], tuple(slot["window"]))
+
+    def lookup(self, entity_bbox, entity_type, entity_size, entity_color, entity_angle):
+        """Find the sprite of an entity.
+        Returns:
+            window(tuple of int): (y0, y1, x0, x1) region of the canvas covered by the sprite
+            sprite(np.ndarray): read-only uint8 array of the window shape
+            or None if the variant is not in the atlas
+        """
+        slot = self.slots.get(tuple(entity_bbox))
+        if slot is None or entity_type not in self.type_index:
+            return None
+        offset, window = slot
+        y0, y1, x0, x1 = window
+        h, w = y1 - y0, x1 - x0
+        variant = ((self.type_index[entity_type] * len(SIZE_VALUES) + self.size_index[entity_size])
+                   * len(COLOR_VALUES) + self.color_index[entity_color]) * len(ANGLE_VALUES) \
+            + self.angle_index[entity_angle]
+        start = offset + variant * h * w
+        return window, self.data[start:start + h * w].reshape((h, w))
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="build the sprite atlas for I-RAVEN rendering")
+    main_arg_parser.add_argument("--save-dir", type=str, default="atlas",
+                                 help="path to folder where the atlas will be saved")
+    args = main_arg_parser.parse_args()
+    build_atlas(args.save_dir)
+
+
+if __name__ == "__main__":
+    main()
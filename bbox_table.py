@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from api import get_real_bbox
+from atlas import layout_slots
+from const import ANGLE_VALUES, DEFAULT_WIDTH, IMAGE_SIZE, SIZE_VALUES, TYPE_VALUES
+
+
+# "none" has no bounding box
+BBOX_TYPES = [t for t in TYPE_VALUES if t != "none"]
+
+
+class RealBBoxTable:
+    """get_real_bbox of every slot, type, size and angle of the configurations in build_tree,
+    computed once. Other slots are left to get_real_bbox.
+    """
+
+    def __init__(self, slots, real_bboxes):
+        """
+        Arguments:
+            slots(list of tuple): the bboxes of the slots
+            real_bboxes(np.ndarray): (slot, type, size, angle, 4) as returned by get_real_bbox,
+                types as in BBOX_TYPES
+        """
+        self.slots = dict((tuple(bbox), i) for i, bbox in enumerate(slots))
+        self.real_bboxes = real_bboxes
+        self.type_index = dict((v, i) for i, v in enumerate(BBOX_TYPES))
+        self.size_index = dict((v, i) for i, v in enumerate(SIZE_VALUES))
+        self.angle_index = dict((v, i) for i, v in enumerate(ANGLE_VALUES))
+
+    @staticmethod
+    def build():
+        slots = layout_slots(planar=False)
+        real_bboxes = np.zeros((len(slots), len(BBOX_TYPES), len(SIZE_VALUES), len(ANGLE_VALUES), 4))
+        for i, bbox in enumerate(slots):
+            for t, entity_type in enumerate(BBOX_TYPES):
+                for s, entity_size in enumerate(SIZE_VALUES):
+                    for a, entity_angle in enumerate(ANGLE_VALUES):
+                        real_bboxes[i, t, s, a] = get_real_bbox(bbox, entity_type, entity_size, entity_angle)
+        return RealBBoxTable(slots, real_bboxes)
+
+    def save(self, path):
+        slots = sorted(self.slots.keys(), key=self.slots.get)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, slots=json.dumps(slots), real_bboxes=self.real_bboxes, fingerprint=table_fingerprint(slots))
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path):
+        """
+        Returns:
+            table(RealBBoxTable): the table saved at path, None if it was built for other value tables
+        """
+        with np.load(path) as data:
+            slots = [tuple(bbox) for bbox in json.loads(str(data["slots"]))]
+            if str(data["fingerprint"]) != table_fingerprint(slots):
+                return None
+            return RealBBoxTable(slots, data["real_bboxes"])
+
+    def lookup(self, entity_bbox, entity_type, entity_size, entity_angle):
+        """Same as get_real_bbox, from the table when the variant is in it.
+        """
+        i = self.slots.get(tuple(entity_bbox))
+        if i is None:
+            return get_real_bbox(entity_bbox, entity_type, entity_size, entity_angle)
+        return list(self.real_bboxes[i, self.type_index[entity_type], self.size_index[entity_size],
+                                     self.angle_index[entity_angle]])
+
+
+def table_fingerprint(slots):
+    """Hash of everything get_real_bbox depends on besides its code.
+    """
+    data = json.dumps([slots, BBOX_TYPES, SIZE_VALUES, ANGLE_VALUES, IMAGE_SIZE, DEFAULT_WIDTH])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def load_bbox_table(path):
+    """Load the table saved at path, building and saving it if it is missing or stale.
+    With an empty path the table is only built in memory.
+    """
+    if not path:
+        return RealBBoxTable.build()
+    table = RealBBoxTable.load(path) if os.path.exists(path) else None
+    if table is None:
+        table = RealBBoxTable.build()
+        table.save(path)
+    return table
+
+
+# table consulted by real_bbox, see use_bbox_table
+_bbox_table = None
+
+
+def use_bbox_table(table):
+    """Read real bounding boxes from a RealBBoxTable in real_bbox. Pass None to disable.
+    """
+    global _bbox_table
+    _bbox_table = table
+
+
+def real_bbox(entity_bbox, entity_type, entity_size, entity_angle):
+    if _bbox_table is not None:
+        return _bbox_table.lookup(entity_bbox, entity_type, entity_size, entity_angle)
+    return get_real_bbox(entity_bbox, entity_type, entity_size, entity_angle)
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="build the real bounding box table used by the XML metadata")
+    main_arg_parser.add_argument("--path", type=str, default="bbox_table.npz",
+                                 help="path to the table file")
+    args = main_arg_parser.parse_args()
+    table = load_bbox_table(args.path)
+    print("{} slots, {} entries".format(len(table.slots), table.real_bboxes.size // 4))
+
+
+if __name__ == "__main__":
+    main()
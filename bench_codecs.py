@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from export import list_samples, read_sample
+from image_codec import (DEFAULT_LEVELS, IMAGE_CODECS, IMAGE_FILTERS, codec_functions,
+                         decode_image, encode_image)
+
+
+# compression levels benchmarked for each codec by default
+BENCH_LEVELS = {"raw": [0], "zlib": [1, 6, 9], "zstd": [1, 3, 9, 19], "lz4": [0, 9]}
+
+
+def load_images(save_dir, keys, num_samples):
+    """The image stacks of the first num_samples samples of every configuration, all splits."""
+    images = []
+    readers = dict()
+    for key in keys:
+        samples = [sample for split_samples in list_samples(save_dir, key).values() for sample in split_samples]
+        for k, source in sorted(samples)[:num_samples]:
+            images.append(read_sample(source, k, readers)["image"])
+    for reader in readers.values():
+        reader.close()
+    return images
+
+
+def stored_size(arrays):
+    """Bytes taken by arrays in a .npz, as np.savez writes them."""
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return len(buf.getvalue())
+
+
+def bench_codec(images, codec, level, filter):
+    """Encode and decode every image stack, checking that they are restored exactly.
+    Returns:
+        result(dict): JSON-serializable throughputs in MB/s of raw pixels, and sizes
+    """
+    raw_bytes = sum(image.nbytes for image in images)
+    start = time.perf_counter()
+    encoded = [encode_image(image, codec, level, filter) for image in images]
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = [decode_image(arrays) for arrays in encoded]
+    decode_seconds = time.perf_counter() - start
+    for image, decoded_image in zip(images, decoded):
+        assert np.array_equal(image, decoded_image), "{} {} {} is not lossless".format(codec, level, filter)
+    stored_bytes = sum(stored_size(arrays) for arrays in encoded)
+    return {"codec": codec,
+            "level": level,
+            "filter": filter,
+            "encode_mb_per_s": raw_bytes / 1e6 / max(encode_seconds, 1e-9),
+            "decode_mb_per_s": raw_bytes / 1e6 / max(decode_seconds, 1e-9),
+            "kib_per_sample": stored_bytes / 1024.0 / len(images),
+            "ratio": raw_bytes / float(stored_bytes)}
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="compare the storage codecs of the image stacks of a "
+                                                          "generated dataset: throughput and size")
+    main_arg_parser.add_argument("--save-dir", type=str, default="dataset",
+                                 help="path to folder where the dataset was generated")
+    main_arg_parser.add_argument("--config", type=str, nargs="+", default=None,
+                                 help="configurations to read samples from, defaults to all the folders of save-dir")
+    main_arg_parser.add_argument("--num-samples", type=int, default=20,
+                                 help="number of samples read from each configuration")
+    main_arg_parser.add_argument("--codec", type=str, nargs="+", default=IMAGE_CODECS, choices=IMAGE_CODECS,
+                                 help="codecs to benchmark; unavailable ones are skipped")
+    main_arg_parser.add_argument("--filter", type=str, nargs="+", default=IMAGE_FILTERS, choices=IMAGE_FILTERS,
+                                 help="filters to benchmark with each codec")
+    main_arg_parser.add_argument("--level", type=int, nargs="+", default=None,
+                                 help="compression levels to benchmark, defaults to a few per codec")
+    main_arg_parser.add_argument("--output", type=str, default="bench_codecs.json",
+                                 help="path of the JSON report")
+    args = main_arg_parser.parse_args()
+
+    keys = args.config
+    if keys is None:
+        keys = sorted(name for name in os.listdir(args.save_dir)
+                      if os.path.isdir(os.path.join(args.save_dir, name)))
+    images = load_images(args.save_dir, keys, args.num_samples)
+    if not images:
+        raise ValueError("No samples found in {}".format(args.save_dir))
+
+    results = []
+    print("{:<6} {:>6} {:<6} {:>12} {:>12} {:>12} {:>8}".format("codec", "level", "filter", "encode MB/s",
+                                                               "decode MB/s", "KiB/sample", "ratio"))
+    for codec in args.codec:
+        try:
+            codec_functions(codec, DEFAULT_LEVELS[codec])
+        except ValueError as error:
+            print("Skipping {}: {}".format(codec, error), file=sys.stderr)
+            continue
+        for level in (args.level if args.level is not None and codec != "raw" else BENCH_LEVELS[codec]):
+            for filter in args.filter:
+                result = bench_codec(images, codec, level, filter)
+                results.append(result)
+                print("{:<6} {:>6} {:<6} {:>12.1f} {:>12.1f} {:>12.1f} {:>8.2f}".format(
+                    codec, level, filter, result["encode_mb_per_s"], result["decode_mb_per_s"],
+                    result["kib_per_sample"], result["ratio"]))
+
+    with open(args.output, "w") as f:
+        json.dump({"samples": len(images), "configs": keys, "results": results}, f, indent=1)
+    print("Wrote {}".format(args.output), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import copy
+import os
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from build_tree import (build_center_single, build_distribute_four,
+                        build_distribute_nine,
+                        build_in_center_single_out_center_single,
+                        build_in_distribute_four_out_center_single,
+                        build_left_center_single_right_center_single,
+                        build_up_center_single_down_center_single)
+from main import generate_sample
+
+
+class DeepcopyCounter:
+    """Wrap copy.deepcopy to count the copies requested by the generator, the objects
+    they duplicate (the size of the deepcopy memo) and the bytes kept alive by them.
+    """
+
+    def __init__(self):
+        self.deepcopy = copy.deepcopy
+        self.depth = 0
+        self.calls = 0
+        self.objects = 0
+        self.bytes = 0
+
+    def __call__(self, x, memo=None, _nil=[]):
+        if self.depth > 0:
+            return self.deepcopy(x, memo, _nil)
+        self.calls += 1
+        self.depth += 1
+        memo = dict() if memo is None else memo
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            return self.deepcopy(x, memo, _nil)
+        finally:
+            self.bytes += tracemalloc.get_traced_memory()[0] - before
+            # the memo also keeps a list of the copied objects under its own id
+            self.objects += len(memo) - (id(memo) in memo)
+            self.depth -= 1
+
+    def __enter__(self):
+        copy.deepcopy = self
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        tracemalloc.stop()
+        copy.deepcopy = self.deepcopy
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="count deepcopy calls and bytes per generated sample")
+    main_arg_parser.add_argument("--num-samples", type=int, default=20,
+                                 help="number of samples for each component configuration")
+    main_arg_parser.add_argument("--seed", type=int, default=1234,
+                                 help="random seed for dataset generation")
+    args = main_arg_parser.parse_args()
+    args.val = 2
+    args.test = 2
+    args.metadata = "xml"
+
+    rng = np.random.default_rng(args.seed)
+    all_configs = {"center_single": build_center_single(rng),
+                   "distribute_four": build_distribute_four(rng),
+                   "distribute_nine": build_distribute_nine(rng),
+                   "left_center_single_right_center_single": build_left_center_single_right_center_single(rng),
+                   "up_center_single_down_center_single": build_up_center_single_down_center_single(rng),
+                   "in_center_single_out_center_single": build_in_center_single_out_center_single(rng),
+                   "in_distribute_four_out_center_single": build_in_distribute_four_out_center_single(rng)}
+
+    print("{:<40} {:>12} {:>14} {:>14}".format("config", "copies/smp", "objects/smp", "KiB/smp"))
+    with tempfile.TemporaryDirectory() as save_dir:
+        args.save_dir = save_dir
+        for key in list(all_configs.keys()):
+            os.mkdir(os.path.join(save_dir, key))
+            with DeepcopyCounter() as counter:
+                for k in range(args.num_samples):
+                    generate_sample(args, key, all_configs[key], k)
+            print("{:<40} {:>12.1f} {:>14.1f} {:>14.1f}".format(key,
+                                                             float(counter.calls) / args.num_samples,
+                                                             float(counter.objects) / args.num_samples,
+                                                             counter.bytes / 1024.0 / args.num_samples))
+
+
+if __name__ == "__main__":
+    main()
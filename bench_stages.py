@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import AoT
+import main as generator
+import rule_table
+from atlas import SpriteAtlas
+from bbox_table import load_bbox_table, use_bbox_table
+from build_tree import (build_center_single, build_distribute_four,
+                        build_distribute_nine,
+                        build_in_center_single_out_center_single,
+                        build_in_distribute_four_out_center_single,
+                        build_left_center_single_right_center_single,
+                        build_up_center_single_down_center_single)
+from rendering import use_sprite_atlas
+
+
+# stage -> the functions it is made of, as (owner, attribute name)
+STAGES = [("base_columns", [(AoT.Root, "sample"), (AoT.Root, "resample")]),
+          ("rule_sampling", [(generator, "sample_rules"), (AoT.Root, "feasible"), (rule_table.RuleTable, "sample")]),
+          ("rule_application", [(generator, "apply_rule_group")]),
+          ("distractors", [(generator, "sample_attr_avail"), (generator, "build_candidates")]),
+          ("compact_state", [(generator, "compact_panel")]),
+          ("rendering", [(generator, "render_panels")]),
+          ("solve", [(generator, "solve")]),
+          ("serialize", [(generator, "serialize_rules"), (generator, "serialize_aot")]),
+          ("metadata", [(generator, "dom_problem"), (generator, "problem_record")]),
+          ("savez", [(np, "savez")])]
+
+
+class StageProfiler:
+    """Wrap the functions of every stage of main.generate_sample to accumulate their wall
+    time, and with allocations=True the memory they allocate, traced by tracemalloc.
+    A call made from inside another stage is counted in the outer one. The time of
+    generate_sample spent outside of every stage is reported as "other".
+    """
+
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.depth = 0
+        self.stats = dict((stage, {"calls": 0, "seconds": 0.0, "peak_bytes": 0, "net_bytes": 0})
+                          for stage, _ in STAGES + [("other", None)])
+        self.originals = []
+
+    def _wrap(self, stage, function):
+        stats = self.stats[stage]
+
+        def wrapper(*args, **kwargs):
+            if self.depth > 0:
+                return function(*args, **kwargs)
+            self.depth += 1
+            if self.allocations:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats["seconds"] += time.perf_counter() - start
+                stats["calls"] += 1
+                if self.allocations:
+                    current, peak = tracemalloc.get_traced_memory()
+                    stats["peak_bytes"] += peak - before
+                    stats["net_bytes"] += current - before
+                self.depth -= 1
+        return wrapper
+
+    def __enter__(self):
+        for stage, functions in STAGES:
+            for owner, name in functions:
+                # methods may be inherited, the wrapper then only shadows them
+                self.originals.append((owner, name, owner.__dict__.get(name)))
+                setattr(owner, name, self._wrap(stage, getattr(owner, name)))
+        if self.allocations:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.allocations:
+            tracemalloc.stop()
+        for owner, name, function in reversed(self.originals):
+            if function is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, function)
+        self.originals = []
+
+    def run(self, args, key, root, ks):
+        """Generate the samples ks and count the time left outside the stages.
+        Returns:
+            seconds(float): wall time of the samples
+        """
+        start = time.perf_counter()
+        for k in ks:
+            generator.generate_sample(args, key, root, k)
+        seconds = time.perf_counter() - start
+        self.stats["other"]["seconds"] += seconds - sum(stats["seconds"] for stage, stats in self.stats.items()
+                                                        if stage != "other")
+        return seconds
+
+
+def bench_config(args, key, root):
+    """Time the stages of args.num_samples samples of a configuration, then generate them again
+    under tracemalloc for the allocations, which slows them down too much to time them.
+    Returns:
+        result(dict): JSON-serializable stage report of the configuration
+    """
+    ks = list(range(args.num_samples))
+    with StageProfiler() as timing:
+        seconds = timing.run(args, key, root, ks)
+    with StageProfiler(allocations=True) as memory:
+        memory.run(args, key, root, ks)
+    stages = dict()
+    for stage in timing.stats:
+        stages[stage] = {"calls_per_sample": float(timing.stats[stage]["calls"]) / len(ks),
+                         "ms_per_sample": timing.stats[stage]["seconds"] * 1000.0 / len(ks),
+                         "share": timing.stats[stage]["seconds"] / seconds,
+                         "peak_kib_per_sample": memory.stats[stage]["peak_bytes"] / 1024.0 / len(ks),
+                         "net_kib_per_sample": memory.stats[stage]["net_bytes"] / 1024.0 / len(ks)}
+    return {"samples": len(ks), "ms_per_sample": seconds * 1000.0 / len(ks), "stages": stages}
+
+
+def print_report(report, baseline=None):
+    """Print the stage times of every configuration, with their ratio to a previous report.
+    """
+    for key, result in report["configs"].items():
+        print("{} ({:.1f} ms/sample)".format(key, result["ms_per_sample"]))
+        print("  {:<18} {:>10} {:>8} {:>12} {:>12} {:>10}".format("stage", "ms/smp", "share", "peak KiB", "net KiB",
+                                                                   "vs base"))
+        for stage, stats in result["stages"].items():
+            ratio = ""
+            if baseline is not None and key in baseline["configs"]:
+                before = baseline["configs"][key]["stages"].get(stage, {}).get("ms_per_sample")
+                if before:
+                    ratio = "{:.2f}x".format(stats["ms_per_sample"] / before)
+            print("  {:<18} {:>10.2f} {:>7.1%} {:>12.1f} {:>12.1f} {:>10}".format(
+                stage, stats["ms_per_sample"], stats["share"], stats["peak_kib_per_sample"],
+                stats["net_kib_per_sample"], ratio))
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="time and trace the allocations of each stage of sample generation")
+    main_arg_parser.add_argument("--num-samples", type=int, default=20,
+                                 help="number of samples for each component configuration")
+    main_arg_parser.add_argument("--seed", type=int, default=1234,
+                                 help="random seed for dataset generation")
+    main_arg_parser.add_argument("--config", type=str, nargs="+", default=None,
+                                 help="configurations to benchmark, defaults to all")
+    main_arg_parser.add_argument("--atlas", type=str, default="",
+                                 help="path to a sprite atlas built by atlas.py, used to render entities")
+    main_arg_parser.add_argument("--rule-tables", type=str, default="",
+                                 help="path to folder caching the feasible rule tables; empty to sample rules by rejection")
+    main_arg_parser.add_argument("--metadata", type=str, default="xml", choices=["xml", "record"],
+                                 help="metadata written with each sample, see main.py")
+    main_arg_parser.add_argument("--output", type=str, default="bench_stages.json",
+                                 help="path of the JSON report")
+    main_arg_parser.add_argument("--baseline", type=str, default="",
+                                 help="JSON report of a previous run to compare the stage times with")
+    args = main_arg_parser.parse_args()
+    args.val = 2
+    args.test = 2
+    args.bbox_table = ""
+
+    rng = np.random.default_rng(args.seed)
+    all_configs = {"center_single": build_center_single(rng),
+                   "distribute_four": build_distribute_four(rng),
+                   "distribute_nine": build_distribute_nine(rng),
+                   "left_center_single_right_center_single": build_left_center_single_right_center_single(rng),
+                   "up_center_single_down_center_single": build_up_center_single_down_center_single(rng),
+                   "in_center_single_out_center_single": build_in_center_single_out_center_single(rng),
+                   "in_distribute_four_out_center_single": build_in_distribute_four_out_center_single(rng)}
+    keys = args.config or list(all_configs.keys())
+    if args.rule_tables:
+        for key in keys:
+            all_configs[key].rule_table = rule_table.load_rule_table(args.rule_tables, key, all_configs[key])
+    if args.atlas:
+        use_sprite_atlas(SpriteAtlas(args.atlas))
+    use_bbox_table(load_bbox_table(args.bbox_table))
+
+    report = {"seed": args.seed,
+              "num_samples": args.num_samples,
+              "atlas": bool(args.atlas),
+              "rule_tables": bool(args.rule_tables),
+              "metadata": args.metadata,
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "configs": dict()}
+    with tempfile.TemporaryDirectory() as save_dir:
+        args.save_dir = save_dir
+        for key in keys:
+            os.mkdir(os.path.join(save_dir, key))
+            report["configs"][key] = bench_config(args, key, all_configs[key])
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Wrote {}".format(args.output), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ from constraints import (gen_entity_constraint, gen_layout_constraint,
                          rule_constraint)
 
 
-def build_center_single():
+def build_center_single(rng):
     # Build AoT here
     root = Root("Scene")
 
@@ -22,7 +22,7 @@ def build_center_single():
                                               [(0.5, 0.5, 1, 1)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("Center_Single", layout_constraint, entity_constraint, rng)
     comp.insert(layout)
 
     struct.insert(comp)
@@ -31,7 +31,7 @@ def build_center_single():
     return root
 
 
-def build_distribute_four():
+def build_distribute_four(rng):
     # Build AoT here
     root = Root("Scene")
 
@@ -50,7 +50,7 @@ def build_distribute_four():
                                                (0.75, 0.75, 0.5, 0.5)],
                                               num_min=0,
                                               num_max=3)
-    layout = Layout("Distribute_Four", layout_constraint, entity_constraint)
+    layout = Layout("Distribute_Four", layout_constraint, entity_constraint, rng)
     comp.insert(layout)
 
     struct.insert(comp)
@@ -59,7 +59,7 @@ def build_distribute_four():
     return root
 
 
-def build_distribute_nine():
+def build_distribute_nine(rng):
     # Build AoT here
     root = Root("Scene")
 
@@ -83,7 +83,7 @@ def build_distribute_nine():
                                                (0.83, 0.83, 0.33, 0.33)],
                                               num_min=0,
                                               num_max=8)
-    layout = Layout("Distribute_Nine", layout_constraint, entity_constraint)
+    layout = Layout("Distribute_Nine", layout_constraint, entity_constraint, rng)
     comp.insert(layout)
 
     struct.insert(comp)
@@ -92,7 +92,7 @@ def build_distribute_nine():
     return root
 
 
-def build_left_center_single_right_center_single():
+def build_left_center_single_right_center_single(rng):
     # Build AoT here
     root = Root("Scene")
 
@@ -108,7 +108,7 @@ def build_left_center_single_right_center_single():
                                               [(0.5, 0.25, 0.5, 0.5)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("Left_Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("Left_Center_Single", layout_constraint, entity_constraint, rng)
     comp_left.insert(layout)
 
     # Right Component
@@ -120,7 +120,7 @@ def build_left_center_single_right_center_single():
                                               [(0.5, 0.75, 0.5, 0.5)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("Right_Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("Right_Center_Single", layout_constraint, entity_constraint, rng)
     comp_right.insert(layout)
 
     struct.insert(comp_left)
@@ -130,7 +130,7 @@ def build_left_center_single_right_center_single():
     return root
 
 
-def build_up_center_single_down_center_single():
+def build_up_center_single_down_center_single(rng):
     # Build AoT here
     root = Root("Scene")
 
@@ -146,7 +146,7 @@ def build_up_center_single_down_center_single():
                                               [(0.25, 0.5, 0.5, 0.5)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("Up_Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("Up_Center_Single", layout_constraint, entity_constraint, rng)
     comp_up.insert(layout)
 
     # Down Component
@@ -158,7 +158,7 @@ def build_up_center_single_down_center_single():
                                               [(0.75, 0.5, 0.5, 0.5)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("Down_Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("Down_Center_Single", layout_constraint, entity_constraint, rng)
     comp_down.insert(layout)
 
     struct.insert(comp_up)
@@ -168,7 +168,7 @@ def build_up_center_single_down_center_single():
     return root
 
 
-def build_in_center_single_out_center_single():
+def build_in_center_single_out_center_single(rng):
     # Build AoT here
     root = Root("Scene")
 
@@ -186,7 +186,7 @@ def build_in_center_single_out_center_single():
                                               [(0.5, 0.5, 1, 1)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("Out_Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("Out_Center_Single", layout_constraint, entity_constraint, rng)
     comp_out.insert(layout)
 
     # In Component
@@ -198,7 +198,7 @@ def build_in_center_single_out_center_single():
                                               [(0.5, 0.5, 0.33, 0.33)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("In_Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("In_Center_Single", layout_constraint, entity_constraint, rng)
     comp_in.insert(layout)
 
     struct.insert(comp_out)
@@ -208,7 +208,7 @@ def build_in_center_single_out_center_single():
     return root
 
 
-def build_in_distribute_four_out_center_single():
+def build_in_distribute_four_out_center_single(rng):
     # Build AoT here
     root = Root("Scene")
 
@@ -226,7 +226,7 @@ def build_in_distribute_four_out_center_single():
                                               [(0.5, 0.5, 1, 1)],
                                               num_min=0,
                                               num_max=0)
-    layout = Layout("Out_Center_Single", layout_constraint, entity_constraint)
+    layout = Layout("Out_Center_Single", layout_constraint, entity_constraint, rng)
     comp_out.insert(layout)
 
     # In Component
@@ -241,7 +241,7 @@ def build_in_distribute_four_out_center_single():
                                                (0.58, 0.58, 0.15, 0.15)],
                                               num_min=0,
                                               num_max=3)
-    layout = Layout("In_Distribute_Four", layout_constraint, entity_constraint)
+    layout = Layout("In_Distribute_Four", layout_constraint, entity_constraint, rng)
     comp_in.insert(layout)
 
     struct.insert(comp_out)
@@ -249,10 +249,3 @@ def build_in_distribute_four_out_center_single():
     root.insert(struct)
 
     return root
-
-
-# --- 修复：添加 merge_component 到文件末尾 ---
-def merge_component(dst_aot, src_aot, component_idx):
-    src_component = src_aot.children[0].children[component_idx]
-    dst_aot.children[0].children[component_idx] = src_component
-# --- 修复结束 ---
\ No newline at end of file
@@ -1,6 +1,8 @@
 # 7w 144 143 center
 import os, glob, numpy as np
 
+from image_codec import decode_image
+
 dataset_dir = "./test4_10000"
 pattern = "**/*_*.npz"
 
@@ -12,7 +14,7 @@ bad = []
 for p in glob.glob(os.path.join(dataset_dir, pattern), recursive=True):
     try:
         with np.load(p) as d:
-            sz = d["image"].size
+            sz = decode_image(d).size
         if sz != expected_total:
             bad.append((p, sz))
             print(p)
@@ -38,6 +40,8 @@ import json
 import numpy as np
 import xml.etree.ElementTree as ET
 
+from image_codec import decode_image
+
 
 def panel_kind(idx, n_rows=3, n_cols=5):
     """
@@ -76,7 +80,7 @@ def inspect_sample(npz_path, black_threshold=5.0):
 
     # 1. 载入 npz
     data = np.load(npz_path, allow_pickle=True)
-    images = data["image"]  # (22, H, W)
+    images = decode_image(data)  # (22, H, W)
     target = int(data.get("target", -1))
     pred = int(data.get("predict", -1))
     print(f"target = {target}, pred = {pred}")
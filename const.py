@@ -10,6 +10,9 @@ CENTER = (IMAGE_SIZE // 2, IMAGE_SIZE // 2)
 DEFAULT_RADIUS = IMAGE_SIZE // 4
 DEFAULT_WIDTH = 2
 
+# Number of rendered entity layers kept per process (see rendering.render_entity_layer)
+RENDER_CACHE_SIZE = 2048
+
 # Attribute parameters
 # Number
 NUM_VALUES = [1, 2, 3, 4, 5, 6, 7, 8, 9]
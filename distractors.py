@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+
+from panel import CandidatePanel, compact_layout
+
+
+def make_delta(rng, answer_AoT, component_idx, attr_name, value):
+    """Turn a value sampled by Root.sample_new_value into a delta of CandidatePanel.
+    The modification is resolved against the answer as Layout._apply_new_value would do it:
+    entity levels are clipped to the range of each entity, and a new Number recreates the
+    entities of the component, drawing their attributes from rng.
+    Arguments:
+        rng(numpy.random.Generator): source of randomness
+        answer_AoT(Root): the answer panel
+        component_idx(int), attr_name(str), value(list): as for Root.apply_new_value
+    Returns:
+        delta(tuple): (component_idx, attr_name, value), see CandidatePanel
+    """
+    if not value:
+        return component_idx, attr_name, None
+    if attr_name == "Number":
+        new_AoT = answer_AoT.copy_component(component_idx)
+        new_AoT.apply_new_value(rng, component_idx, attr_name, value)
+        return component_idx, attr_name, compact_layout(new_AoT.children[0].children[component_idx])
+    if attr_name == "Position":
+        return component_idx, attr_name, np.asarray(value[0])
+    entities = answer_AoT.children[0].children[component_idx].children[0].children
+    levels = np.empty(len(entities), np.int64)
+    for index, entity in enumerate(entities):
+        attr = getattr(entity, attr_name.lower())
+        levels[index] = np.clip(value[index % len(value)], attr.min_level, attr.max_level)
+    return component_idx, attr_name, levels
+
+
+def build_candidates(rng, answer_AoT, answer_state, selected_attr, mode, attr_num):
+    """Build the I-RAVEN candidates as deltas of the answer: each modification is sampled
+    once and resolved once, then shared by every candidate it is applied to.
+    Number, if selected, must be the last attribute of selected_attr, as it recreates the
+    entities that the other attributes modify.
+    Arguments:
+        rng(numpy.random.Generator): source of randomness
+        answer_AoT(Root): the answer panel
+        answer_state(PanelState): the compact state of the answer
+        selected_attr(list): the attributes to modify, see sample_attr_avail
+        mode(str): 'Position-Number' if both are selected, else None
+        attr_num(int): number of attributes modified in the full tree of candidates
+    Returns:
+        candidates(list of CandidatePanel): the answer first, then the distractors
+    """
+    candidates = [CandidatePanel(answer_state)]
+    if len(selected_attr) >= 3:
+        mode_3 = None
+        if mode == 'Position-Number':
+            mode_3 = '3-Position-Number'
+        for i in range(attr_num):
+            component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[i][0], selected_attr[i][1], \
+                selected_attr[i][3], selected_attr[i][4], \
+                selected_attr[i][5]
+            value = answer_AoT.sample_new_value(rng, component_idx, attr_name, min_level, max_level, attr_uni,
+                                                mode_3)
+            if attr_name == "Number":
+                # every candidate recreates its own entities
+                candidates += [j.extend(make_delta(rng, answer_AoT, component_idx, attr_name, value))
+                               for j in list(candidates)]
+            else:
+                delta = make_delta(rng, answer_AoT, component_idx, attr_name, value)
+                candidates += [j.extend(delta) for j in list(candidates)]
+
+    elif len(selected_attr) == 2:
+        component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[0][0], selected_attr[0][1], \
+            selected_attr[0][3], selected_attr[0][4], \
+            selected_attr[0][5]
+        value = answer_AoT.sample_new_value(rng, component_idx, attr_name, min_level, max_level, attr_uni, None)
+        candidates.append(candidates[0].extend(make_delta(rng, answer_AoT, component_idx, attr_name, value)))
+        component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[1][0], selected_attr[1][1], \
+            selected_attr[1][3], selected_attr[1][4], \
+            selected_attr[1][5]
+        if mode == 'Position-Number':
+            ran, qu = 6, 1
+        else:
+            ran, qu = 3, 2
+        for i in range(ran):
+            value = answer_AoT.sample_new_value(rng, component_idx, attr_name, min_level, max_level, attr_uni, None)
+            delta = None
+            for j in range(qu):
+                if delta is None or attr_name == "Number":
+                    delta = make_delta(rng, answer_AoT, component_idx, attr_name, value)
+                candidates.append(candidates[j].extend(delta))
+
+    elif len(selected_attr) == 1:
+        component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[0][0], selected_attr[0][1], \
+            selected_attr[0][3], selected_attr[0][4], \
+            selected_attr[0][5]
+        for i in range(7):
+            value = answer_AoT.sample_new_value(rng, component_idx, attr_name, min_level, max_level, attr_uni, None)
+            candidates.append(candidates[0].extend(make_delta(rng, answer_AoT, component_idx, attr_name, value)))
+
+    return candidates
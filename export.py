@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from image_codec import decode_arrays
+from shards import INDEX_SUFFIX, ShardReader, load_index
+
+
+# arrays of a sample packed by export_config, plus "index", the sample index k of each row
+EXPORT_ARRAYS = ["image", "target", "predict", "meta_matrix", "meta_target"]
+EXPORT_PATTERN = "{}_{}.npy"
+SPLITS = ["train", "val", "test"]
+
+
+def export_path(export_dir, key, split, name):
+    return os.path.join(export_dir, key, EXPORT_PATTERN.format(split, name))
+
+
+def list_samples(save_dir, key):
+    """Find the samples of a configuration, written either as files or as tar shards.
+    Returns:
+        samples(dict): split -> sorted list of (k, source), where source is the .npz path
+            or the path of the shard holding the sample
+    """
+    samples = dict((split, []) for split in SPLITS)
+    for path in glob.glob(os.path.join(save_dir, key, "RAVEN_*_*.npz")):
+        _, k, split = os.path.basename(path)[:-len(".npz")].split("_")
+        samples[split].append((int(k), path))
+    for index_path in glob.glob(os.path.join(save_dir, key, "shard-*.tar" + INDEX_SUFFIX)):
+        shard = index_path[:-len(INDEX_SUFFIX)]
+        for record in load_index(shard):
+            samples[record["set"]].append((record["k"], shard))
+    for split in SPLITS:
+        samples[split].sort()
+    return samples
+
+
+def read_sample(source, k, readers):
+    """Read the arrays of a sample listed by list_samples, with its image stack decoded.
+    Shards are opened once and kept in readers.
+    """
+    if source.endswith(".npz"):
+        with np.load(source) as data:
+            arrays = decode_arrays(data)
+            return dict((name, arrays[name]) for name in EXPORT_ARRAYS)
+    if source not in readers:
+        readers[source] = ShardReader(source)
+    arrays, _ = readers[source].read(k)
+    return decode_arrays(arrays)
+
+
+def export_config(save_dir, export_dir, key):
+    """Pack the samples of a configuration into one .npy file per split and array, with
+    one row per sample in increasing k: e.g. train_image.npy is a (N, 22, 160, 160) uint8 array.
+    The files are written under temporary names and moved into place once complete.
+    """
+    if not os.path.exists(os.path.join(export_dir, key)):
+        os.makedirs(os.path.join(export_dir, key))
+    readers = dict()
+    try:
+        for split, samples in list_samples(save_dir, key).items():
+            if not samples:
+                continue
+            paths = dict((name, export_path(export_dir, key, split, name)) for name in EXPORT_ARRAYS + ["index"])
+            index = np.lib.format.open_memmap(paths["index"] + ".tmp", mode="w+",
+                                              dtype=np.int64, shape=(len(samples),))
+            outputs = dict()
+            for i, (k, source) in enumerate(samples):
+                arrays = read_sample(source, k, readers)
+                if not outputs:
+                    # the row shape and dtype of every array are taken from the first sample
+                    for name in EXPORT_ARRAYS:
+                        outputs[name] = np.lib.format.open_memmap(paths[name] + ".tmp", mode="w+",
+                                                                  dtype=arrays[name].dtype,
+                                                                  shape=(len(samples),) + arrays[name].shape)
+                for name in EXPORT_ARRAYS:
+                    outputs[name][i] = arrays[name]
+                index[i] = k
+            outputs["index"] = index
+            for output in outputs.values():
+                output.flush()
+            outputs = index = None
+            for path in paths.values():
+                os.replace(path + ".tmp", path)
+    finally:
+        for reader in readers.values():
+            reader.close()
+
+
+def load_export(export_dir, key, split):
+    """Open the packed arrays of a configuration and split without reading them.
+    Returns:
+        arrays(dict): name -> read-only memory-mapped array, see EXPORT_ARRAYS
+    """
+    return dict((name, np.load(export_path(export_dir, key, split, name), mmap_mode="r"))
+                for name in EXPORT_ARRAYS + ["index"])
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="pack a generated I-RAVEN dataset into memory-mappable arrays")
+    main_arg_parser.add_argument("--save-dir", type=str, default="dataset",
+                                 help="path to folder where the dataset was generated")
+    main_arg_parser.add_argument("--export-dir", type=str, default="",
+                                 help="path to folder for the packed arrays, defaults to save-dir")
+    main_arg_parser.add_argument("--config", type=str, nargs="+", default=None,
+                                 help="configurations to pack, defaults to all the folders of save-dir")
+    args = main_arg_parser.parse_args()
+
+    export_dir = args.export_dir or args.save_dir
+    keys = args.config
+    if keys is None:
+        keys = sorted(name for name in os.listdir(args.save_dir)
+                      if os.path.isdir(os.path.join(args.save_dir, name)))
+    for key in keys:
+        export_config(args.save_dir, export_dir, key)
+        print("Exported {}".format(key))
+
+
+if __name__ == "__main__":
+    main()
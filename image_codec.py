@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+
+import functools
+import zlib
+
+import numpy as np
+
+
+IMAGE_CODECS = ["raw", "zlib", "zstd", "lz4"]
+# none: the pixels; sub/up: PNG-style difference with the pixel on the left/above;
+# pack: indices in the gray levels of the sample, bit-packed when at most 16 levels occur
+IMAGE_FILTERS = ["none", "sub", "up", "pack"]
+# compression level of each codec when none is given
+DEFAULT_LEVELS = {"raw": 0, "zlib": 6, "zstd": 3, "lz4": 0}
+# prefix of the arrays an encoded image stack is stored as, instead of "image"
+IMAGE_PREFIX = "image_"
+
+
+@functools.lru_cache(maxsize=None)
+def codec_functions(codec, level):
+    """Compression and decompression functions of a codec, bytes -> bytes. zstd and lz4
+    need the optional zstandard and lz4 packages.
+    """
+    if codec == "raw":
+        return bytes, bytes
+    if codec == "zlib":
+        return functools.partial(zlib.compress, level=level), zlib.decompress
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("the zstd codec needs the zstandard package")
+        return zstandard.ZstdCompressor(level=level).compress, zstandard.ZstdDecompressor().decompress
+    if codec == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ValueError("the lz4 codec needs the lz4 package")
+        return functools.partial(lz4.frame.compress, compression_level=level), lz4.frame.decompress
+    raise ValueError("Unsupported image codec {}".format(codec))
+
+
+def _pack_bits(levels):
+    """Smallest number of bits per pixel, among 1, 2, 4 and 8, to index levels gray levels."""
+    for bits in (1, 2, 4):
+        if levels <= 1 << bits:
+            return bits
+    return 8
+
+
+def _filter(image, filter):
+    """Apply a filter to every panel of image.
+    Returns:
+        rows(np.ndarray): (P, N) uint8, the filtered bytes of each panel
+        palette(np.ndarray): the gray levels indexed by pack, empty for the other filters
+    """
+    palette = np.zeros(0, np.uint8)
+    if filter == "sub":
+        # uint8 的差分按 256 取模，可由 cumsum 精确还原
+        image = np.diff(image, axis=-1, prepend=np.uint8(0))
+    elif filter == "up":
+        image = np.diff(image, axis=-2, prepend=np.uint8(0))
+    elif filter == "pack":
+        # uint8 只有 256 个灰度：用计数表代替 np.unique 和 searchsorted
+        present = np.bincount(image.ravel(), minlength=256) > 0
+        palette = np.flatnonzero(present).astype(np.uint8)
+        image = (np.cumsum(present) - 1).astype(np.uint8)[image]
+        bits = _pack_bits(len(palette))
+        if bits < 8:
+            per_byte = 8 // bits
+            rows = image.reshape(len(image), -1)
+            rows = np.pad(rows, ((0, 0), (0, -rows.shape[1] % per_byte))).reshape(len(image), -1, per_byte)
+            shifts = (np.arange(per_byte)[::-1] * bits).astype(np.uint8)
+            return np.bitwise_or.reduce(rows << shifts, axis=-1).astype(np.uint8), palette
+    elif filter != "none":
+        raise ValueError("Unsupported image filter {}".format(filter))
+    return image.reshape(len(image), -1), palette
+
+
+def _unfilter(rows, filter, palette, shape):
+    """Inverse of _filter."""
+    if filter == "pack":
+        bits = _pack_bits(len(palette))
+        if bits < 8:
+            per_byte = 8 // bits
+            shifts = (np.arange(per_byte)[::-1] * bits).astype(np.uint8)
+            rows = ((rows[..., np.newaxis] >> shifts) & ((1 << bits) - 1)).reshape(len(rows), -1)
+            rows = rows[:, :int(np.prod(shape[1:]))]
+        return palette[rows].reshape(shape)
+    image = rows.reshape(shape)
+    if filter == "sub":
+        return np.cumsum(image, axis=-1, dtype=np.uint8)
+    if filter == "up":
+        return np.cumsum(image, axis=-2, dtype=np.uint8)
+    return image
+
+
+def encode_image(image, codec="raw", level=None, filter="none"):
+    """Encode an image stack panel by panel, so that a panel can be decoded on its own.
+    Arguments:
+        image(np.ndarray): (P, H, W) uint8
+        codec(str), filter(str): see IMAGE_CODECS and IMAGE_FILTERS
+        level(int): compression level, DEFAULT_LEVELS[codec] if None
+    Returns:
+        arrays(dict): {"image": image} with the raw codec and no filter, else the arrays
+            IMAGE_PREFIX + codec, filter, level, shape, palette, offsets and data, where
+            data[offsets[i]:offsets[i + 1]] is the i-th encoded panel
+    """
+    if codec == "raw" and filter == "none":
+        return {"image": image}
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    compress, _ = codec_functions(codec, level)
+    rows, palette = _filter(image, filter)
+    chunks = [compress(row.tobytes()) for row in rows]
+    arrays = dict(codec=np.array(codec),
+                  filter=np.array(filter),
+                  level=np.array(level),
+                  shape=np.array(image.shape, np.int64),
+                  palette=palette,
+                  offsets=np.cumsum([0] + [len(chunk) for chunk in chunks]).astype(np.int64),
+                  data=np.frombuffer(b"".join(chunks), np.uint8))
+    return dict((IMAGE_PREFIX + name, value) for name, value in arrays.items())
+
+
+def decode_image(arrays):
+    """The image stack of a sample, whether it was stored raw or by encode_image.
+    Arguments:
+        arrays(dict or NpzFile): the arrays of the sample
+    """
+    if "image" in arrays:
+        return arrays["image"]
+    codec = str(arrays[IMAGE_PREFIX + "codec"])
+    shape = tuple(int(size) for size in arrays[IMAGE_PREFIX + "shape"])
+    _, decompress = codec_functions(codec, int(arrays[IMAGE_PREFIX + "level"]))
+    data = arrays[IMAGE_PREFIX + "data"]
+    offsets = arrays[IMAGE_PREFIX + "offsets"]
+    chunks = [decompress(data[offsets[i]:offsets[i + 1]].tobytes()) for i in range(len(offsets) - 1)]
+    rows = np.frombuffer(b"".join(chunks), np.uint8).reshape(len(chunks), -1)
+    return _unfilter(rows, str(arrays[IMAGE_PREFIX + "filter"]), arrays[IMAGE_PREFIX + "palette"], shape)
+
+
+def decode_arrays(arrays):
+    """The arrays of a sample with its image stack decoded under "image"."""
+    if "image" in arrays:
+        return arrays
+    decoded = dict((name, value) for name, value in arrays.items() if not name.startswith(IMAGE_PREFIX))
+    decoded["image"] = decode_image(arrays)
+    return decoded
+
+
+# codec, level and filter of the images saved by the current process, see use_image_codec
+_image_codec = ("raw", None, "none")
+
+
+def use_image_codec(codec="raw", level=None, filter="none"):
+    """Set how the images of the samples generated by the current process are stored.
+    Raises ValueError if the codec is not available.
+    """
+    global _image_codec
+    if filter not in IMAGE_FILTERS:
+        raise ValueError("Unsupported image filter {}".format(filter))
+    codec_functions(codec, DEFAULT_LEVELS.get(codec) if level is None else level)
+    _image_codec = (codec, level, filter)
+
+
+def image_arrays(image):
+    """The arrays of the image stack of a sample, encoded as set by use_image_codec."""
+    return encode_image(image, *_image_codec)
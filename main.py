@@ -1,223 +1,329 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import copy
+import multiprocessing
 import os
-import random
+import zlib
 
 import numpy as np
-from tqdm import trange
+from tqdm import tqdm
 
+from atlas import SpriteAtlas
+from bbox_table import load_bbox_table, use_bbox_table
 from build_tree import (build_center_single, build_distribute_four,
                         build_distribute_nine,
                         build_in_center_single_out_center_single,
                         build_in_distribute_four_out_center_single,
                         build_left_center_single_right_center_single,
-                        build_up_center_single_down_center_single,
-                        merge_component)  # <-- 修复：从 build_tree 导入
-from const import IMAGE_SIZE
-from rendering import render_panel
+                        build_up_center_single_down_center_single)
+from distractors import build_candidates
+from export import export_config
+from image_codec import IMAGE_CODECS, IMAGE_FILTERS, image_arrays, use_image_codec
+import metrics
+from metadata import problem_record
+from panel import compact_panel
+from progress import (ProgressLog, completed_samples, sample_paths,
+                      split_name, write_manifest)
+from rendering import render_panels, use_sprite_atlas
+from Rule import apply_rule_group
+from rule_table import load_rule_table
 from sampling import sample_attr_avail, sample_rules
 from serialize import dom_problem, serialize_aot, serialize_rules
+from shards import ShardWriter, shard_path
 from solver import solve
-
-
-# --- 修复：删除这里的 merge_component 定义 ---
-# def merge_component(dst_aot, src_aot, component_idx):
-# ...
-# --- 修复结束 ---
-
-
-def separate(args, all_configs):
-    random.seed(args.seed)
-    np.random.seed(args.seed)
+from writer import WriteBehind, flush_writes, use_writer, write, write_sample_files
+
+
+def sample_seed(seed, key, k):
+    """Derive the seed of the k-th sample of configuration key from the run seed.
+    The seed only depends on (seed, key, k), so a sample is reproduced identically
+    no matter which worker generates it or in which order.
+    """
+    entropy = [seed, zlib.crc32(key.encode("utf-8")), k]
+    return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+
+def generate_sample(args, key, root, k, shard=None):
+    """Generate, solve and save the k-th sample of configuration key.
+    Arguments:
+        args(Namespace): parsed command line arguments
+        key(str): name of the configuration
+        root(Root): the abstract AoT of the configuration (is_pg=False)
+        k(int): index of the sample
+        shard(ShardWriter): shard to append the sample to; if None, the sample is saved
+            as its own .npz and .xml files
+    With --metadata record, no XML is written: the compact record of the problem is saved
+    with the arrays of the sample instead. The files are written by writer.write, in place
+    or behind the sample loop with --write-behind.
+    Returns:
+        record(dict): index, seed, split and whether the solver picks the right answer
+    """
+    sample_started = metrics.start()
+    seed = sample_seed(args.seed, key, k)
+    rng = np.random.default_rng(seed)
+    set_name = split_name(args, k)
 
     n_rows = 3
     n_columns = 5
     r_base = 2  # 基础列的数量 (t=0, t=1)，为 2-arity 规则提供输入
 
-    for key in list(all_configs.keys()):
-        acc = 0
-        for k in trange(args.num_samples):
-            count_num = k % 10
-            if count_num < (10 - args.val - args.test):
-                set_name = "train"
-            elif count_num < (10 - args.test):
-                set_name = "val"
-            else:
-                set_name = "test"
-
-            # root 是一个抽象的模板 (is_pg=False)
-            root = all_configs[key]
-
-            # 从抽象 root 确定组件数量
-            num_components = len(root.children[0].children)
-
-            # (3x5) 的面板网格
-            all_panels = [[None for _ in range(n_columns)] for _ in range(n_rows)]
-            all_column_rules = []  # 存储 t=2, 3, 4 列的规则
-
-            # --- 步骤 1: 生成基础列 (t=0, t=1) ---
-            for r in range(n_rows):
-                for t in range(r_base):
-                    panel = root.sample()
-                    panel.resample(change_number=True)
-                    all_panels[r][t] = panel
-                    # all_panels[r][t] = root.sample()
-
-            # --- 步骤 2: 生成递推列 (t=2, 3, 4) ---
-            for t in range(r_base, n_columns):
-                # column_rule_groups = sample_rules(num_components)
-                column_rule_groups = None
-                while True:
-                    candidate_rules = sample_rules(num_components)
-                    if root.prune(candidate_rules) is not None:
-                        column_rule_groups = candidate_rules
-                        break
-                all_column_rules.append(column_rule_groups)
-
-                for r in range(n_rows):
-                    previous_panels_in_row = all_panels[r][:t]
-                    final_panel_for_row_col = None
-
-                    for l in range(num_components):
-                        rule_group_for_comp = column_rule_groups[l]
-                        panel_template = copy.deepcopy(previous_panels_in_row[-1])
-                        panel_in_progress = None
-
-                        for i in range(len(rule_group_for_comp)):
-                            rule = rule_group_for_comp[i]
-
-                            arity = 1
-                            if rule.name in ["Arithmetic", "Distribute_Three"]:
-                                arity = 2
-
-                            input_panels = previous_panels_in_row[-arity:]
-                            in_aot = panel_template if i == 0 else panel_in_progress
-                            panel_in_progress = rule.apply_rule(input_panels, in_aot=in_aot)
-
-                        if l == 0:
-                            final_panel_for_row_col = panel_in_progress
-                        else:
-                            merge_component(final_panel_for_row_col, panel_in_progress, l)
-
-                    all_panels[r][t] = final_panel_for_row_col
-
-            # --- 步骤 3: 准备上下文、答案和候选 ---
-            answer_AoT = all_panels[n_rows - 1][n_columns - 1]
-            context_list_flat = [p for row in all_panels for p in row]
-            answer_index = (n_rows * n_columns) - 1
-            context_list_flat[answer_index] = None
-            imgs = [render_panel(p) if p is not None else np.zeros((IMAGE_SIZE, IMAGE_SIZE), np.uint8) for p in
-                    context_list_flat]
-            full_context_aot = [p for p in context_list_flat if p is not None]
-
-            # --- 步骤 4: 生成干扰项 (I-RAVEN version)---
-            rules_for_last_step = all_column_rules[-1]
-            modifiable_attr = sample_attr_avail(rules_for_last_step, answer_AoT)
-            candidates = [answer_AoT]
-
-            attr_num = 3
-            if attr_num <= len(modifiable_attr):
-                idx = np.random.choice(len(modifiable_attr), attr_num, replace=False)
-                selected_attr = [modifiable_attr[i] for i in idx]
+    # 从抽象 root 确定组件数量
+    num_components = len(root.children[0].children)
+
+    # (3x5) 的面板网格
+    all_panels = [[None for _ in range(n_columns)] for _ in range(n_rows)]
+    all_column_rules = []  # 存储 t=2, 3, 4 列的规则
+
+    # --- 步骤 1: 生成基础列 (t=0, t=1) ---
+    for r in range(n_rows):
+        for t in range(r_base):
+            panel = root.sample(rng)
+            panel.resample(rng, change_number=True)
+            all_panels[r][t] = panel
+            # all_panels[r][t] = root.sample()
+
+    # --- 步骤 2: 生成递推列 (t=2, 3, 4) ---
+    for t in range(r_base, n_columns):
+        # column_rule_groups = sample_rules(num_components)
+        column_rule_groups = None
+        if root.rule_table is not None:
+            column_rule_groups = root.rule_table.sample(rng)
+        while column_rule_groups is None:
+            candidate_rules = sample_rules(rng, num_components)
+            metrics.count("rule_draws")
+            if root.feasible(candidate_rules):
+                column_rule_groups = candidate_rules
             else:
-                selected_attr = modifiable_attr
-
-            mode = None
-            pos = [i for i in range(len(selected_attr)) if selected_attr[i][1] == 'Number']
-            if pos:
-                pos = pos[0]
-                selected_attr[pos], selected_attr[-1] = selected_attr[-1], selected_attr[pos]
-
-                pos = [i for i in range(len(selected_attr)) if selected_attr[i][1] == 'Position']
-                if pos:
-                    mode = 'Position-Number'
-            values = []
-            if len(selected_attr) >= 3:
-                mode_3 = None
-                if mode == 'Position-Number':
-                    mode_3 = '3-Position-Number'
-                for i in range(attr_num):
-                    component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[i][0], selected_attr[i][1], \
-                        selected_attr[i][3], selected_attr[i][4], \
-                        selected_attr[i][5]
-                    value = answer_AoT.sample_new_value(component_idx, attr_name, min_level, max_level, attr_uni,
-                                                        mode_3)
-                    values.append(value)
-                    tmp = []
-                    for j in candidates:
-                        new_AoT = copy.deepcopy(j)
-                        new_AoT.apply_new_value(component_idx, attr_name, value)
-                        tmp.append(new_AoT)
-                    candidates += tmp
-
-            elif len(selected_attr) == 2:
-                component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[0][0], selected_attr[0][1], \
-                    selected_attr[0][3], selected_attr[0][4], \
-                    selected_attr[0][5]
-                value = answer_AoT.sample_new_value(component_idx, attr_name, min_level, max_level, attr_uni, None)
-                values.append(value)
-                new_AoT = copy.deepcopy(answer_AoT)
-                new_AoT.apply_new_value(component_idx, attr_name, value)
-                candidates.append(new_AoT)
-                component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[1][0], selected_attr[1][1], \
-                    selected_attr[1][3], selected_attr[1][4], \
-                    selected_attr[1][5]
-                if mode == 'Position-Number':
-                    ran, qu = 6, 1
-                else:
-                    ran, qu = 3, 2
-                for i in range(ran):
-                    value = answer_AoT.sample_new_value(component_idx, attr_name, min_level, max_level, attr_uni, None)
-                    values.append(value)
-                    for j in range(qu):
-                        new_AoT = copy.deepcopy(candidates[j])
-                        new_AoT.apply_new_value(component_idx, attr_name, value)
-                        candidates.append(new_AoT)
-
-            elif len(selected_attr) == 1:
-                component_idx, attr_name, min_level, max_level, attr_uni = selected_attr[0][0], selected_attr[0][1], \
-                    selected_attr[0][3], selected_attr[0][4], \
-                    selected_attr[0][5]
-                for i in range(7):
-                    value = answer_AoT.sample_new_value(component_idx, attr_name, min_level, max_level, attr_uni, None)
-                    values.append(value)
-                    new_AoT = copy.deepcopy(answer_AoT)
-                    new_AoT.apply_new_value(component_idx, attr_name, value)
-                    candidates.append(new_AoT)
-
-            random.shuffle(candidates)
-            answers = []
-            for candidate in candidates:
-                answers.append(render_panel(candidate))
-
-
-            # --- 步骤 5: 求解 ---
-            context_panels_for_solver = all_panels[n_rows - 1][n_columns - r_base: n_columns - 1]
-            image = imgs[:-1] + answers
-            target = candidates.index(answer_AoT)
-
-            predicted = solve(rules_for_last_step, context_panels_for_solver, candidates)
-
-            # --- 步骤 6: 序列化 ---
-            meta_matrix, meta_target = serialize_rules(rules_for_last_step)
-            structure, meta_structure = serialize_aot(all_panels[0][0])
-
-            np.savez("{}/{}/RAVEN_{}_{}.npz".format(args.save_dir, key, k, set_name), image=image,
-                     target=target,
-                     predict=predicted,
-                     meta_matrix=meta_matrix,
-                     meta_target=meta_target,
-                     structure=structure,
-                     meta_structure=meta_structure)
-            with open("{}/{}/RAVEN_{}_{}.xml".format(args.save_dir, key, k, set_name), "wb") as f:
-                dom = dom_problem(full_context_aot + candidates, all_column_rules)
-                f.write(dom)
-
-            if target == predicted:
-                acc += 1
-        print(("Accuracy of {}: {}".format(key, float(acc) / args.num_samples)))
+                metrics.count("rule_rejections")
+        all_column_rules.append(column_rule_groups)
+
+        for r in range(n_rows):
+            previous_panels_in_row = all_panels[r][:t]
+            final_panel_for_row_col = None
+
+            for l in range(num_components):
+                # each component is copied once from the previous panel into the new one,
+                # then all the rules of its group are applied to it in place
+                final_panel_for_row_col = apply_rule_group(rng, column_rule_groups[l], previous_panels_in_row,
+                                                           final_panel_for_row_col)
+
+            all_panels[r][t] = final_panel_for_row_col
+
+    # --- 步骤 3: 准备上下文、答案和候选 ---
+    answer_AoT = all_panels[n_rows - 1][n_columns - 1]
+    context_list_flat = [p for row in all_panels for p in row]
+    answer_index = (n_rows * n_columns) - 1
+    context_list_flat[answer_index] = None
+    full_context_aot = [p for p in context_list_flat if p is not None]
+
+    # --- 步骤 4: 生成干扰项 (I-RAVEN version)---
+    rules_for_last_step = all_column_rules[-1]
+    modifiable_attr = sample_attr_avail(rules_for_last_step, answer_AoT)
+    attr_num = 3
+    if attr_num <= len(modifiable_attr):
+        idx = rng.choice(len(modifiable_attr), attr_num, replace=False)
+        selected_attr = [modifiable_attr[i] for i in idx]
+    else:
+        selected_attr = modifiable_attr
+
+    mode = None
+    pos = [i for i in range(len(selected_attr)) if selected_attr[i][1] == 'Number']
+    if pos:
+        pos = pos[0]
+        selected_attr[pos], selected_attr[-1] = selected_attr[-1], selected_attr[pos]
+
+        pos = [i for i in range(len(selected_attr)) if selected_attr[i][1] == 'Position']
+        if pos:
+            mode = 'Position-Number'
+    candidates = build_candidates(rng, answer_AoT, compact_panel(answer_AoT), selected_attr, mode, attr_num)
+    answer_candidate = candidates[0]
+
+    candidates = [candidates[i] for i in rng.permutation(len(candidates))]
+    target = candidates.index(answer_candidate)
+    # the finished panels are only read from here on, keep their compact state;
+    # the candidates are built from their deltas when first rendered
+    states = dict((id(panel), compact_panel(panel)) for panel in full_context_aot)
+    full_context_aot = [states[id(panel)] for panel in full_context_aot]
+    # 14 个上下文面板 + 候选，一次批量渲染
+    started = metrics.start()
+    image = render_panels(full_context_aot + candidates)
+    metrics.stop("render_seconds", started)
+
+    # --- 步骤 5: 求解 ---
+    context_panels_for_solver = [states[id(panel)]
+                                 for panel in all_panels[n_rows - 1][n_columns - r_base: n_columns - 1]]
+
+    started = metrics.start()
+    predicted = solve(rng, rules_for_last_step, context_panels_for_solver, candidates)
+    metrics.stop("solve_seconds", started)
+
+    # --- 步骤 6: 序列化 ---
+    started = metrics.start()
+    meta_matrix, meta_target = serialize_rules(rules_for_last_step)
+    structure, meta_structure = serialize_aot(all_panels[0][0])
+
+    # the image stack is stored as set by --image-codec, see image_codec.py
+    arrays = image_arrays(image)
+    arrays.update(target=target,
+                  predict=predicted,
+                  meta_matrix=meta_matrix,
+                  meta_target=meta_target,
+                  structure=structure,
+                  meta_structure=meta_structure)
+    if args.metadata == "record":
+        # the XML is left to a post-pass, see metadata.py
+        arrays.update(problem_record(full_context_aot + candidates, all_column_rules))
+        dom = None
+    else:
+        dom = dom_problem(full_context_aot + candidates, all_column_rules)
+    metrics.stop("serialize_seconds", started)
+    correct = bool(target == predicted)
+    started = metrics.start()
+    if shard is not None:
+        write(shard.add, k, set_name, arrays, dom, correct)
+    else:
+        # write to temporary files first so that an interrupted run never leaves a truncated sample
+        npz_path, xml_path = sample_paths(args.save_dir, key, k, set_name)
+        write(write_sample_files, npz_path, xml_path, arrays, dom)
+    metrics.stop("write_seconds", started)
+    metrics.count("samples")
+    metrics.stop("sample_seconds", sample_started)
+
+    return {"k": k, "seed": seed, "set": set_name, "correct": correct}
+
+
+def shard_samples(pending, shard_size):
+    """Split the pending (config, k) sample space into shards of at most shard_size samples.
+    Arguments:
+        pending(dict): configuration -> sorted list of sample indices to generate
+    """
+    shards = []
+    for key in list(pending.keys()):
+        ks = pending[key]
+        for start in range(0, len(ks), shard_size):
+            shards.append((key, ks[start:start + shard_size]))
+    return shards
+
+
+def generate_shard(args, key, root, ks):
+    """Generate the samples ks of configuration key. With --format tar they are stored in
+    one shard file, and their records are only yielded once the shard is complete.
+    Yields:
+        record(dict): the record of each sample, see generate_sample
+    """
+    if args.format != "tar":
+        for k in ks:
+            yield generate_sample(args, key, root, k)
+        return
+    shard = ShardWriter(shard_path(args.save_dir, key, ks[0]))
+    records = [generate_sample(args, key, root, k, shard) for k in ks]
+    write(shard.finish)
+    for record in records:
+        yield record
+
+
+# state of a worker process, set once by init_worker
+_worker_state = {}
+
+
+def init_worker(args, all_configs):
+    _worker_state["args"] = args
+    _worker_state["all_configs"] = all_configs
+    if args.atlas:
+        use_sprite_atlas(SpriteAtlas(args.atlas))
+    use_bbox_table(load_bbox_table(args.bbox_table))
+    use_image_codec(args.image_codec, args.image_level, args.image_filter)
+    metrics.enable_metrics(bool(args.metrics))
+    if args.write_behind > 0:
+        use_writer(WriteBehind(args.write_behind, args.write_batch, args.fsync))
+    else:
+        use_writer(None, args.fsync)
+
+
+def run_shard(shard):
+    """Returns:
+        key(str), records(list): the configuration and the records of the samples
+        snapshot(dict): the metrics counted since the previous shard of the worker, see metrics.drain_metrics
+    """
+    key, ks = shard
+    args = _worker_state["args"]
+    root = _worker_state["all_configs"][key]
+    records = list(generate_shard(args, key, root, ks))
+    # the parent logs the samples as done, they must be on disk by then
+    flush_writes()
+    return key, records, metrics.drain_metrics()
+
+
+def separate(args, all_configs):
+    keys = list(all_configs.keys())
+    write_manifest(args, args.resume)
+    if args.atlas:
+        use_sprite_atlas(SpriteAtlas(args.atlas))
+    use_bbox_table(load_bbox_table(args.bbox_table))
+    use_image_codec(args.image_codec, args.image_level, args.image_filter)
+    metrics.enable_metrics(bool(args.metrics))
+    exporter = None
+    if args.metrics:
+        exporter = metrics.MetricsExporter(args.metrics, args.metrics_format, args.metrics_interval)
+    writer = None
+    if args.write_behind > 0 and args.workers <= 1:
+        writer = WriteBehind(args.write_behind, args.write_batch, args.fsync)
+    use_writer(writer, args.fsync)
+
+    # with --resume, samples already on disk are counted but not generated again
+    acc = dict()
+    pending = dict()
+    for key in keys:
+        done = completed_samples(args, key) if args.resume else dict()
+        acc[key] = sum(done.values())
+        pending[key] = [k for k in range(args.num_samples) if k not in done]
+        if done:
+            print("Resuming {}: {} of {} samples already done".format(key, len(done), args.num_samples))
+    progress = dict((key, ProgressLog(args.save_dir, key, args.resume)) for key in keys)
+
+    try:
+        if args.workers <= 1:
+            for key in keys:
+                with tqdm(total=len(pending[key])) as pbar:
+                    for _, ks in shard_samples({key: pending[key]}, args.shard_size):
+                        records = []
+                        for record in generate_shard(args, key, all_configs[key], ks):
+                            records.append(record)
+                            pbar.update(1)
+                            if exporter is not None:
+                                exporter.maybe_export()
+                        # as in run_shard, the samples are only logged as done once on disk
+                        flush_writes()
+                        for record in records:
+                            progress[key].log(record)
+                            acc[key] += record["correct"]
+                print(("Accuracy of {}: {}".format(key, float(acc[key]) / args.num_samples)))
+            return
+
+        shards = shard_samples(pending, args.shard_size)
+        with multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(args, all_configs)) as pool, \
+                tqdm(total=sum(len(ks) for ks in pending.values())) as pbar:
+            for key, records, snapshot in pool.imap_unordered(run_shard, shards):
+                for record in records:
+                    progress[key].log(record)
+                    acc[key] += record["correct"]
+                pbar.update(len(records))
+                if exporter is not None:
+                    exporter.add(snapshot)
+                    exporter.maybe_export()
+        for key in keys:
+            print(("Accuracy of {}: {}".format(key, float(acc[key]) / args.num_samples)))
+    finally:
+        try:
+            if writer is not None:
+                use_writer(None, args.fsync)
+                writer.close()
+        finally:
+            # a failed write is raised once the logs and metrics are closed
+            for log in progress.values():
+                log.close()
+            if exporter is not None:
+                exporter.close()
 
 
 def main():
@@ -234,18 +340,75 @@ def main():
                                  help="the proportion of the size of validation set")
     main_arg_parser.add_argument("--test", type=float, default=2,
                                  help="the proportion of the size of test set")
+    main_arg_parser.add_argument("--workers", type=int, default=1,
+                                 help="number of worker processes; samples are split into shards across them")
+    main_arg_parser.add_argument("--shard-size", type=int, default=100,
+                                 help="number of consecutive samples of a configuration handled by one worker task")
+    main_arg_parser.add_argument("--atlas", type=str, default="",
+                                 help="path to a sprite atlas built by atlas.py, used to render entities")
+    main_arg_parser.add_argument("--resume", type=int, default=0,
+                                 help="whether to skip samples already saved in save-dir by an interrupted run")
+    main_arg_parser.add_argument("--format", type=str, default="files", choices=["files", "tar"],
+                                 help="files: one .npz and one .xml per sample; "
+                                      "tar: one tar file and offset index per shard of samples")
+    main_arg_parser.add_argument("--rule-tables", type=str, default="",
+                                 help="path to folder caching the feasible rule tables built by rule_table.py, "
+                                      "built there on first use; the rules are then drawn from these tables, with "
+                                      "the same distribution as rejection sampling but a different random stream, "
+                                      "so the samples differ for the same seed. Empty to sample rules by rejection")
+    main_arg_parser.add_argument("--bbox-table", type=str, default="",
+                                 help="path to the real bounding box table built by bbox_table.py; "
+                                      "empty to build it in memory at startup")
+    main_arg_parser.add_argument("--metadata", type=str, default="xml", choices=["xml", "record"],
+                                 help="xml: write the XML metadata of every sample; record: save a compact record "
+                                      "of the problem with its arrays, the XML is written by metadata.py")
+    main_arg_parser.add_argument("--export", type=int, default=0,
+                                 help="whether to also pack each configuration and split into memory-mappable "
+                                      "arrays once generated, see export.py")
+    main_arg_parser.add_argument("--metrics", type=str, default="",
+                                 help="path of the metrics file (sample rate, retry counters, stage latencies); "
+                                      "empty to disable metrics")
+    main_arg_parser.add_argument("--metrics-format", type=str, default="jsonl", choices=["jsonl", "prometheus"],
+                                 help="jsonl: append a JSON line per export; prometheus: rewrite a textfile "
+                                      "for the node_exporter textfile collector")
+    main_arg_parser.add_argument("--metrics-interval", type=float, default=10.0,
+                                 help="minimum number of seconds between two exports of the metrics")
+    main_arg_parser.add_argument("--write-behind", type=int, default=0,
+                                 help="number of samples that may wait in the queue of a writer thread; "
+                                      "0 to write each sample in the sample loop")
+    main_arg_parser.add_argument("--write-batch", type=int, default=8,
+                                 help="maximum number of queued samples the writer thread writes at once")
+    main_arg_parser.add_argument("--fsync", type=str, default="none", choices=["none", "file", "batch"],
+                                 help="none: leave the files to the page cache; file: fsync each file before "
+                                      "moving it into place; batch: fsync the files of a batch together")
+    main_arg_parser.add_argument("--image-codec", type=str, default="raw", choices=IMAGE_CODECS,
+                                 help="compression of the image stack of each sample, panel by panel; zstd and "
+                                      "lz4 need the zstandard and lz4 packages, see bench_codecs.py")
+    main_arg_parser.add_argument("--image-level", type=int, default=None,
+                                 help="compression level of the image codec, defaults to the codec default")
+    main_arg_parser.add_argument("--image-filter", type=str, default="none", choices=IMAGE_FILTERS,
+                                 help="transform of the panels before compression: sub/up PNG-style row "
+                                      "filtering, pack bit-packing of the gray levels")
     args = main_arg_parser.parse_args()
+    # the two ways of drawing rules give different samples for the same seed, see write_manifest
+    args.rule_draw = "table" if args.rule_tables else "rejection"
 
+    # the abstract trees sample their initial layouts while being built
+    rng = np.random.default_rng(args.seed)
     all_configs = {
-                    "center_single": build_center_single(),
-                   "distribute_four": build_distribute_four(),
-                   "distribute_nine": build_distribute_nine(),
-                   "left_center_single_right_center_single": build_left_center_single_right_center_single(),
-                   "up_center_single_down_center_single": build_up_center_single_down_center_single(),
-                   "in_center_single_out_center_single": build_in_center_single_out_center_single(),
-                   "in_distribute_four_out_center_single": build_in_distribute_four_out_center_single()
+                    "center_single": build_center_single(rng),
+                   "distribute_four": build_distribute_four(rng),
+                   "distribute_nine": build_distribute_nine(rng),
+                   "left_center_single_right_center_single": build_left_center_single_right_center_single(rng),
+                   "up_center_single_down_center_single": build_up_center_single_down_center_single(rng),
+                   "in_center_single_out_center_single": build_in_center_single_out_center_single(rng),
+                   "in_distribute_four_out_center_single": build_in_distribute_four_out_center_single(rng)
     }
 
+    if args.rule_tables:
+        for key in list(all_configs.keys()):
+            all_configs[key].rule_table = load_rule_table(args.rule_tables, key, all_configs[key])
+
     if not os.path.exists(args.save_dir):
         os.mkdir(args.save_dir)
     if not args.fuse:
@@ -253,6 +416,9 @@ def main():
             if not os.path.exists(os.path.join(args.save_dir, key)):
                 os.mkdir(os.path.join(args.save_dir, key))
         separate(args, all_configs)
+        if args.export:
+            for key in list(all_configs.keys()):
+                export_config(args.save_dir, args.save_dir, key)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from api import get_mask, rle_encode_batch, rle_format
+from bbox_table import load_bbox_table, real_bbox, use_bbox_table
+from Attribute import position_mask
+from const import ANGLE_VALUES, SIZE_VALUES, TYPE_VALUES
+from export import SPLITS, list_samples
+from panel import as_panel_state
+from progress import sample_paths
+from shards import ShardReader
+from solver import RULE_ATTRS, RULE_NAMES, rule_features, stack_features
+
+
+# arrays of a problem record, stored with the arrays of the sample
+RECORD_PREFIX = "record_"
+# 14 个上下文面板，其后为候选
+NUM_CONTEXT_PANELS = (3 * 5) - 1
+
+
+def problem_record(instances, all_column_rules):
+    """Compact structured metadata of a problem, cheap enough to build for every sample: the
+    value levels of every panel and the rule tables. The derived fields of the XML (real_bbox,
+    RLE masks) are only computed by record_xml.
+    Arguments:
+        instances(list): 14 context panels then the candidates, Root, PanelState or CandidatePanel
+        all_column_rules(list of list of list of Rule): the rule groups of the columns t=2, t=3, t=4
+    Returns:
+        record(dict): arrays named RECORD_PREFIX + name, P panels and C components:
+            structure(P,), component(P, C), layout(P, C): names
+            position_tables(T,): the position tables, JSON encoded
+            position_table(P, C): index in position_tables of the table of each layout
+            number(P, C), uniformity(P, C): value levels of the layout attributes
+            position_mask(P, C): position_mask of the occupied positions
+            entity_count(P, C): number of entities of each layout
+            entity_slot(E,), entity_levels(E, 4): index in the position table and value levels
+                of every entity, layout after layout
+            rules(3, C, R, 3): name and attr (indices in RULE_NAMES and RULE_ATTRS) and value
+            modified(M, 3): candidate, component and attr (index in RULE_ATTRS) of the modified
+                attributes, candidate after candidate
+            num_candidates(): number of candidates
+    """
+    num_candidates = len(instances) - NUM_CONTEXT_PANELS
+    panels = [as_panel_state(panel) for panel in instances if panel is not None]
+    candidates = [as_panel_state(panel) for panel in instances[NUM_CONTEXT_PANELS:]]
+    shape = (len(panels), len(panels[0].layouts))
+    tables = []
+    record = dict(structure=np.array([panel.structure for panel in panels]),
+                  component=np.array([[layout.component for layout in panel.layouts] for panel in panels]),
+                  layout=np.array([[layout.name for layout in panel.layouts] for panel in panels]),
+                  position_table=np.zeros(shape, np.int64),
+                  number=np.zeros(shape, np.int64),
+                  uniformity=np.zeros(shape, np.int64),
+                  position_mask=np.zeros(shape, np.int64),
+                  entity_count=np.zeros(shape, np.int64))
+    slots = []
+    levels = []
+    for i, panel in enumerate(panels):
+        for j, layout in enumerate(panel.layouts):
+            table = json.dumps(layout.positions)
+            if table not in tables:
+                tables.append(table)
+            record["position_table"][i, j] = tables.index(table)
+            record["number"][i, j] = layout.number
+            record["uniformity"][i, j] = layout.uniformity
+            record["position_mask"][i, j] = position_mask(layout.value_idx)
+            record["entity_count"][i, j] = len(layout.levels)
+            slots.append(layout.slots)
+            levels.append(layout.levels)
+    record["position_tables"] = np.array(tables)
+    record["entity_slot"] = np.concatenate(slots).astype(np.int64)
+    record["entity_levels"] = np.concatenate(levels).astype(np.int64).reshape(-1, 4)
+    rules = stack_features([rule_features(rule_groups) for rule_groups in all_column_rules])
+    record["rules"] = np.stack([rules["name"], rules["attr"], rules["value"]], axis=-1)
+    record["modified"] = np.array([[i, component_idx, RULE_ATTRS.index(attr_name)]
+                                   for i, candidate in enumerate(candidates)
+                                   for component_idx, attr_name in candidate.modified_attr], np.int64).reshape(-1, 3)
+    record["num_candidates"] = np.array(num_candidates)
+    return dict((RECORD_PREFIX + name, value) for name, value in record.items())
+
+
+def read_record(arrays):
+    """The problem record among the arrays of a sample, None if it was saved without one.
+    """
+    record = dict((name[len(RECORD_PREFIX):], value) for name, value in arrays.items()
+                  if name.startswith(RECORD_PREFIX))
+    return record or None
+
+
+def record_xml(record):
+    """Build the XML metadata of a problem from its record, including real_bbox and the RLE
+    mask of every entity. The real bboxes come from the table set by bbox_table.use_bbox_table.
+    Arguments:
+        record(dict): problem_record, with or without RECORD_PREFIX
+    Returns:
+        xml(bytes): the XML document written next to each sample
+    """
+    record = read_record(record) or record
+    tables = [json.loads(table) for table in record["position_tables"]]
+    data = ET.Element("Data")
+    panels = ET.SubElement(data, "Panels")
+    entity = 0
+    # the masks are run-length encoded together once all the entities are known
+    entity_elements = []
+    masks = []
+    for i in range(len(record["structure"])):
+        panel_i = ET.SubElement(panels, "Panel")
+        struct_i = ET.SubElement(panel_i, "Struct")
+        struct_i.set("name", str(record["structure"][i]))
+        for j in range(record["number"].shape[1]):
+            positions = tables[record["position_table"][i, j]]
+            component_j = ET.SubElement(struct_i, "Component")
+            component_j.set("id", str(j))
+            component_j.set("name", str(record["component"][i, j]))
+            layout_k = ET.SubElement(component_j, "Layout")
+            layout_k.set("name", str(record["layout"][i, j]))
+            layout_k.set("Number", str(record["number"][i, j]))
+            layout_k.set("Position", json.dumps(positions))
+            layout_k.set("Uniformity", str(record["uniformity"][i, j]))
+            for _ in range(record["entity_count"][i, j]):
+                entity_type_level, entity_size_level, entity_color_level, entity_angle_level = \
+                    record["entity_levels"][entity]
+                entity_l = ET.SubElement(layout_k, "Entity")
+                entity_bbox = positions[record["entity_slot"][entity]]
+                entity_type = TYPE_VALUES[entity_type_level]
+                entity_size = SIZE_VALUES[entity_size_level]
+                entity_angle = ANGLE_VALUES[entity_angle_level]
+                entity_l.set("bbox", json.dumps(entity_bbox))
+                entity_l.set("real_bbox",
+                             json.dumps(real_bbox(entity_bbox, entity_type, entity_size, entity_angle)))
+                entity_l.set("mask", "")
+                entity_elements.append(entity_l)
+                masks.append(get_mask(entity_bbox, entity_type, entity_size, entity_angle))
+                entity_l.set("Type", str(entity_type_level))
+                entity_l.set("Size", str(entity_size_level))
+                entity_l.set("Color", str(entity_color_level))
+                entity_l.set("Angle", str(entity_angle_level))
+                entity += 1
+    if masks:
+        for entity_l, mask_rle in zip(entity_elements, rle_format(*rle_encode_batch(np.stack(masks)))):
+            entity_l.set("mask", mask_rle)
+
+    rules = ET.SubElement(data, "Rules")
+    for i in range(len(record["rules"])):
+        col_rules_i = ET.SubElement(rules, "Column_Rule_Set")
+        col_rules_i.set("column_index", str(i + 2))
+        for j in range(len(record["rules"][i])):
+            comp_rule_j = ET.SubElement(col_rules_i, "Component_Rule_Group")
+            comp_rule_j.set("component_id", str(j))
+            for name, attr, value in record["rules"][i, j]:
+                rule_k = ET.SubElement(comp_rule_j, "Rule")
+                rule_k.set("name", RULE_NAMES[name])
+                rule_k.set("attr", RULE_ATTRS[attr])
+                rule_k.set("value", str(value))
+
+    modified_attr = ET.SubElement(data, "Modified_attributes")
+    candidates = [ET.SubElement(modified_attr, "Candidate") for _ in range(int(record["num_candidates"]))]
+    for i, candidate_i in enumerate(candidates):
+        candidate_i.set("id", str(i))
+    for i, component_idx, attr in record["modified"]:
+        attr_j = ET.SubElement(candidates[i], "Attribute")
+        attr_j.set("component_id", str(component_idx))
+        attr_j.set("name", RULE_ATTRS[attr])
+
+    return ET.tostring(data)
+
+
+# shards opened by write_xml in the current process
+_readers = {}
+
+
+def read_arrays(source, k, readers):
+    """All the arrays of a sample listed by export.list_samples. Shards are opened once and
+    kept in readers.
+    """
+    if source.endswith(".npz"):
+        with np.load(source) as data:
+            return dict((name, data[name]) for name in data.files)
+    if source not in readers:
+        readers[source] = ShardReader(source)
+    arrays, _ = readers[source].read(k)
+    return arrays
+
+
+def write_xml(task):
+    """Write the XML of a sample from its record, next to its .npz or shard.
+    Returns:
+        written(bool): False if the sample has no record
+    """
+    xml_path, source, k = task
+    record = read_record(read_arrays(source, k, _readers))
+    if record is None:
+        return False
+    with open(xml_path + ".tmp", "wb") as f:
+        f.write(record_xml(record))
+    os.replace(xml_path + ".tmp", xml_path)
+    return True
+
+
+def write_config_xml(save_dir, key, workers=1, bbox_table=None):
+    """Post-pass of a dataset generated with --metadata record: write RAVEN_{k}_{set}.xml from
+    the record of every sample of the configuration that does not have it yet. The XML of
+    samples stored in tar shards is written as files next to the shards.
+    bbox_table is used by the worker processes, see bbox_table.use_bbox_table.
+    Returns:
+        count(int): number of XML files written
+    """
+    tasks = []
+    for split in SPLITS:
+        for k, source in list_samples(save_dir, key)[split]:
+            _, xml_path = sample_paths(save_dir, key, k, split)
+            if not os.path.exists(xml_path):
+                tasks.append((xml_path, source, k))
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=use_bbox_table, initargs=(bbox_table,)) as pool:
+            return sum(pool.imap_unordered(write_xml, tasks, chunksize=16))
+    return sum(write_xml(task) for task in tasks)
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="write the XML metadata of a dataset generated with "
+                                                          "--metadata record")
+    main_arg_parser.add_argument("--save-dir", type=str, default="dataset",
+                                 help="path to folder where the dataset was generated")
+    main_arg_parser.add_argument("--config", type=str, nargs="+", default=None,
+                                 help="configurations to process, defaults to all the folders of save-dir")
+    main_arg_parser.add_argument("--workers", type=int, default=1,
+                                 help="number of worker processes")
+    main_arg_parser.add_argument("--bbox-table", type=str, default="",
+                                 help="path to the real bounding box table built by bbox_table.py; "
+                                      "empty to build it in memory")
+    args = main_arg_parser.parse_args()
+
+    bbox_table = load_bbox_table(args.bbox_table)
+    use_bbox_table(bbox_table)
+
+    keys = args.config
+    if keys is None:
+        keys = sorted(name for name in os.listdir(args.save_dir)
+                      if os.path.isdir(os.path.join(args.save_dir, name)))
+    for key in keys:
+        print("Wrote {} XML files for {}".format(write_config_xml(args.save_dir, key, args.workers, bbox_table), key))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import threading
+import time
+
+
+# upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# prefix of the metric names in the Prometheus textfile
+PROMETHEUS_PREFIX = "iraven_"
+
+
+class Metrics:
+    """Counters, gauges and latency histograms of the generator. Each process counts in its
+    own registry; the registries of the workers are merged by the main process from their
+    snapshots. A gauge keeps the maximum value set since the previous export.
+    """
+
+    def __init__(self):
+        self.counters = dict()
+        self.gauges = dict()
+        # name -> [count of each bucket and of +Inf, sum of the observations]
+        self.histograms = dict()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        self.gauges[name] = max(self.gauges.get(name, value), value)
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        histogram[0][bucket] += 1
+        histogram[1] += seconds
+
+    def snapshot(self):
+        """JSON-serializable copy of the registry, see merge."""
+        return {"counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": dict((name, {"buckets": list(buckets), "sum": total})
+                                   for name, (buckets, total) in self.histograms.items())}
+
+    def merge(self, snapshot):
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+        for name, value in snapshot["gauges"].items():
+            self.gauge(name, value)
+        for name, histogram in snapshot["histograms"].items():
+            if name not in self.histograms:
+                self.histograms[name] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            buckets = self.histograms[name][0]
+            for bucket, n in enumerate(histogram["buckets"]):
+                buckets[bucket] += n
+            self.histograms[name][1] += histogram["sum"]
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+
+# registry of the current process, None while metrics are disabled
+_metrics = None
+# the write-behind thread counts into the same registry
+_lock = threading.Lock()
+
+
+def enable_metrics(enabled=True):
+    """Start counting in a new registry of the current process, or stop counting."""
+    global _metrics
+    _metrics = Metrics() if enabled else None
+
+
+def count(name, n=1):
+    if _metrics is not None:
+        with _lock:
+            _metrics.count(name, n)
+
+
+def gauge(name, value):
+    if _metrics is not None:
+        with _lock:
+            _metrics.gauge(name, value)
+
+
+def start():
+    """Start timing a stage. Returns None while metrics are disabled, which stop ignores,
+    so that a disabled timer costs two function calls and no clock read.
+    """
+    if _metrics is not None:
+        return time.perf_counter()
+    return None
+
+
+def stop(name, started):
+    """Record the time since start() in the histogram name."""
+    if started is not None and _metrics is not None:
+        seconds = time.perf_counter() - started
+        with _lock:
+            _metrics.observe(name, seconds)
+
+
+def drain_metrics():
+    """Snapshot of the registry of the current process, which is then emptied; None while
+    metrics are disabled. Worker processes send it with their results.
+    """
+    if _metrics is None:
+        return None
+    with _lock:
+        snapshot = _metrics.snapshot()
+        _metrics.reset()
+    return snapshot
+
+
+class MetricsExporter:
+    """Periodically write the metrics of a run, at most every interval seconds, either as one
+    JSON line per export appended to path, or as a Prometheus textfile replaced at each export
+    (for the textfile collector of node_exporter).
+    """
+
+    def __init__(self, path, format="jsonl", interval=10.0):
+        assert format in ("jsonl", "prometheus")
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self.metrics = Metrics()
+        self.start_time = time.time()
+        self.last_time = time.perf_counter()
+        self.last_samples = 0
+        self.start_perf = self.last_time
+
+    def add(self, snapshot):
+        """Merge the snapshot of a worker, see drain_metrics."""
+        if snapshot is not None:
+            self.metrics.merge(snapshot)
+
+    def maybe_export(self):
+        if time.perf_counter() - self.last_time >= self.interval:
+            self.export()
+
+    def export(self):
+        self.add(drain_metrics())
+        now = time.perf_counter()
+        samples = self.metrics.counters.get("samples", 0)
+        rates = {"samples_per_second": samples / max(now - self.start_perf, 1e-9),
+                 "interval_samples_per_second": (samples - self.last_samples) / max(now - self.last_time, 1e-9)}
+        self.last_time = now
+        self.last_samples = samples
+        snapshot = self.metrics.snapshot()
+        # the gauges are the maxima of the interval
+        self.metrics.gauges.clear()
+        if self.format == "jsonl":
+            line = dict(time=time.time(), elapsed=now - self.start_perf, **rates)
+            line.update(snapshot)
+            line["buckets"] = list(LATENCY_BUCKETS)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(line) + "\n")
+        else:
+            with open(self.path + ".tmp", "w") as f:
+                f.write(prometheus_text(snapshot, rates, self.start_time))
+            os.replace(self.path + ".tmp", self.path)
+
+    def close(self):
+        self.export()
+
+
+def prometheus_text(snapshot, rates, start_time):
+    """Render a snapshot in the Prometheus text exposition format: the counters as
+    <name>_total, the latency histograms as cumulative <name>_bucket series.
+    """
+    lines = []
+    for name, value in rates.items():
+        lines.append("# TYPE {}{} gauge".format(PROMETHEUS_PREFIX, name))
+        lines.append("{}{} {}".format(PROMETHEUS_PREFIX, name, repr(float(value))))
+    lines.append("# TYPE {}start_time_seconds gauge".format(PROMETHEUS_PREFIX))
+    lines.append("{}start_time_seconds {}".format(PROMETHEUS_PREFIX, repr(float(start_time))))
+    for name in sorted(snapshot["gauges"]):
+        lines.append("# TYPE {}{} gauge".format(PROMETHEUS_PREFIX, name))
+        lines.append("{}{} {}".format(PROMETHEUS_PREFIX, name, snapshot["gauges"][name]))
+    for name in sorted(snapshot["counters"]):
+        lines.append("# TYPE {}{}_total counter".format(PROMETHEUS_PREFIX, name))
+        lines.append("{}{}_total {}".format(PROMETHEUS_PREFIX, name, snapshot["counters"][name]))
+    for name in sorted(snapshot["histograms"]):
+        histogram = snapshot["histograms"][name]
+        metric = PROMETHEUS_PREFIX + name
+        lines.append("# TYPE {} histogram".format(metric))
+        cumulative = 0
+        for bound, n in zip([repr(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], histogram["buckets"]):
+            cumulative += n
+            lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, cumulative))
+        lines.append("{}_sum {}".format(metric, repr(float(histogram["sum"]))))
+        lines.append("{}_count {}".format(metric, cumulative))
+    return "\n".join(lines) + "\n"
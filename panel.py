@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+
+import copy
+
+import numpy as np
+
+from AoT import Root
+from const import ANGLE_VALUES, COLOR_VALUES, SIZE_VALUES, TYPE_VALUES
+
+
+# columns of LayoutState.levels
+LEVEL_ATTRS = ["Type", "Size", "Color", "Angle"]
+
+
+class LayoutState:
+    """Struct-of-arrays state of one component of a finished panel. The entities are
+    rows of the level and slot arrays instead of Entity/Attribute objects.
+    """
+
+    __slots__ = ("component", "name", "number", "uniformity", "positions", "value_idx", "slots", "levels")
+
+    def __init__(self, component, name, number, uniformity, positions, value_idx, slots, levels):
+        """
+        Arguments:
+            component(str), name(str): names of the component and of its layout
+            number(int), uniformity(int): value levels of the layout attributes
+            positions(list): the position table of the layout, shared with the AoT
+            value_idx(np.ndarray): indices of the occupied positions
+            slots(np.ndarray): (n,) index in positions of the bbox of each entity
+            levels(np.ndarray): (n, 4) value levels of each entity, columns as in LEVEL_ATTRS
+        """
+        self.component = component
+        self.name = name
+        self.number = number
+        self.uniformity = uniformity
+        self.positions = positions
+        self.value_idx = value_idx
+        self.slots = slots
+        self.levels = levels
+
+    def __deepcopy__(self, memo):
+        # the position table is shared, as in Layout
+        return LayoutState(self.component, self.name, self.number, self.uniformity, self.positions,
+                           self.value_idx.copy(), self.slots.copy(), self.levels.copy())
+
+    def level(self, attr):
+        """Value levels of an entity attribute for all entities.
+        """
+        return self.levels[:, LEVEL_ATTRS.index(attr)]
+
+    def bbox(self, i):
+        return self.positions[self.slots[i]]
+
+
+class PanelState:
+    """Compact, read-only state of a finished panel, enough for the renderer, the solver
+    and the serializer. Build it with compact_panel.
+    """
+
+    __slots__ = ("structure", "layouts", "modified_attr")
+
+    def __init__(self, structure, layouts, modified_attr):
+        self.structure = structure
+        self.layouts = layouts
+        self.modified_attr = modified_attr
+
+    def __deepcopy__(self, memo):
+        return PanelState(self.structure,
+                          tuple(copy.deepcopy(layout, memo) for layout in self.layouts),
+                          [list(attr) for attr in self.modified_attr])
+
+    def prepare(self):
+        """Counterpart of Root.prepare.
+        Returns:
+            structure(str): used for rendering structure
+            entities(list of tuple): (bbox, type, size, color, angle) values of each entity
+        """
+        entities = []
+        for layout in self.layouts:
+            for i in range(len(layout.levels)):
+                entity_type, entity_size, entity_color, entity_angle = layout.levels[i]
+                entities.append((layout.bbox(i),
+                                 TYPE_VALUES[entity_type],
+                                 SIZE_VALUES[entity_size],
+                                 COLOR_VALUES[entity_color],
+                                 ANGLE_VALUES[entity_angle]))
+        return self.structure, entities
+
+
+class CandidatePanel:
+    """A candidate answer kept as the answer panel plus a list of (component_idx, attr_name, value)
+    deltas, in the order they were applied. The PanelState is only built when a consumer asks
+    for it, see as_panel_state. The values of the deltas are:
+        Type, Size, Color: (n,) new value levels of the entities, already clipped to their range
+        Position: the new indices of the occupied positions
+        Number: the LayoutState of the recreated component
+        None: the modification was empty and leaves the component unchanged
+    """
+
+    __slots__ = ("base", "deltas", "state")
+
+    def __init__(self, base, deltas=()):
+        """
+        Arguments:
+            base(PanelState): the answer panel, shared by all the candidates
+            deltas(tuple): the modifications of the answer
+        """
+        self.base = base
+        self.deltas = tuple(deltas)
+        self.state = None
+
+    def extend(self, delta):
+        return CandidatePanel(self.base, self.deltas + (delta,))
+
+    def materialize(self):
+        if self.state is not None:
+            return self.state
+        layouts = list(self.base.layouts)
+        owned = set()
+        for component_idx, attr_name, value in self.deltas:
+            if value is None:
+                continue
+            if attr_name == "Number":
+                layouts[component_idx] = value
+                owned.discard(component_idx)
+                continue
+            if component_idx not in owned:
+                layouts[component_idx] = copy.deepcopy(layouts[component_idx])
+                owned.add(component_idx)
+            layout = layouts[component_idx]
+            if attr_name == "Position":
+                layout.value_idx = np.asarray(value)
+                if len(layout.value_idx) == len(layout.slots):
+                    layout.slots = layout.value_idx.copy()
+            else:
+                layout.levels[:, LEVEL_ATTRS.index(attr_name)] = value
+        self.state = PanelState(self.base.structure, tuple(layouts),
+                                [list(attr) for attr in self.base.modified_attr] +
+                                [[component_idx, attr_name] for component_idx, attr_name, _ in self.deltas])
+        return self.state
+
+
+def compact_layout(component):
+    layout = component.children[0]
+    n = len(layout.children)
+    slots = np.empty(n, np.int64)
+    levels = np.empty((n, len(LEVEL_ATTRS)), np.int64)
+    for i, entity in enumerate(layout.children):
+        slots[i] = layout.position.values.index(entity.bbox)
+        levels[i] = [entity.type.get_value_level(),
+                     entity.size.get_value_level(),
+                     entity.color.get_value_level(),
+                     entity.angle.get_value_level()]
+    return LayoutState(component.name, layout.name,
+                       int(layout.number.get_value_level()),
+                       int(layout.uniformity.get_value_level()),
+                       layout.position.values,
+                       np.asarray(layout.position.get_value_idx()),
+                       slots, levels)
+
+
+def compact_panel(root):
+    """Convert a sampled AoT panel into a PanelState.
+    Arguments:
+        root(Root): a panel (is_pg=True)
+    Returns:
+        panel(PanelState): the compact state of the panel
+    """
+    assert root.is_pg
+    structure = root.children[0]
+    return PanelState(structure.name,
+                      tuple(compact_layout(component) for component in structure.children),
+                      list(root.modified_attr))
+
+
+def as_panel_state(panel):
+    """Accept both representations in the consumers of finished panels.
+    """
+    if isinstance(panel, Root):
+        return compact_panel(panel)
+    if isinstance(panel, CandidatePanel):
+        return panel.materialize()
+    return panel
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+
+import numpy as np
+
+from shards import completed_shard_samples
+
+
+MANIFEST_NAME = "manifest.json"
+PROGRESS_NAME = "progress.jsonl"
+
+# run parameters that must not change between a run and its resumption
+MANIFEST_KEYS = ["seed", "val", "test", "format", "metadata", "rule_draw"]
+# values of the parameters missing from the manifests of older runs, which drew rules by rejection
+MANIFEST_DEFAULTS = {"format": "files", "metadata": "xml", "rule_draw": "rejection"}
+
+
+def split_name(args, k):
+    count_num = k % 10
+    if count_num < (10 - args.val - args.test):
+        return "train"
+    elif count_num < (10 - args.test):
+        return "val"
+    return "test"
+
+
+def sample_paths(save_dir, key, k, set_name):
+    """Paths of the .npz and .xml files of the k-th sample of configuration key.
+    """
+    prefix = os.path.join(save_dir, key, "RAVEN_{}_{}".format(k, set_name))
+    return prefix + ".npz", prefix + ".xml"
+
+
+def write_manifest(args, resume):
+    """Record the run parameters in save_dir. When resuming, check that they
+    match the ones of the interrupted run, as the per-sample seeds depend on them.
+    """
+    path = os.path.join(args.save_dir, MANIFEST_NAME)
+    manifest = dict((name, getattr(args, name)) for name in MANIFEST_KEYS)
+    if resume and os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        for name in MANIFEST_KEYS:
+            previous_value = previous.get(name, MANIFEST_DEFAULTS.get(name))
+            if previous_value != manifest[name]:
+                raise ValueError("Could not resume {}: --{} was {}, got {}".format(
+                    args.save_dir, name, previous_value, manifest[name]))
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+def load_progress(save_dir, key):
+    """Read the progress log of a configuration.
+    Returns:
+        records(dict): sample index -> record written by ProgressLog.log
+    """
+    path = os.path.join(save_dir, key, PROGRESS_NAME)
+    records = dict()
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line may be cut by an interruption
+                continue
+            records[record["k"]] = record
+    return records
+
+
+def completed_samples(args, key):
+    """Scan save_dir for the samples of a configuration that are already on disk.
+    A sample is complete when both its .npz and .xml exist (only the .npz with
+    --metadata record, the XML being written afterwards); files are only moved
+    into place once fully written. Whether the solver was right is taken from the
+    progress log, or read back from the .npz if the log missed it.
+    With --format tar, the complete samples are the ones listed in the shard indices.
+    Returns:
+        done(dict): sample index -> whether the solver picked the right answer
+    """
+    if args.format == "tar":
+        return completed_shard_samples(args.save_dir, key)
+    records = load_progress(args.save_dir, key)
+    done = dict()
+    for k in range(args.num_samples):
+        npz_path, xml_path = sample_paths(args.save_dir, key, k, split_name(args, k))
+        if not os.path.exists(npz_path):
+            continue
+        if args.metadata == "xml" and not os.path.exists(xml_path):
+            continue
+        if k in records:
+            done[k] = records[k]["correct"]
+        else:
+            with np.load(npz_path) as data:
+                done[k] = bool(data["target"] == data["predict"])
+    return done
+
+
+class ProgressLog:
+    """Append-only log of the finished samples of a configuration, one JSON record per line.
+    """
+
+    def __init__(self, save_dir, key, resume):
+        path = os.path.join(save_dir, key, PROGRESS_NAME)
+        self.file = open(path, "a" if resume else "w")
+        # terminate a line cut by an interruption so that new records stay readable
+        if self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def log(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 
 
+import functools
+
 import cv2
 import numpy as np
 from PIL import Image
 
-from AoT import Root
-from const import CENTER, DEFAULT_WIDTH, IMAGE_SIZE
+from const import (CENTER, DEFAULT_WIDTH, IMAGE_SIZE, RENDER_CACHE_SIZE,
+                   SIZE_VALUES)
+from panel import as_panel_state
 
 
 def imshow(array):
@@ -92,21 +95,102 @@ def merge_matrix_answer(matrix, answer, n_columns=5):
     return img_grid
 
 
+# sprite atlas consulted by render_panels, see use_sprite_atlas
+_sprite_atlas = None
+
+
+def use_sprite_atlas(atlas):
+    """Composite entities from a precomputed atlas.SpriteAtlas in render_panels.
+    Entities missing from the atlas are still rendered with OpenCV. Pass None to disable.
+    """
+    global _sprite_atlas
+    _sprite_atlas = atlas
+
+
 def render_panel(root):
-    # Decompose the panel into a structure and its entities
-    assert isinstance(root, Root)
-    canvas = np.ones((IMAGE_SIZE, IMAGE_SIZE), np.uint8) * 255
-    structure, entities = root.prepare()
-    structure_img = render_structure(structure)
-    background = np.zeros((IMAGE_SIZE, IMAGE_SIZE), np.uint8)
+    return render_panels([root])[0]
+
+
+def render_panels(roots, out=None):
+    """Render a batch of panels. The i-th entity of every panel is drawn into one
+    (N, IMAGE_SIZE, IMAGE_SIZE) layer stack, which is then composited over the whole batch at once.
+    Arguments:
+        roots(list of Root or PanelState): panels to render
+        out(np.ndarray): optional (N, IMAGE_SIZE, IMAGE_SIZE) uint8 array to render into
+    Returns:
+        out(np.ndarray): (N, IMAGE_SIZE, IMAGE_SIZE) uint8 images
+    """
+    n = len(roots)
+    if out is None:
+        out = np.empty((n, IMAGE_SIZE, IMAGE_SIZE), np.uint8)
+    assert out.shape == (n, IMAGE_SIZE, IMAGE_SIZE) and out.dtype == np.uint8
+    # Decompose the panels into structures and entities
+    structures = []
+    panel_entities = []
+    for root in roots:
+        structure, entities = as_panel_state(root).prepare()
+        structures.append(structure)
+        panel_entities.append(entities)
+    # panels are processed by decreasing number of entities, so that the panels still
+    # having an i-th entity always form a prefix of the batch
+    order = sorted(range(n), key=lambda i: -len(panel_entities[i]))
+    background = np.zeros((n, IMAGE_SIZE, IMAGE_SIZE), np.uint8)
+    layers = np.zeros((n, IMAGE_SIZE, IMAGE_SIZE), np.uint8)
     # note left components entities are in the lower layer
-    for entity in entities:
-        entity_img = render_entity(entity)
-        background = layer_add(background, entity_img)
-    background = layer_add(background, structure_img)
-    return canvas - background
+    for j in range(len(panel_entities[order[0]]) if n else 0):
+        windows = []
+        for m in range(n):
+            entities = panel_entities[order[m]]
+            if j >= len(entities):
+                break
+            windows.append((m, draw_entity(layers[m], entities[j])))
+        # only the union of the drawn windows needs compositing
+        y0 = min(window[0] for _, window in windows)
+        y1 = max(window[1] for _, window in windows)
+        x0 = min(window[2] for _, window in windows)
+        x1 = max(window[3] for _, window in windows)
+        composite(background[:len(windows), y0:y1, x0:x1], layers[:len(windows), y0:y1, x0:x1])
+        for m, (y0, y1, x0, x1) in windows:
+            layers[m, y0:y1, x0:x1] = 0
+    for m in range(n):
+        layers[m] = render_structure(structures[order[m]])
+    composite(background, layers)
+    out[order] = 255 - background
+    return out
+
+
+def draw_entity(layer, entity):
+    """Draw an entity on an empty layer, from the sprite atlas if possible.
+    Arguments:
+        entity(tuple): (bbox, type, size, color, angle) values, as given by PanelState.prepare
+    Returns:
+        window(tuple of int): (y0, y1, x0, x1) region of the layer that was written
+    """
+    entity_bbox = entity[0]
+    sprite = None
+    if _sprite_atlas is not None:
+        sprite = _sprite_atlas.lookup(*entity)
+    if sprite is not None:
+        # the layer is empty outside the sprite window
+        window, sprite_img = sprite
+        y0, y1, x0, x1 = window
+        layer[y0:y1, x0:x1] = sprite_img
+        return window
+    if len(entity_bbox) > 4:
+        window = (0, IMAGE_SIZE, 0, IMAGE_SIZE)
+    else:
+        window = sprite_window(tuple(entity_bbox))
+    y0, y1, x0, x1 = window
+    layer[y0:y1, x0:x1] = render_entity_layer(tuple(entity_bbox), *entity[1:])[y0:y1, x0:x1]
+    return window
+
 
+def composite(lower_layers, higher_layers):
+    # superimpose the higher layers: where the higher layer is set it replaces the lower one, lower_layers is modified
+    np.copyto(lower_layers, higher_layers, where=higher_layers > 0)
 
+
+@functools.lru_cache(maxsize=None)
 def render_structure(structure_name):
     ret = None
     if structure_name == "Left_Right":
@@ -117,15 +201,28 @@ def render_structure(structure_name):
         ret[int(0.5 * IMAGE_SIZE), :] = 255.0
     else:
         ret = np.zeros((IMAGE_SIZE, IMAGE_SIZE), np.uint8)
+    ret.flags.writeable = False
     return ret
 
 
 def render_entity(entity):
-    entity_bbox = entity.bbox
-    entity_type = entity.type.get_value()
-    entity_size = entity.size.get_value()
-    entity_color = entity.color.get_value()
-    entity_angle = entity.angle.get_value()
+    return render_entity_layer(tuple(entity.bbox),
+                               entity.type.get_value(),
+                               entity.size.get_value(),
+                               entity.color.get_value(),
+                               entity.angle.get_value())
+
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_entity_layer(entity_bbox, entity_type, entity_size, entity_color, entity_angle):
+    """Render a single entity on an empty layer. Layers are cached on the entity state,
+    so the returned array is shared and read-only.
+    Arguments:
+        entity_bbox(tuple): planar or angular position of the entity
+        entity_type(str), entity_size(float), entity_color(int), entity_angle(int): attribute values
+    Returns:
+        img(np.ndarray): (IMAGE_SIZE, IMAGE_SIZE) uint8 layer
+    """
     img = np.zeros((IMAGE_SIZE, IMAGE_SIZE), np.uint8)
 
     # planar position: [x, y, w, h]
@@ -198,9 +295,36 @@ def render_entity(entity):
         img = rotate(img, entity_angle, center=center)
     # img = shift(img, *entity_position)
 
+    img.flags.writeable = False
     return img
 
 
+@functools.lru_cache(maxsize=None)
+def sprite_window(entity_bbox):
+    """Region of the canvas an entity in a planar slot can cover, whatever its type, size and angle.
+    Returns:
+        window(tuple of int): (y0, y1, x0, x1)
+    """
+    center = (int(entity_bbox[1] * IMAGE_SIZE), int(entity_bbox[0] * IMAGE_SIZE))
+    unit = min(entity_bbox[2], entity_bbox[3]) * IMAGE_SIZE / 2
+    # every vertex lies within unit * size of the center; leave room for the edge and interpolation
+    half = int(np.ceil(unit * max(SIZE_VALUES))) + DEFAULT_WIDTH + 2
+    return (max(0, center[1] - half), min(IMAGE_SIZE, center[1] + half + 1),
+            max(0, center[0] - half), min(IMAGE_SIZE, center[0] + half + 1))
+
+
+def render_cache_info():
+    """Hit-rate counters of the entity layer cache of this process.
+    """
+    info = render_entity_layer.cache_info()
+    total = info.hits + info.misses
+    return {"hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+            "hit_rate": float(info.hits) / total if total else 0.0}
+
+
 def shift(img, dx, dy):
     M = np.array([[1, 0, dx], [0, 1, dy]], np.float32)
     img = cv2.warpAffine(img, M, (IMAGE_SIZE, IMAGE_SIZE), flags=cv2.INTER_LINEAR)
@@ -219,14 +343,6 @@ def scale(img, tx, ty, center=CENTER):
     return img
 
 
-def layer_add(lower_layer_np, higher_layer_np):
-    # higher_layer_np is superimposed on lower_layer_np
-    # new_np = lower_layer_np.copy()
-    # lower_layer_np is modified
-    lower_layer_np[higher_layer_np > 0] = 0
-    return lower_layer_np + higher_layer_np
-
-
 # Draw primitives
 def draw_triangle(img, pts, color, width):
     # if filled
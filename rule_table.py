@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from build_tree import (build_center_single, build_distribute_four,
+                        build_distribute_nine,
+                        build_in_center_single_out_center_single,
+                        build_in_distribute_four_out_center_single,
+                        build_left_center_single_right_center_single,
+                        build_up_center_single_down_center_single)
+from const import RULE_ATTR
+from Rule import Rule_Wrapper
+
+
+def enumerate_rule_groups():
+    """All the rule groups sample_rules can draw for a component, with their probability.
+    sample_rules picks a rule uniformly for each attribute, then its parameter uniformly.
+    Returns:
+        groups(list of tuple): one (name, attr, params, value) tuple per attribute, in RULE_ATTR order
+        weights(np.ndarray): probability of each group
+    """
+    choices = []
+    for rules in RULE_ATTR:
+        attr_choices = []
+        for name, attr, params in rules:
+            if params is None:
+                attr_choices.append(((name, attr, params, 0), 1.0 / len(rules)))
+            else:
+                for value in params:
+                    attr_choices.append(((name, attr, params, value), 1.0 / len(rules) / len(params)))
+        choices.append(attr_choices)
+    groups = []
+    weights = []
+    for combination in itertools.product(*choices):
+        groups.append(tuple(rule for rule, _ in combination))
+        weights.append(np.prod([weight for _, weight in combination]))
+    return groups, np.array(weights)
+
+
+def make_rule_group(group, component_idx):
+    return [Rule_Wrapper(name, attr, params, component_idx, None, value) for name, attr, params, value in group]
+
+
+def table_fingerprint(root):
+    """Hash of everything the feasibility of a rule group depends on: the rule list and the
+    original constraints of every layout of the configuration.
+    """
+    layouts = []
+    for structure in root.children:
+        for component in structure.children:
+            for layout in component.children:
+                layouts.append([layout.orig_layout_constraint, layout.orig_entity_constraint])
+    data = json.dumps([RULE_ATTR, layouts], sort_keys=True, default=int)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class RuleTable:
+    """The feasible rule groups of each component of a configuration, weighted as sample_rules
+    would draw them. Sampling from it gives the same distribution as drawing with sample_rules
+    until root.feasible accepts, in one draw per component.
+    Only configurations with a single structure are supported, their components being independent.
+    """
+
+    def __init__(self, feasible, fingerprint):
+        """
+        Arguments:
+            feasible(np.ndarray): (num_components, num_groups) bool, feasible groups of each component
+            fingerprint(str): see table_fingerprint
+        """
+        self.feasible = feasible
+        self.fingerprint = fingerprint
+        self.groups, weights = enumerate_rule_groups()
+        self.indices = []
+        self.cum_weights = []
+        for mask in feasible:
+            self.indices.append(np.flatnonzero(mask))
+            self.cum_weights.append(np.cumsum(weights[mask]))
+        # probability that a draw of sample_rules is feasible
+        self.acceptance = float(np.prod([cum_weights[-1] for cum_weights in self.cum_weights]))
+
+    @staticmethod
+    def build(root):
+        assert len(root.children) == 1, "rule tables need a single structure"
+        groups, _ = enumerate_rule_groups()
+        components = root.children[0].children
+        feasible = np.zeros((len(components), len(groups)), bool)
+        for i, component in enumerate(components):
+            for j, group in enumerate(groups):
+                feasible[i, j] = component._feasible(make_rule_group(group, i))
+        return RuleTable(feasible, table_fingerprint(root))
+
+    def save(self, path):
+        # a temporary file of its own, as concurrent runs may build the same table
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, feasible=self.feasible, fingerprint=self.fingerprint)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            return RuleTable(data["feasible"], str(data["fingerprint"]))
+
+    def sample(self, rng):
+        """Draw the rule groups of a column.
+        Arguments:
+            rng(numpy.random.Generator): source of randomness
+        Returns:
+            rule_groups(list of list of Rule): one feasible rule group per component
+        """
+        rule_groups = []
+        for i in range(len(self.indices)):
+            cum_weights = self.cum_weights[i]
+            j = np.searchsorted(cum_weights, rng.random() * cum_weights[-1], side="right")
+            rule_groups.append(make_rule_group(self.groups[self.indices[i][j]], i))
+        return rule_groups
+
+
+def load_rule_table(cache_dir, key, root):
+    """Load the rule table of a configuration from cache_dir, building and saving it if it is
+    missing or was built for other rules or constraints.
+    """
+    path = os.path.join(cache_dir, key + ".npz")
+    fingerprint = table_fingerprint(root)
+    if os.path.exists(path):
+        table = RuleTable.load(path)
+        if table.fingerprint == fingerprint:
+            return table
+    os.makedirs(cache_dir, exist_ok=True)
+    table = RuleTable.build(root)
+    table.save(path)
+    return table
+
+
+def main():
+    main_arg_parser = argparse.ArgumentParser(description="build the feasible rule tables and report their acceptance rates")
+    main_arg_parser.add_argument("--cache-dir", type=str, default="rule_tables",
+                                 help="path to folder where the rule tables are cached")
+    args = main_arg_parser.parse_args()
+
+    # the trees are only read for their constraints; the sampled values do not matter
+    rng = np.random.default_rng(0)
+    all_configs = {"center_single": build_center_single(rng),
+                   "distribute_four": build_distribute_four(rng),
+                   "distribute_nine": build_distribute_nine(rng),
+                   "left_center_single_right_center_single": build_left_center_single_right_center_single(rng),
+                   "up_center_single_down_center_single": build_up_center_single_down_center_single(rng),
+                   "in_center_single_out_center_single": build_in_center_single_out_center_single(rng),
+                   "in_distribute_four_out_center_single": build_in_distribute_four_out_center_single(rng)}
+    print("{:<40} {:>18} {:>12} {:>14}".format("config", "feasible groups", "acceptance", "draws/column"))
+    for key, root in all_configs.items():
+        table = load_rule_table(args.cache_dir, key, root)
+        print("{:<40} {:>18} {:>12.4f} {:>14.1f}".format(key,
+                                                         "/".join(str(len(indices)) for indices in table.indices),
+                                                         table.acceptance, 1.0 / table.acceptance))
+
+
+if __name__ == "__main__":
+    main()
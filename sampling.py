@@ -8,7 +8,7 @@ from const import MAX_COMPONENTS, RULE_ATTR
 from Rule import Rule_Wrapper, Rule
 
 
-def sample_rules(num_components: int) -> List[List[Rule]]:
+def sample_rules(rng: np.random.Generator, num_components: int) -> List[List[Rule]]:
     """First sample # components; for each component, sample a rule on each attribute.
     """
     # num_components = np.random.randint(1, MAX_COMPONENTS + 1) # <-- 删除此行
@@ -16,10 +16,10 @@ def sample_rules(num_components: int) -> List[List[Rule]]:
     for i in range(num_components):  # <-- 现在使用传入的 num_components
         all_rules_component = []
         for j in range(len(RULE_ATTR)):
-            idx = np.random.choice(len(RULE_ATTR[j]))
+            idx = rng.choice(len(RULE_ATTR[j]))
             name_attr_param = RULE_ATTR[j][idx]
             all_rules_component.append(Rule_Wrapper(name_attr_param[0], name_attr_param[1], name_attr_param[2],
-                                                    component_idx=i))
+                                                    component_idx=i, rng=rng))
         all_rules.append(all_rules_component)
     return all_rules
 
@@ -93,14 +93,15 @@ def sample_attr_avail(rule_groups, row_3_3):
     return ret
 
 
-def sample_attr(attrs_list):
+def sample_attr(rng, attrs_list):
     """Given the attr_avail list, sample one attribute to modify the value.
     If the available times becomes zero, delete it.
     Arguments:
+        rng(numpy.random.Generator): source of randomness
         attrs_list(list of list): a flat component of available attributes
             to change the values; consisting of different component indexes
     """
-    attr_idx = np.random.choice(len(attrs_list))
+    attr_idx = rng.choice(len(attrs_list))
     component_idx, attr_name, _, min_level, max_level, _ = attrs_list[attr_idx]
     attrs_list[attr_idx][2] -= 1
     if attrs_list[attr_idx][2] == 0:
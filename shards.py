@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+
+import glob
+import io
+import json
+import os
+import tarfile
+
+import numpy as np
+
+
+SHARD_PATTERN = "shard-{:06d}.tar"
+INDEX_SUFFIX = ".json"
+
+
+def shard_path(save_dir, key, start):
+    """Path of the shard of configuration key whose first sample is start.
+    """
+    return os.path.join(save_dir, key, SHARD_PATTERN.format(start))
+
+
+class ShardWriter:
+    """Write the samples of one shard into a single uncompressed tar file, WebDataset style:
+    each sample is a RAVEN_{k}_{set}.npz and a RAVEN_{k}_{set}.xml member, the latter missing
+    for samples generated with --metadata record. The byte range of
+    every member is kept in an index written next to the tar, so that samples can be read
+    back without scanning the archive. Both files are moved into place by close, a shard
+    without its index is incomplete.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tar = tarfile.open(path + ".tmp", "w", format=tarfile.USTAR_FORMAT)
+        self.records = []
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+        # the data ends the member, padded to a whole number of blocks
+        n_blocks = (len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        return [self.tar.offset - n_blocks * tarfile.BLOCKSIZE, len(data)]
+
+    def add(self, k, set_name, arrays, xml, correct):
+        """Append a sample.
+        Arguments:
+            k(int): index of the sample
+            set_name(str): train, val or test
+            arrays(dict): arrays saved in the .npz
+            xml(bytes): the XML metadata, None to store the sample without it
+            correct(bool): whether the solver picked the right answer
+        """
+        name = "RAVEN_{}_{}".format(k, set_name)
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        self.records.append({"k": k,
+                             "set": set_name,
+                             "correct": correct,
+                             "npz": self._add_member(name + ".npz", buf.getvalue()),
+                             "xml": None if xml is None else self._add_member(name + ".xml", xml)})
+
+    def finish(self):
+        """Close the tar and write the index, both still under their temporary names.
+        Returns:
+            renames(list of tuple): (temporary, final) paths, see writer.finish_writes
+        """
+        self.tar.close()
+        with open(self.path + INDEX_SUFFIX + ".tmp", "w") as f:
+            json.dump(self.records, f)
+        return [(self.path + ".tmp", self.path), (self.path + INDEX_SUFFIX + ".tmp", self.path + INDEX_SUFFIX)]
+
+    def close(self):
+        for tmp_path, path in self.finish():
+            os.replace(tmp_path, path)
+
+
+def load_index(path):
+    with open(path + INDEX_SUFFIX) as f:
+        return json.load(f)
+
+
+def completed_shard_samples(save_dir, key):
+    """Samples of a configuration stored in complete shards.
+    Returns:
+        done(dict): sample index -> whether the solver picked the right answer
+    """
+    done = dict()
+    for index_path in sorted(glob.glob(os.path.join(save_dir, key, "shard-*.tar" + INDEX_SUFFIX))):
+        for record in load_index(index_path[:-len(INDEX_SUFFIX)]):
+            done[record["k"]] = record["correct"]
+    return done
+
+
+class ShardReader:
+    """Random access to the samples of a shard written by ShardWriter.
+    """
+
+    def __init__(self, path):
+        self.records = dict((record["k"], record) for record in load_index(path))
+        self.file = open(path, "rb")
+
+    def keys(self):
+        return sorted(self.records.keys())
+
+    def _read_member(self, offset, size):
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def read(self, k):
+        """Read the k-th sample of the configuration.
+        Returns:
+            arrays(dict): the arrays of the .npz
+            xml(bytes): the XML metadata, None if the shard was written without it
+        """
+        record = self.records[k]
+        with np.load(io.BytesIO(self._read_member(*record["npz"]))) as data:
+            arrays = dict((name, data[name]) for name in data.files)
+        if record["xml"] is None:
+            return arrays, None
+        return arrays, self._read_member(*record["xml"])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
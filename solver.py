@@ -2,274 +2,202 @@
 
 
 import numpy as np
-import copy
+
+from Attribute import position_mask
+from const import NUM_VALUES
+from panel import LEVEL_ATTRS, as_panel_state
 
 
 # 注意：这个求解器不再需要导入 main 或 rendering
 # 它是一个纯粹的逻辑检查器
 
+# codes of the rule features
+RULE_NAMES = ["Constant", "Progression", "Arithmetic", "Distribute_Three"]
+RULE_ATTRS = ["Number", "Position", "Number/Position", "Type", "Size", "Color"]
+# entity attributes of the panel features, the columns of "level" and "consistent"
+ENTITY_ATTRS = ["Type", "Size", "Color"]
 
-def solve(rule_groups, context, candidates):
-    """
-    Search-based Heuristic Solver (Corrected Reverse-Check Strategy).
 
+def panel_features(panels):
+    """Extract the features the rules are checked on, once per panel.
     Arguments:
-        rule_groups(list of list of Rule): 最后一列 (t=n) 的规则
-        context(list of AoTNode): 最后一步所需的上下文 [panel_t-2, panel_t-1]
-        candidates(list of AoTNode): 8个候选答案
+        panels(list of Root or PanelState): panels of the same structure
     Returns:
-        ans(int): index of the correct answer in the candidates
+        features(dict): arrays indexed by (panel, component):
+            number(int64): level of Number
+            positions(int64): bitmask of the occupied positions
+            slots(int64): size of the position table
+            empty(bool): whether the component has no entity
+            consistent(bool, (..., 3)): whether all entities share the level of each ENTITY_ATTRS
+            level(int64, (..., 3)): level of each ENTITY_ATTRS of the first entity, 0 if empty
     """
-    satisfied = [0] * len(candidates)
-
-    # if len(context) < 2:
-    #     # 上下文不足，无法进行 2-arity 检查，只能随机猜
-    #     return np.random.choice(len(candidates))
-
-    for i, candidate in enumerate(candidates):
-        score = 0
-        # 遍历每个组件 (例如 'Left' 和 'Right')
-        for component_idx in range(len(rule_groups)):
-            rule_group = rule_groups[component_idx]
-
-            # 1. 检查 Number/Position 规则
-            rule_num_pos = rule_group[0]
-            score += check_num_pos(rule_num_pos, context, candidate)
-
-            # 2. 检查实体规则 (Type, Size, Color)
-            for entity_rule in rule_group[1:]:
-                score += check_entity(entity_rule, context, candidate)
-
-        satisfied[i] = score
-
-    satisfied = np.array(satisfied)
-
-    max_score = np.max(satisfied)
-
-    # 检查是否有规则被应用（score > 0）。如果没有，随机猜测。
-    # 并且，检查最高分是否*唯一*。如果多个候选得到满分（理论上不应发生），随机选一个。
-    if max_score == 0:
-        return np.random.choice(len(candidates))
-
-    # 找到所有获得最高分的候选
-    answer_set = np.where(satisfied == max_score)[0]
-
-    # 从最高分中随机选一个（通常只有一个）
-    return np.random.choice(answer_set)
-
-
-def get_layouts(rule, context, candidate):
-    """辅助函数：安全地提取 t-2, t-1 和 candidate 的布局"""
-    component_idx = rule.component_idx
-    try:
-        layout_t_minus_2 = context[0].children[0].children[component_idx].children[0]
-        layout_t_minus_1 = context[1].children[0].children[component_idx].children[0]
-        layout_cand = candidate.children[0].children[component_idx].children[0]
-        return layout_t_minus_2, layout_t_minus_1, layout_cand
-    except IndexError:
-        return None, None, None  # 缺少组件/布局
-
-def check_num_pos(rule, context, candidate):
+    panels = [as_panel_state(panel) for panel in panels]
+    shape = (len(panels), len(panels[0].layouts))
+    features = dict(number=np.zeros(shape, np.int64),
+                    positions=np.zeros(shape, np.int64),
+                    slots=np.zeros(shape, np.int64),
+                    empty=np.zeros(shape, bool),
+                    consistent=np.ones(shape + (len(ENTITY_ATTRS),), bool),
+                    level=np.zeros(shape + (len(ENTITY_ATTRS),), np.int64))
+    for i, panel in enumerate(panels):
+        for j, layout in enumerate(panel.layouts):
+            features["number"][i, j] = layout.number
+            features["positions"][i, j] = position_mask(layout.value_idx)
+            features["slots"][i, j] = len(layout.positions)
+            features["empty"][i, j] = len(layout.levels) == 0
+            if len(layout.levels):
+                levels = layout.levels[:, [LEVEL_ATTRS.index(attr) for attr in ENTITY_ATTRS]]
+                features["consistent"][i, j] = np.all(levels == levels[0], axis=0)
+                features["level"][i, j] = levels[0]
+    return features
+
+
+def rule_features(rule_groups):
+    """Encode the rules of a column as arrays indexed by (component, rule).
+    Returns:
+        rules(dict): name and attr, indices in RULE_NAMES and RULE_ATTRS, and value
     """
-    检查 Number/Position 规则。
-    context = [Panel_t-2, Panel_t-1]
+    shape = (len(rule_groups), len(rule_groups[0]))
+    rules = dict(name=np.zeros(shape, np.int64), attr=np.zeros(shape, np.int64), value=np.zeros(shape, np.int64))
+    for i, rule_group in enumerate(rule_groups):
+        for j, rule in enumerate(rule_group):
+            rules["name"][i, j] = RULE_NAMES.index(rule.name) if rule.name in RULE_NAMES else -1
+            rules["attr"][i, j] = RULE_ATTRS.index(rule.attr)
+            rules["value"][i, j] = rule.value
+    return rules
+
+
+def stack_features(features):
+    """Stack the features of several problems along a new first axis, for score_features.
     """
-    layout_t_minus_2, layout_t_minus_1, layout_cand = get_layouts(rule, context, candidate)
-    if layout_cand is None:
-        return 0  # 缺少组件/布局，无法检查
-
-    attr = rule.attr
-
-    # --- Constant: 仅检查被声明的属性 ---
-    if rule.name == "Constant":
-        if attr == "Number":
-            return int(layout_t_minus_1.number.get_value() ==
-                       layout_cand.number.get_value())
-        elif attr == "Position":
-            return int(set(layout_t_minus_1.position.get_value_idx()) ==
-                       set(layout_cand.position.get_value_idx()))
-        elif attr == "Number/Position":  # 仅少数组合规则使用
-            return int((layout_t_minus_1.number.get_value() ==
-                        layout_cand.number.get_value()) and
-                       (set(layout_t_minus_1.position.get_value_idx()) ==
-                        set(layout_cand.position.get_value_idx())))
-        return 0
-
-    # --- Progression ---
-    elif rule.name == "Progression":
-        if attr == "Number":
-            v1 = layout_t_minus_2.number.get_value_level()
-            v2 = layout_t_minus_1.number.get_value_level()
-            v3 = layout_cand.number.get_value_level()
-            return int((v2 - v1) == (v3 - v2) == rule.value)
-        else:  # Position: 循环移位
-            # 先确保三个面板 Number 一致或满足位置可比
-            if not (layout_t_minus_2.number.get_value() ==
-                    layout_t_minus_1.number.get_value() ==
-                    layout_cand.number.get_value()):
-                return 0
-            if layout_cand.number.get_value() == 0:
-                return 1  # 三者皆空，视为满足
-            v1_pos = set(layout_t_minus_2.position.get_value_idx())
-            v2_pos = set(layout_t_minus_1.position.get_value_idx())
-            v3_pos = set(layout_cand.position.get_value_idx())
-            most_num = len(layout_cand.position.values)
-            diff = rule.value
-            expected_v2_pos = set((p + diff) % most_num for p in v1_pos)
-            expected_v3_pos = set((p + diff) % most_num for p in v2_pos)
-            return int(v2_pos == expected_v2_pos and v3_pos == expected_v3_pos)
-
-    # --- Arithmetic ---
-    elif rule.name == "Arithmetic":
-        if attr == "Number":
-            # Number 的算术作用在 level 上；加法 +1 偏置，减法取绝对值
-            v1 = layout_t_minus_2.number.get_value_level()
-            v2 = layout_t_minus_1.number.get_value_level()
-            v3 = layout_cand.number.get_value_level()
-            if rule.value > 0:   # 加
-                return int(v3 == v1 + v2 + 1)
-            else:                # 减
-                return int(v3 == abs(v1 - v2))
-        else:  # Position: 并/差
-            v1_pos = set(layout_t_minus_2.position.get_value_idx())
-            v2_pos = set(layout_t_minus_1.position.get_value_idx())
-            v3_pos = set(layout_cand.position.get_value_idx())
-            if rule.value > 0:   # union
-                return int(v3_pos == (v1_pos | v2_pos))
-            else:                # diff
-                return int(v3_pos == (v1_pos - v2_pos))
-
-    # --- Distribute_Three ---
-    elif rule.name == "Distribute_Three":
-        if attr == "Number":
-            v1 = layout_t_minus_2.number.get_value_level()
-            v2 = layout_t_minus_1.number.get_value_level()
-            v3 = layout_cand.number.get_value_level()
-            return int(v1 != v2 and v1 != v3 and v2 != v3)
-        else:
-            v1_pos = set(layout_t_minus_2.position.get_value_idx())
-            v2_pos = set(layout_t_minus_1.position.get_value_idx())
-            v3_pos = set(layout_cand.position.get_value_idx())
-            return int(v1_pos != v2_pos and v1_pos != v3_pos and v2_pos != v3_pos)
-
-    return 0
-
-def check_entity(rule, context, candidate):
+    return dict((name, np.stack([feature[name] for feature in features])) for name in features[0])
+
+
+def _rotate(positions, shift, slots):
+    """Bitmask of {(p + shift) % slots for p in positions}."""
+    shift = shift % np.maximum(slots, 1)
+    mask = np.left_shift(1, slots) - 1
+    return (np.left_shift(positions, shift) | np.right_shift(positions, slots - shift)) & mask
+
+
+def _num_pos_scores(name, attr, value, n1, n2, n3, p1, p2, p3, slots):
+    """Vectorized check of the Number/Position rules, see score_features."""
+    number, position, both = attr == 0, attr == 1, attr == 2
+    constant = np.where(number, n2 == n3,
+                        np.where(position, p2 == p3,
+                                 np.where(both, (n2 == n3) & (p2 == p3), False)))
+    # Progression on anything but Number shifts the positions cyclically
+    shifted = (n1 == n2) & (n2 == n3) & (np.asarray(NUM_VALUES)[n3] == 0) | \
+        (n1 == n2) & (n2 == n3) & (p2 == _rotate(p1, value, slots)) & (p3 == _rotate(p2, value, slots))
+    progression = np.where(number, (n2 - n1 == value) & (n3 - n2 == value), shifted)
+    # Number 的算术作用在 level 上；加法 +1 偏置，减法取绝对值
+    arithmetic = np.where(number,
+                          np.where(value > 0, n3 == n1 + n2 + 1, n3 == np.abs(n1 - n2)),
+                          np.where(value > 0, p3 == p1 | p2, p3 == p1 & ~p2))
+    distribute = np.where(number, (n1 != n2) & (n1 != n3) & (n2 != n3),
+                          (p1 != p2) & (p1 != p3) & (p2 != p3))
+    return np.select([name == 0, name == 1, name == 2, name == 3],
+                     [constant, progression, arithmetic, distribute], False)
+
+
+def _entity_scores(name, attr, value, e1, e2, e3, c1, c2, c3, v1, v2, v3):
+    """Vectorized check of the entity rules (Type, Size, Color), see score_features.
+    空面板统一按没有实体判定；Size/Type 的算术带 ±1 偏置，Color 无偏置。
     """
-    检查实体属性规则 (Type, Size, Color)。
-    - 空面板统一按 len(children)==0 判定
-    - Number/Size 带 ±1 偏置；Color 无偏置
+    full = ~(e1 | e2 | e3)
+    constant = ~e2 & ~e3 & (v3 == v2)
+    progression = full & (v2 - v1 == value) & (v3 - v2 == value)
+    bias = np.where(attr == RULE_ATTRS.index("Color"), 0, 1)
+    # 减法：例如 5-5 → 0（空）
+    arithmetic = np.where(value > 0,
+                          full & (v3 == v1 + v2 + bias),
+                          ~e1 & ~e2 & e3 | full & (v3 == np.abs(v1 - v2 - bias)))
+    distribute = full & (v1 != v2) & (v1 != v3) & (v2 != v3)
+    scores = np.select([name == 0, name == 1, name == 2, name == 3],
+                       [constant, progression, arithmetic, distribute], False)
+    # 三个都空：规则满足；否则每个非空布局内该属性必须一致
+    return (e1 & e2 & e3) | (c1 & c2 & c3) & scores
+
+
+def score_features(rules, context, candidates):
+    """Score every candidate against the rules of the last column with NumPy broadcasting.
+    Any leading axes shared by the three arguments are batch axes, so thousands of problems
+    can be checked at once with stack_features.
+    Arguments:
+        rules(dict): rule_features of the column, arrays (..., C, R)
+        context(dict): panel_features of [panel_t-2, panel_t-1], arrays (..., 2, C)
+        candidates(dict): panel_features of the candidates, arrays (..., K, C)
+    Returns:
+        scores(np.ndarray): (..., K) number of rules satisfied by each candidate
     """
-    layout_t_minus_2, layout_t_minus_1, layout_cand = get_layouts(rule, context, candidate)
-    if layout_cand is None:
-        return 0
-
-    attr = rule.attr
-    attr_lower = attr.lower()
-
-    def _is_empty(layout):
-        return len(layout.children) == 0
-
-    def _consistent(layout):
-        """布局内该属性是否一致"""
-        if not layout.children:
-            return True
-        v0 = getattr(layout.children[0], attr_lower).get_value_level()
-        for ent in layout.children[1:]:
-            if getattr(ent, attr_lower).get_value_level() != v0:
-                return False
-        return True
-
-    is_empty_v1, is_empty_v2, is_empty_v3 = map(_is_empty, (layout_t_minus_2, layout_t_minus_1, layout_cand))
-    is_consistent_v1, is_consistent_v2, is_consistent_v3 = map(_consistent, (layout_t_minus_2, layout_t_minus_1, layout_cand))
-
-    # 三个都空：规则满足
-    if is_empty_v1 and is_empty_v2 and is_empty_v3:
-        return 1
-
-    # 若有非空，要求一致性或空可跳过该列比较
-    if not ((is_consistent_v1 or is_empty_v1) and
-            (is_consistent_v2 or is_empty_v2) and
-            (is_consistent_v3 or is_empty_v3)):
-        return 0
-
-    # 取 level 值（空则不取）
-    if not is_empty_v1:
-        v1 = getattr(layout_t_minus_2.children[0], attr_lower).get_value_level()
-    if not is_empty_v2:
-        v2 = getattr(layout_t_minus_1.children[0], attr_lower).get_value_level()
-    if not is_empty_v3:
-        v3 = getattr(layout_cand.children[0], attr_lower).get_value_level()
-
-    # --- Constant ---
-    if rule.name == "Constant":
-        # 空 → 空 已在前面返回；现为至少 v2/v3 非空
-        if not is_empty_v2 and not is_empty_v3:
-            return int(v3 == v2)
-        return 0
+    def split(context_values, candidate_values):
+        # panel_t-2 and panel_t-1 as (..., 1, C), the candidates as (..., K, C)
+        return context_values[..., 0:1, :], context_values[..., 1:2, :], candidate_values
+
+    def select(features, name, attr):
+        # the column of the attribute of each rule in an entity feature
+        index = (attr - RULE_ATTRS.index(ENTITY_ATTRS[0]))[..., np.newaxis]
+        values = features[name]
+        return np.take_along_axis(values, np.broadcast_to(index, values.shape[:-1] + (1,)), axis=-1)[..., 0]
+
+    # (..., 1, C, R), the rules of every component
+    name, attr, value = (rules[key][..., np.newaxis, :, :] for key in ("name", "attr", "value"))
+    scores = _num_pos_scores(name[..., 0], attr[..., 0], value[..., 0],
+                             *split(context["number"], candidates["number"]) +
+                             split(context["positions"], candidates["positions"]) +
+                             (candidates["slots"],)).astype(np.int64)
+    empty = split(context["empty"], candidates["empty"])
+    for j in range(1, name.shape[-1]):
+        scores += _entity_scores(name[..., j], attr[..., j], value[..., j], *empty +
+                                 split(select(context, "consistent", attr[..., j]),
+                                       select(candidates, "consistent", attr[..., j])) +
+                                 split(select(context, "level", attr[..., j]),
+                                       select(candidates, "level", attr[..., j])))
+    return scores.sum(axis=-1)
 
-    # --- Progression ---
-    elif rule.name == "Progression":
-        if not (is_empty_v1 or is_empty_v2 or is_empty_v3):
-            return int((v2 - v1) == (v3 - v2) == rule.value)
-        return 0
-
-    # --- Arithmetic ---
-    elif rule.name == "Arithmetic":
-        # 处理因空引起的边界情况
-        if rule.value > 0:
-            # 加法：Color 无偏置，其它 +1 偏置
-            if is_empty_v1 and is_empty_v2 and not is_empty_v3:
-                # 0+0 不产生明确信号，判 0
-                return 0
-            if not (is_empty_v1 or is_empty_v2 or is_empty_v3):
-                expected_v3 = (v1 + v2) if attr == "Color" else (v1 + v2 + 1)
-                return int(v3 == expected_v3)
-        else:
-            # 减法：Color 无偏置，其它 (v1 - v2 - 1) 的绝对值
-            if not (is_empty_v1 or is_empty_v2) and is_empty_v3:
-                # 例如 5-5 → 0（空）
-                return 1
-            if not (is_empty_v1 or is_empty_v2 or is_empty_v3):
-                expected_v3 = (v1 - v2) if attr == "Color" else (v1 - v2 - 1)
-                return int(v3 == abs(expected_v3))
-        return 0
-
-    # --- Distribute_Three ---
-    elif rule.name == "Distribute_Three":
-        if not (is_empty_v1 or is_empty_v2 or is_empty_v3):
-            return int(v1 != v2 and v1 != v3 and v2 != v3)
-        return 0
-
-    return 0
 
 def solve_with_scores(rule_groups, context, candidates):
     """
     返回每个候选的得分，并给出是否“有且仅有一个最高分”。
     用于生成阶段强制唯一解：max>0 且 top-1 唯一。
+    Arguments:
+        rule_groups(list of list of Rule): 最后一列 (t=n) 的规则
+        context(list of Root or PanelState): 最后一步所需的上下文 [panel_t-2, panel_t-1]
+        candidates(list of Root or PanelState): 候选答案
     """
-    scores = []
-    for cand in candidates:
-        s = 0
-        for component_idx, rule_group in enumerate(rule_groups):
-            rule_num_pos = rule_group[0]
-            s += check_num_pos(rule_num_pos, context, cand)
-            for entity_rule in rule_group[1:]:
-                s += check_entity(entity_rule, context, cand)
-        scores.append(s)
-    scores = np.array(scores)
+    if len(context) < 2:
+        # 上下文不足，无法进行 2-arity 检查，所有规则都不满足
+        scores = np.zeros(len(candidates), np.int64)
+    else:
+        scores = score_features(rule_features(rule_groups), panel_features(context[:2]), panel_features(candidates))
     n_top = np.count_nonzero(scores == scores.max())
     ok = (scores.max() > 0) and (n_top == 1)
     return scores, ok
 
-def check_consistency(layout, attr):
-    """检查一个布局内的所有实体是否在某个属性上值都相同"""
-    if not layout.children:
-        return True  # 空布局被认为是“一致的”
 
-    attr_name = attr.lower()
-    first_val = getattr(layout.children[0], attr_name).get_value_level()
-    for entity in layout.children[1:]:
-        if getattr(entity, attr_name).get_value_level() != first_val:
-            return False
-    return True
\ No newline at end of file
+def solve(rng, rule_groups, context, candidates):
+    """
+    Search-based Heuristic Solver (Corrected Reverse-Check Strategy).
+
+    Arguments:
+        rng(numpy.random.Generator): 用于平局时随机选择
+        rule_groups(list of list of Rule): 最后一列 (t=n) 的规则
+        context(list of Root or PanelState): 最后一步所需的上下文 [panel_t-2, panel_t-1]
+        candidates(list of Root or PanelState): 8个候选答案
+    Returns:
+        ans(int): index of the correct answer in the candidates
+    """
+    satisfied, _ = solve_with_scores(rule_groups, context, candidates)
+
+    max_score = np.max(satisfied)
+
+    # 检查是否有规则被应用（score > 0）。如果没有，随机猜测。
+    # 并且，检查最高分是否*唯一*。如果多个候选得到满分（理论上不应发生），随机选一个。
+    if max_score == 0:
+        return rng.choice(len(candidates))
+
+    # 找到所有获得最高分的候选
+    answer_set = np.where(satisfied == max_score)[0]
+
+    # 从最高分中随机选一个（通常只有一个）
+    return rng.choice(answer_set)
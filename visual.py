@@ -15,6 +15,8 @@ import glob
 import random
 import xml.etree.ElementTree as ET
 
+from image_codec import decode_image
+
 # 默认的配置（子目录）列表
 DEFAULT_CONFIGS = [
     "center_single",
@@ -124,7 +126,7 @@ def visualize_npz(npz_file_path, save_dir):
     # --- 加载数据 ---
     try:
         data = np.load(npz_file_path)
-        img = data['image']
+        img = decode_image(data)
         target = int(data['target'])
     except FileNotFoundError:
         print(f"Error: wrong path -> {npz_file_path}")
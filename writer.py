@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+
+import os
+import queue
+import threading
+
+import numpy as np
+
+import metrics
+
+
+# none: leave the data to the page cache; file: fsync every file of a sample before moving it
+# into place; batch: fsync the files of a whole batch, then their folders once
+FSYNC_POLICIES = ["none", "file", "batch"]
+# buffer of the files written, large enough to hold most of an image stack
+WRITE_BUFFER = 1 << 20
+
+
+def write_sample_files(npz_path, xml_path, arrays, xml):
+    """Write the .npz and .xml of a sample to temporary files, the .xml only if xml is not None.
+    Returns:
+        renames(list of tuple): (temporary, final) paths, see finish_writes
+    """
+    with open(npz_path + ".tmp", "wb", buffering=WRITE_BUFFER) as f:
+        np.savez(f, **arrays)
+    renames = [(npz_path + ".tmp", npz_path)]
+    if xml is not None:
+        with open(xml_path + ".tmp", "wb") as f:
+            f.write(xml)
+        renames.append((xml_path + ".tmp", xml_path))
+    return renames
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def finish_writes(renames, fsync="none"):
+    """Move written files into place, so that an interrupted run never leaves a truncated
+    sample, after syncing them to disk as the fsync policy asks.
+    Arguments:
+        renames(list of list of tuple): the (temporary, final) paths of each write task, None
+            for a task that has nothing to move
+        fsync(str): one of FSYNC_POLICIES
+    """
+    renames = [task_renames for task_renames in renames if task_renames]
+    if fsync == "none":
+        for task_renames in renames:
+            for tmp_path, path in task_renames:
+                os.replace(tmp_path, path)
+        return
+    folders = set()
+    if fsync == "batch":
+        for task_renames in renames:
+            for tmp_path, _ in task_renames:
+                _fsync_path(tmp_path)
+    for task_renames in renames:
+        for tmp_path, path in task_renames:
+            if fsync == "file":
+                _fsync_path(tmp_path)
+            os.replace(tmp_path, path)
+            folders.add(os.path.dirname(path) or ".")
+    # the renames themselves are only durable once their folders are synced
+    for folder in sorted(folders):
+        _fsync_path(folder)
+
+
+class WriteBehind:
+    """Write the samples behind their generation: the sample loop submits write tasks to a
+    bounded queue and a thread drains it, batch_size tasks at a time. A full queue blocks the
+    sample loop, so at most max_pending samples are held in memory.
+    Whether the run is disk-bound or CPU-bound shows in the metrics: the time the sample loop
+    waits on a full queue (write_wait_seconds) against the time the writer waits for work
+    (writer_idle_seconds), and the peak number of queued samples (write_queue_depth_max).
+    """
+
+    def __init__(self, max_pending=16, batch_size=8, fsync="none"):
+        assert fsync in FSYNC_POLICIES
+        self.queue = queue.Queue(max_pending)
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def submit(self, function, *args):
+        """Queue the write task function(*args), which writes temporary files and returns
+        their renames, see write_sample_files. Raises the error of a failed task if any.
+        """
+        self._check()
+        if self.queue.full():
+            metrics.count("write_queue_full")
+        metrics.gauge("write_queue_depth_max", self.queue.qsize())
+        started = metrics.start()
+        self.queue.put((function, args))
+        metrics.stop("write_wait_seconds", started)
+
+    def _run(self):
+        while True:
+            started = metrics.start()
+            batch = [self.queue.get()]
+            metrics.stop("writer_idle_seconds", started)
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            tasks = [task for task in batch if task is not None]
+            if tasks and self.error is None:
+                started = metrics.start()
+                try:
+                    finish_writes([function(*args) for function, args in tasks], self.fsync)
+                except Exception as error:
+                    # the tasks left are dropped, the error is raised in the sample loop
+                    self.error = error
+                metrics.stop("write_batch_seconds", started)
+                metrics.count("write_batches")
+                metrics.count("written_tasks", len(tasks))
+            for _ in batch:
+                self.queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("write-behind failed") from self.error
+
+    def flush(self):
+        """Wait until every queued task is written."""
+        self.queue.join()
+        self._check()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+
+# write-behind writer of the current process, None to write in the sample loop
+_writer = None
+# fsync policy of the writes made in the sample loop
+_fsync = "none"
+
+
+def use_writer(writer=None, fsync="none"):
+    """Send the write tasks of the current process to writer, or run them in place with the
+    given fsync policy if writer is None.
+    """
+    global _writer, _fsync
+    _writer = writer
+    _fsync = fsync
+
+
+def write(function, *args):
+    """Run the write task function(*args), see WriteBehind.submit."""
+    if _writer is not None:
+        _writer.submit(function, *args)
+    else:
+        finish_writes([function(*args)], _fsync)
+
+
+def flush_writes():
+    if _writer is not None:
+        _writer.flush()